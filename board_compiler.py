@@ -0,0 +1,231 @@
+import json
+from argparse import ArgumentParser
+
+import numpy as np
+
+# the river drawn by build_graph_gui.py, as the vertices of its piecewise linear function
+RIVER = [(0, 5.5), (2, 5.5), (4, 3.5), (5, 3.5), (6, 4.5), (9, 4.5)]
+
+
+def _orientation(p, q, r):
+    # vectorized version of orientation() in build_graph_gui.py: 0 collinear, 1 clockwise, 2 counterclockwise
+    val = (q[:, 1] - p[:, 1]) * (r[:, 0] - q[:, 0]) - (q[:, 0] - p[:, 0]) * (
+        r[:, 1] - q[:, 1]
+    )
+    return np.where(val == 0, 0, np.where(val > 0, 1, 2))
+
+
+def _on_segment(p, q, r):
+    # check if q lies on segment pr
+    return (
+        (np.minimum(p[:, 0], r[:, 0]) <= q[:, 0])
+        & (q[:, 0] <= np.maximum(p[:, 0], r[:, 0]))
+        & (np.minimum(p[:, 1], r[:, 1]) <= q[:, 1])
+        & (q[:, 1] <= np.maximum(p[:, 1], r[:, 1]))
+    )
+
+
+def _same(a, b):
+    return (a[:, 0] == b[:, 0]) & (a[:, 1] == b[:, 1])
+
+
+def segments_intersect(p1, q1, p2, q2):
+    # this is do_segments_intersect from build_graph_gui.py applied to arrays of segments.
+    # every argument is an (n, 2) array and the result is an (n,) boolean array.
+    # the cases are checked in the same order so that endpoint and collinear edge cases match exactly.
+    o1 = _orientation(p1, q1, p2)
+    o2 = _orientation(p1, q1, q2)
+    o3 = _orientation(p2, q2, p1)
+    o4 = _orientation(p2, q2, q1)
+
+    p1_shared = _same(p1, p2) | _same(p1, q2)
+    q1_shared = _same(q1, p2) | _same(q1, q2)
+    p2_shared = _same(p2, p1) | _same(p2, q1)
+    q2_shared = _same(q2, p1) | _same(q2, q1)
+
+    conditions = [
+        # general case, excluding intersections at endpoints
+        (o1 != o2) & (o3 != o4),
+        # collinear cases
+        (o1 == 0) & _on_segment(p1, p2, q1),
+        (o2 == 0) & _on_segment(p1, q2, q1),
+        (o3 == 0) & _on_segment(p2, p1, q2),
+        (o4 == 0) & _on_segment(p2, q1, q2),
+    ]
+    choices = [
+        ~(p1_shared | q1_shared),
+        ~p2_shared,
+        ~q2_shared,
+        ~p1_shared,
+        ~q1_shared,
+    ]
+    return np.select(conditions, choices, default=False)
+
+
+def _candidate_pairs(starts, ends, cell_size=None):
+    # grid broad phase: every segment is put in each cell its bounding box touches,
+    # and only segments that share a cell and have overlapping bounding boxes are tested
+    num_segments = len(starts)
+    if num_segments < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    lo = np.minimum(starts, ends)
+    hi = np.maximum(starts, ends)
+    if cell_size is None:
+        extent = (hi - lo).max(axis=1)
+        cell_size = extent[extent > 0].mean() if np.any(extent > 0) else 1.0
+    origin = lo.min(axis=0)
+    cell_lo = np.floor((lo - origin) / cell_size).astype(np.int64)
+    cell_hi = np.floor((hi - origin) / cell_size).astype(np.int64)
+    span = cell_hi - cell_lo + 1
+    grid_width = cell_hi[:, 0].max() + 1
+
+    # expand every segment into the cells it covers
+    cells_per_segment = span[:, 0] * span[:, 1]
+    segment_ids = np.repeat(np.arange(num_segments), cells_per_segment)
+    offsets = np.arange(len(segment_ids)) - np.repeat(
+        np.cumsum(cells_per_segment) - cells_per_segment, cells_per_segment
+    )
+    cell_x = cell_lo[segment_ids, 0] + offsets % span[segment_ids, 0]
+    cell_y = cell_lo[segment_ids, 1] + offsets // span[segment_ids, 0]
+    cell_ids = cell_y * grid_width + cell_x
+
+    order = np.argsort(cell_ids, kind="stable")
+    cell_ids = cell_ids[order]
+    segment_ids = segment_ids[order]
+
+    # pair every entry with the entries after it in the same cell
+    positions = np.arange(len(cell_ids))
+    group_starts = np.flatnonzero(np.r_[True, cell_ids[1:] != cell_ids[:-1]])
+    group_ends = np.r_[group_starts[1:], len(cell_ids)]
+    group_sizes = group_ends - group_starts
+    ends_of_entry = np.repeat(group_ends, group_sizes)
+    pairs_after = ends_of_entry - positions - 1
+    left = np.repeat(positions, pairs_after)
+    first_pair = np.repeat(np.cumsum(pairs_after) - pairs_after, pairs_after)
+    right = left + 1 + (np.arange(len(left)) - first_pair)
+
+    a = segment_ids[left]
+    b = segment_ids[right]
+    first = np.minimum(a, b)
+    second = np.maximum(a, b)
+    keys = np.unique(first[first != second] * num_segments + second[first != second])
+    first = keys // num_segments
+    second = keys % num_segments
+
+    overlap = np.all(lo[first] <= hi[second], axis=1) & np.all(
+        lo[second] <= hi[first], axis=1
+    )
+    return first[overlap], second[overlap]
+
+
+def find_intersections(starts, ends, cell_size=None):
+    # returns the (i, j) pairs with i < j of segments that block each other
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    first, second = _candidate_pairs(starts, ends, cell_size)
+    hits = segments_intersect(starts[first], ends[first], starts[second], ends[second])
+    return first[hits], second[hits]
+
+
+def find_river_crossings(starts, ends, river=RIVER, chunk_size=1 << 20):
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    river = np.asarray(river, dtype=np.float64)
+    river_starts = river[:-1]
+    river_ends = river[1:]
+    num_river = len(river_starts)
+    crosses = np.zeros(len(starts), dtype=bool)
+    if num_river == 0:
+        return crosses
+    # test every edge against every river segment, a chunk of edges at a time to bound memory
+    step = max(1, chunk_size // num_river)
+    for begin in range(0, len(starts), step):
+        stop = min(begin + step, len(starts))
+        count = stop - begin
+        hits = segments_intersect(
+            np.repeat(starts[begin:stop], num_river, axis=0),
+            np.repeat(ends[begin:stop], num_river, axis=0),
+            np.tile(river_starts, (count, 1)),
+            np.tile(river_ends, (count, 1)),
+        )
+        crosses[begin:stop] = hits.reshape(count, num_river).any(axis=1)
+    return crosses
+
+
+def compile_board(board, cell_size=None):
+    nodes = board["nodes"]
+    river = board.get("river", RIVER)
+    lookup = {tuple(node["xy"]): i for i, node in enumerate(nodes)}
+
+    endpoints = []
+    for edge in board["edges"]:
+        if isinstance(edge, dict):
+            pair = (edge["node1"], edge["node2"])
+        else:
+            pair = tuple(edge)
+        # edges can refer to nodes by index or by a full node dictionary like the ones save_graph writes
+        indices = []
+        for endpoint in pair:
+            if isinstance(endpoint, dict):
+                if tuple(endpoint["xy"]) not in lookup:
+                    raise ValueError(f"Edge endpoint {endpoint} is not a board node")
+                indices.append(lookup[tuple(endpoint["xy"])])
+            else:
+                indices.append(int(endpoint))
+        endpoints.append(indices)
+    endpoints = np.asarray(endpoints, dtype=np.int64).reshape(-1, 2)
+
+    xy = np.asarray([node["xy"] for node in nodes], dtype=np.float64).reshape(-1, 2)
+    starts = xy[endpoints[:, 0]]
+    ends = xy[endpoints[:, 1]]
+
+    first, second = find_intersections(starts, ends, cell_size)
+    crosses_river = find_river_crossings(starts, ends, river)
+
+    blocks_edges = [[] for _ in range(len(endpoints))]
+    for i, j in zip(first.tolist(), second.tolist()):
+        blocks_edges[i].append(j)
+        blocks_edges[j].append(i)
+
+    edges = []
+    for k, (i, j) in enumerate(endpoints.tolist()):
+        edges.append(
+            {
+                "node1": nodes[i],
+                "node2": nodes[j],
+                "blocks_edges": sorted(blocks_edges[k]),
+                "blocked": False,
+                "crosses_river": bool(crosses_river[k]),
+            }
+        )
+    graph_data = {"nodes": nodes, "edges": edges}
+    # anything else on the board (river, scale) is passed through untouched
+    for key, value in board.items():
+        if key not in graph_data:
+            graph_data[key] = value
+    return graph_data
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("board", help="Board file with nodes and edges")
+    parser.add_argument(
+        "--output", "-o", default="london_system_compiled.json", help="Output file"
+    )
+    parser.add_argument(
+        "--cell-size", type=float, default=None, help="Broad phase grid cell size"
+    )
+    args = parser.parse_args()
+
+    with open(args.board, "r") as file:
+        board = json.load(file)
+    graph_data = compile_board(board, args.cell_size)
+    with open(args.output, "w") as file:
+        json.dump(graph_data, file)
+
+    num_blocking = sum(len(edge["blocks_edges"]) for edge in graph_data["edges"]) // 2
+    num_river = sum(edge["crosses_river"] for edge in graph_data["edges"])
+    print(
+        f"Compiled {len(graph_data['edges'])} edges: {num_blocking} crossings, {num_river} river crossings"
+    )
+    print(f"Graph saved to {args.output}")
@@ -0,0 +1,152 @@
+import json
+import math
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board_compiler import compile_board
+from graph import CardType, NodeLocation
+
+NODE_TYPES = [
+    CardType.CIRCLE,
+    CardType.TRIANGLE,
+    CardType.SQUARE,
+    CardType.PENTAGON,
+    CardType.RANDOM,
+]
+# the default board has one random node in 53, the other shapes share the rest evenly
+NODE_TYPE_WEIGHTS = [0.245, 0.245, 0.245, 0.245, 0.02]
+
+# every color starts in the same area it does on the default board
+START_LOCATIONS = {
+    "red": NodeLocation.MIDDLE_RIGHT,
+    "blue": NodeLocation.BOTTOM_MIDDLE,
+    "green": NodeLocation.TOP_MIDDLE,
+    "purple": NodeLocation.MIDDLE_LEFT,
+}
+
+# lattice offsets that can become edges, each undirected pair is only listed once.
+# longer straight offsets are left out so that no edge runs through another node.
+EDGE_OFFSETS = [(1, 0), (0, 1), (1, 1), (1, -1), (2, 1), (1, 2), (2, -1), (1, -2)]
+
+
+def board_location(x, y):
+    # x and y are in default board coordinates, the boundaries are the ones drawn by draw_boundaries in game.py
+    if x < 0.5 and y > 8.5:
+        return NodeLocation.TOP_LEFT_SMALL
+    if x > 8.5 and y > 8.5:
+        return NodeLocation.TOP_RIGHT_SMALL
+    if x < 0.5 and y < 0.5:
+        return NodeLocation.BOTTOM_LEFT_SMALL
+    if x > 8.5 and y < 0.5:
+        return NodeLocation.BOTTOM_RIGHT_SMALL
+    row = "TOP" if y > 6.5 else "MIDDLE" if y > 2.5 else "BOTTOM"
+    column = "LEFT" if x < 2.5 else "MIDDLE" if x < 6.5 else "RIGHT"
+    if row == "MIDDLE" or column == "MIDDLE":
+        return NodeLocation[f"{row}_{column}"]
+    return NodeLocation[f"{row}_{column}_LARGE"]
+
+
+def generate_river(side, rng):
+    # the river runs left to right through the middle of the board. vertices sit on half integer
+    # coordinates two columns apart, so the river never passes through a lattice node.
+    y = side // 2 - 0.5
+    river = [[-0.5, y]]
+    for x in np.arange(1.5, side, 2.0):
+        # drift back towards the middle so the river doesn't wander off the board
+        pull = min(max((side / 2 - 0.5 - y) / side, -0.25), 0.25)
+        y += rng.choice([-1, 0, 1], p=[0.3 - pull, 0.4, 0.3 + pull])
+        y = min(max(y, 1.5), side - 2.5)
+        river.append([float(x), float(y)])
+    return river
+
+
+def generate_board(num_nodes=530, seed=0, degree=4.0, tourist_fraction=0.1):
+    rng = np.random.default_rng(seed)
+    # the board is a square lattice scale times the size of the default 10x10 board, about half occupied
+    scale = max(1, math.ceil(math.sqrt(num_nodes / 53)))
+    side = 10 * scale
+    num_nodes = min(num_nodes, side * side)
+
+    cells = np.sort(rng.choice(side * side, size=num_nodes, replace=False))
+    xs = cells % side
+    ys = cells // side
+    base_x = (xs + 0.5) / scale - 0.5
+    base_y = (ys + 0.5) / scale - 0.5
+    locations = [board_location(x, y) for x, y in zip(base_x, base_y)]
+    types = rng.choice(len(NODE_TYPES), size=num_nodes, p=NODE_TYPE_WEIGHTS)
+    tourist = rng.random(num_nodes) < tourist_fraction
+
+    nodes = []
+    for i in range(num_nodes):
+        nodes.append(
+            {
+                "type": NODE_TYPES[types[i]].name,
+                "tourist": bool(tourist[i]),
+                "location": locations[i].name,
+                "xy": [int(xs[i]), int(ys[i])],
+                "start": False,
+                "color": None,
+            }
+        )
+
+    for color, location in START_LOCATIONS.items():
+        candidates = [
+            i
+            for i, node in enumerate(nodes)
+            if locations[i] == location
+            and not node["tourist"]
+            and not node["start"]
+            and node["type"] != CardType.RANDOM.name
+        ]
+        if not candidates:
+            candidates = [i for i, node in enumerate(nodes) if not node["start"]]
+        start = candidates[rng.integers(len(candidates))]
+        nodes[start]["start"] = True
+        nodes[start]["color"] = color
+
+    # connect neighbouring lattice nodes, keeping each candidate with a probability that gives the requested mean degree
+    index = np.full(side * side, -1, dtype=np.int64)
+    index[cells] = np.arange(num_nodes)
+    keep_probability = min(
+        1.0, degree * side * side / (2 * len(EDGE_OFFSETS) * num_nodes)
+    )
+    edges = []
+    for dx, dy in EDGE_OFFSETS:
+        nx = xs + dx
+        ny = ys + dy
+        inside = (nx >= 0) & (nx < side) & (ny >= 0) & (ny < side)
+        other = np.full(num_nodes, -1, dtype=np.int64)
+        other[inside] = index[ny[inside] * side + nx[inside]]
+        chosen = (other >= 0) & (rng.random(num_nodes) < keep_probability)
+        edges.extend(zip(np.flatnonzero(chosen).tolist(), other[chosen].tolist()))
+    edges.sort()
+
+    board = {
+        "nodes": nodes,
+        "edges": [list(edge) for edge in edges],
+        "river": generate_river(side, rng),
+        "scale": scale,
+    }
+    return compile_board(board)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--nodes", "-n", type=int, default=530, help="Number of nodes")
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--degree", type=float, default=4.0, help="Mean number of edges per node"
+    )
+    parser.add_argument(
+        "--output", "-o", default="london_system_generated.json", help="Output file"
+    )
+    args = parser.parse_args()
+
+    graph_data = generate_board(args.nodes, args.seed, args.degree)
+    with open(args.output, "w") as file:
+        json.dump(graph_data, file)
+    print(
+        f"Generated {len(graph_data['nodes'])} nodes and {len(graph_data['edges'])} edges"
+    )
+    print(f"Graph saved to {args.output}")
@@ -0,0 +1,37 @@
+import numpy as np
+
+# the outline of the board shared by the gui and the headless renderers, in the coordinates of the default
+# board. nothing here needs matplotlib or a display.
+
+# the river on the default board, as the vertices of the piecewise linear function it used to be drawn from
+DEFAULT_RIVER = [(-0.5, 5.5), (2, 5.5), (4, 3.5), (5, 3.5), (6, 4.5), (9.5, 4.5)]
+
+BOUNDARIES = [
+    # draw outline around board
+    ([-0.5, -0.5], [-0.5, 9.7]),
+    ([-0.5, 9.5], [-0.5, -0.5]),
+    ([9.5, 9.5], [9.7, -0.5]),
+    ([9.5, -0.5], [9.7, 9.7]),
+    # draw top left corner line
+    ([-0.5, 0.5], [8.5, 8.5]),
+    ([0.5, 0.5], [8.5, 9.7]),
+    # draw top right corner line
+    ([9.5, 8.5], [8.5, 8.5]),
+    ([8.5, 8.5], [8.5, 9.7]),
+    # draw bottom left corner line
+    ([-0.5, 0.5], [0.5, 0.5]),
+    ([0.5, 0.5], [0.5, -0.5]),
+    # draw bottom right corner line
+    ([9.5, 8.5], [0.5, 0.5]),
+    ([8.5, 8.5], [0.5, -0.5]),
+    # draw inner boundaries
+    ([-0.5, 9.5], [6.5, 6.5]),
+    ([-0.5, 9.5], [2.5, 2.5]),
+    ([2.5, 2.5], [-0.5, 9.7]),
+    ([6.5, 6.5], [-0.5, 9.7]),
+]
+
+
+def to_board(values, scale):
+    # generated boards are scale times larger than the default board, with nodes on integer coordinates
+    return (np.asarray(values, dtype=float) + 0.5) * scale - 0.5
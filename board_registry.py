@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+import numpy as np
+
+from board_tables import BoardTables
+from graph import CardType, Edge, Graph, Node, NodeLocation
+from london_system import LondonSystem
+
+# a rough size of one node or edge of a loaded Graph with its index, measured with tracemalloc
+GRAPH_BYTES_PER_ITEM = 640
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def content_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def node_arrays(graph):
+    # the node attributes BoardTables doesn't keep, so a graph can be built from the compiled arrays alone
+    colors = sorted({node.color for node in graph.nodes if node.color is not None})
+    node_color = np.array(
+        [
+            colors.index(node.color) if node.color is not None else -1
+            for node in graph.nodes
+        ],
+        dtype=np.int8,
+    )
+    node_start = np.array([bool(node.start) for node in graph.nodes], dtype=bool)
+    return colors, node_color, node_start
+
+
+def build_graph(tables, colors, node_color, node_start, river=None, scale=1):
+    # the same graph load_graph_data builds, without going through json. edges share the node objects.
+    card_types = {card_type.value: card_type for card_type in CardType}
+    locations = list(NodeLocation)
+    xy = tables.xy.tolist()
+    if all(value == int(value) for point in xy for value in point):
+        xy = [[int(x), int(y)] for x, y in xy]
+    graph = Graph()
+    for i, (node_type, location, tourist, start, color) in enumerate(
+        zip(
+            tables.node_type.tolist(),
+            tables.location.tolist(),
+            tables.tourist.tolist(),
+            node_start.tolist(),
+            node_color.tolist(),
+        )
+    ):
+        graph.add_node(
+            Node(
+                type=card_types[node_type],
+                tourist=tourist,
+                location=locations[location],
+                xy=xy[i],
+                start=start,
+                color=colors[color] if color >= 0 else None,
+            )
+        )
+    indptr = tables.blocks_indptr.tolist()
+    indices = tables.blocks_indices.tolist()
+    for i, ((a, b), crosses_river) in enumerate(
+        zip(tables.edge_nodes.tolist(), tables.crosses_river.tolist())
+    ):
+        graph.add_edge(
+            Edge(
+                graph.nodes[a],
+                graph.nodes[b],
+                blocks_edges=indices[indptr[i] : indptr[i + 1]],
+                crosses_river=crosses_river,
+            )
+        )
+    graph.river = river
+    graph.scale = scale
+    return graph
+
+
+class BoardEntry:
+    # graph is the board as loaded and is never played on. every game gets its own graph built from the tables.
+    def __init__(self, key, graph, tables):
+        self.key = key
+        self.graph = graph
+        self.tables = tables
+        self.node_arrays = node_arrays(graph)
+        self.nbytes = tables.nbytes + GRAPH_BYTES_PER_ITEM * (
+            len(graph.nodes) + len(graph.edges)
+        )
+
+    def new_game(self):
+        london_system = LondonSystem()
+        london_system.verbose = False
+        london_system.graph = build_graph(
+            self.tables, *self.node_arrays, self.graph.river, self.graph.scale
+        )
+        return london_system
+
+
+# boards are loaded the first time they are asked for and kept by the hash of their file contents, so the same
+# board under two names is loaded once and an edited file is loaded again. the least recently used boards are
+# dropped when the total goes over max_bytes. with a cache_dir the compiled arrays are written there once, and
+# every process using the same directory maps the same files read only and builds its graph from them.
+class BoardRegistry:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        # file hashes by path, size and modification time so a lookup doesn't read the whole file
+        self.hashes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, filename):
+        return self.key(filename) in self.entries
+
+    def key(self, filename):
+        stat = os.stat(filename)
+        path_key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        if path_key not in self.hashes:
+            self.hashes[path_key] = content_hash(filename)
+        return self.hashes[path_key]
+
+    def get(self, filename):
+        key = self.key(filename)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        entry = self.load(key, filename)
+        self.entries[key] = entry
+        self.nbytes += entry.nbytes
+        self.evict()
+        return entry
+
+    # a new game on a board. games share the board's tables but not its graph, so they can be played side by side
+    def london_system(self, filename):
+        return self.get(filename).new_game()
+
+    def tables(self, filename):
+        return self.get(filename).tables
+
+    def evict(self):
+        # the newest board is always kept, even if it is bigger than max_bytes on its own
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= entry.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def load(self, key, filename):
+        directory = None
+        if self.cache_dir is not None:
+            directory = os.path.join(self.cache_dir, key)
+            if os.path.exists(os.path.join(directory, "board.json")):
+                return self.load_compiled(key, directory)
+
+        london_system = LondonSystem()
+        london_system.verbose = False
+        london_system.load_graph(filename)
+        tables = BoardTables(london_system.graph)
+        if directory is not None:
+            self.save_compiled(directory, london_system.graph, tables)
+        return BoardEntry(key, london_system.graph, tables)
+
+    def save_compiled(self, directory, graph, tables):
+        # written to a temporary directory and renamed, so other processes never see half a board
+        os.makedirs(self.cache_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            tables.save(staging)
+            colors, node_color, node_start = node_arrays(graph)
+            np.save(os.path.join(staging, "node_color.npy"), node_color)
+            np.save(os.path.join(staging, "node_start.npy"), node_start)
+            with open(os.path.join(staging, "board.json"), "w") as file:
+                json.dump(
+                    {"colors": colors, "river": graph.river, "scale": graph.scale}, file
+                )
+            os.replace(staging, directory)
+        except OSError:
+            # another process got there first
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def load_compiled(self, key, directory):
+        tables = BoardTables.load(directory)
+        with open(os.path.join(directory, "board.json")) as file:
+            meta = json.load(file)
+        graph = build_graph(
+            tables,
+            meta["colors"],
+            np.load(os.path.join(directory, "node_color.npy")),
+            np.load(os.path.join(directory, "node_start.npy")),
+            meta["river"],
+            meta["scale"],
+        )
+        return BoardEntry(key, graph, tables)
+
+
+# one registry per process, for code that just wants a board by file name
+registry = BoardRegistry(cache_dir=os.environ.get("LONDON_SYSTEM_BOARD_CACHE"))
+
+
+def get_board(filename):
+    return registry.london_system(filename)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("boards", nargs="+", help="Board files to switch between")
+    parser.add_argument("--episodes", type=int, default=200, help="Episodes to time")
+    parser.add_argument("--cache-dir", help="Directory for compiled boards")
+    parser.add_argument(
+        "--max-mb", type=float, default=512, help="Memory cap of the registry in MB"
+    )
+    args = parser.parse_args()
+
+    def timed(load):
+        started = time.perf_counter()
+        for episode in range(args.episodes):
+            london_system = load(args.boards[episode % len(args.boards)])
+            london_system.start_game()
+        return (time.perf_counter() - started) / args.episodes
+
+    def load_graph(filename):
+        london_system = LondonSystem()
+        london_system.verbose = False
+        london_system.load_graph(filename)
+        return london_system
+
+    board_registry = BoardRegistry(int(args.max_mb * 1024 * 1024), args.cache_dir)
+    print(f"load_graph every episode: {1000 * timed(load_graph):.3f}ms per switch")
+    print(
+        f"Registry: {1000 * timed(board_registry.london_system):.3f}ms per switch, "
+        f"{board_registry.hits} hits, {board_registry.misses} misses, "
+        f"{len(board_registry)} boards in {board_registry.nbytes / 1e6:.1f}MB"
+    )
+    if args.cache_dir:
+        board_registry.clear()
+        started = time.perf_counter()
+        for filename in args.boards:
+            board_registry.get(filename)
+        print(
+            f"Building every board from the compiled cache: {1000 * (time.perf_counter() - started):.1f}ms"
+        )
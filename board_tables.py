@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+
+from graph import CardType, NodeLocation, node_key
+from london_system import COLORS
+
+# the arrays save and load write, every other attribute follows from them
+ARRAYS = [
+    "xy",
+    "node_type",
+    "location",
+    "tourist",
+    "start",
+    "edge_nodes",
+    "crosses_river",
+    "first_edge",
+    "blocks_indptr",
+    "blocks_indices",
+    "incident_indptr",
+    "incident_edges",
+    "incident_other",
+]
+
+
+# flat numpy tables describing one board: node attributes, edge endpoints, crossings and river flags,
+# and the incident edges of every node in compressed sparse row form. they never change during a game.
+class BoardTables:
+    def __init__(self, graph):
+        graph.ensure_index()
+        self.num_nodes = len(graph.nodes)
+        self.num_edges = len(graph.edges)
+        self.num_locations = len(NodeLocation)
+
+        self.xy = np.array([node.xy for node in graph.nodes], dtype=float).reshape(
+            -1, 2
+        )
+        self.node_type = np.array(
+            [node.type.value for node in graph.nodes], dtype=np.int8
+        )
+        self.location = np.array(
+            [node.location.value - 1 for node in graph.nodes], dtype=np.int8
+        )
+        self.tourist = np.array(
+            [bool(node.tourist) for node in graph.nodes], dtype=bool
+        )
+        self.start = np.full(len(COLORS), -1, dtype=np.int32)
+        for i, node in enumerate(graph.nodes):
+            if (
+                node.start
+                and node.color in COLORS
+                and self.start[COLORS.index(node.color)] < 0
+            ):
+                self.start[COLORS.index(node.color)] = i
+
+        self.edge_nodes = np.array(
+            [
+                [
+                    graph.node_index[node_key(edge.node1)],
+                    graph.node_index[node_key(edge.node2)],
+                ]
+                for edge in graph.edges
+            ],
+            dtype=np.int32,
+        ).reshape(-1, 2)
+        self.crosses_river = np.array(
+            [bool(edge.crosses_river) for edge in graph.edges], dtype=bool
+        )
+        # the edge get_edge would return for each edge's endpoints, so duplicates can be told apart
+        self.first_edge = np.array(
+            [
+                graph.edge_lookup[(node_key(e.node1), node_key(e.node2))]
+                for e in graph.edges
+            ],
+            dtype=np.int32,
+        )
+
+        blocks = [sorted(set(edge.blocks_edges)) for edge in graph.edges]
+        self.blocks_indptr = np.zeros(self.num_edges + 1, dtype=np.int64)
+        self.blocks_indptr[1:] = np.cumsum([len(b) for b in blocks])
+        self.blocks_indices = np.array([j for b in blocks for j in b], dtype=np.int32)
+
+        # incident edges of every node, in edge order, with the node at the other end
+        incident_edges = []
+        incident_other = []
+        self.incident_indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        for i, node in enumerate(graph.nodes):
+            key = node_key(node)
+            for e in graph.incident.get(key, []):
+                a, b = self.edge_nodes[e]
+                incident_edges.append(e)
+                incident_other.append(b if a == i else a)
+            self.incident_indptr[i + 1] = len(incident_edges)
+        self.incident_edges = np.array(incident_edges, dtype=np.int32)
+        self.incident_other = np.array(incident_other, dtype=np.int32)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    # with mmap_mode="r" the arrays are read only views of the files, so processes loading the same directory
+    # share one copy of them through the page cache
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        tables = cls.__new__(cls)
+        for name in ARRAYS:
+            path = os.path.join(directory, f"{name}.npy")
+            setattr(tables, name, np.load(path, mmap_mode=mmap_mode))
+        tables.num_nodes = len(tables.node_type)
+        tables.num_edges = len(tables.edge_nodes)
+        tables.num_locations = len(NodeLocation)
+        return tables
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def incident(self, node):
+        begin, end = self.incident_indptr[node], self.incident_indptr[node + 1]
+        return self.incident_edges[begin:end], self.incident_other[begin:end]
+
+    def blocks(self, edge):
+        return self.blocks_indices[
+            self.blocks_indptr[edge] : self.blocks_indptr[edge + 1]
+        ]
+
+    def matches(self, card_type, node):
+        # the same type test as Graph.matches, on a node index and a CardType
+        node_type = self.node_type[node]
+        return (
+            node_type == card_type.value
+            or card_type == CardType.RANDOM
+            or node_type == CardType.RANDOM.value
+        )
+
+
+def track_indices(graph, color):
+    # the distinct nodes of a color track as node indices, in the order they were first visited
+    graph.ensure_index()
+    seen = {}
+    for node in graph.railroad_nodes[color]:
+        seen.setdefault(graph.node_index[node_key(node)], None)
+    return list(seen)
+
+
+def blocked_edges(graph):
+    return np.fromiter(
+        (edge.blocked for edge in graph.edges), dtype=bool, count=len(graph.edges)
+    )
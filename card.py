@@ -1,4 +1,51 @@
+from graph import CardType
+
+
+# there are only 11 different cards, so every game shares the same card objects. Card(type, color) returns the
+# one card for that type and color and cards can't be changed, which also makes copies and pickles keep them shared.
 class Card:
-    def __init__(self, type, color):
-        self.type = type
-        self.color = color
+    __slots__ = ("type", "color")
+    _cards = {}
+
+    def __new__(cls, type, color):
+        card = cls._cards.get((type, color))
+        if card is None:
+            card = super().__new__(cls)
+            object.__setattr__(card, "type", type)
+            object.__setattr__(card, "color", color)
+            cls._cards[(type, color)] = card
+        return card
+
+    def __setattr__(self, name, value):
+        raise AttributeError("cards are shared between games and can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError("cards are shared between games and can't be changed")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return Card, (self.type, self.color)
+
+    def __repr__(self):
+        return f"Card({self.type}, {self.color!r})"
+
+
+# the deck a color is played with, in the order it has always been dealt from
+DECK = (
+    Card(CardType.CIRCLE, "red"),
+    Card(CardType.CIRCLE, "blue"),
+    Card(CardType.TRIANGLE, "red"),
+    Card(CardType.TRIANGLE, "blue"),
+    Card(CardType.SQUARE, "red"),
+    Card(CardType.SQUARE, "blue"),
+    Card(CardType.PENTAGON, "red"),
+    Card(CardType.PENTAGON, "blue"),
+    Card(CardType.RANDOM, "red"),
+    Card(CardType.RANDOM, "blue"),
+    Card(CardType.RAILROAD, None),
+)
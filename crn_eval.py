@@ -0,0 +1,156 @@
+import importlib
+import json
+import math
+import random
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from hindsight_oracle import deal_for_seed, deal_from_json, deal_json, play_deal
+from london_system import LondonSystem
+from rollout import greedy_policy, random_policy
+
+POLICIES = {"random": random_policy, "greedy": greedy_policy}
+
+# two sided 95% normal quantile
+Z_95 = 1.959963984540054
+
+
+# policies are compared on common random numbers: every policy plays the same stored deals (color order and
+# the cards drawn in every round, see hindsight_oracle.deal_for_seed) and a policy's own random choices are
+# seeded per deal too. the part of the luck of the draw that both policies feel the same way cancels out of the
+# per deal score differences. how much that is depends on how closely the two policies' scores track each other:
+# greedy against random on generated 53 node boards needs 1.5 to 3.6 times fewer deals than independent games,
+# not the order of magnitude that was hoped for. the deal itself (cards per round and per type) explains none of
+# the difference that is left, so it is no use as a control variate either.
+def make_schedule(london_system, seeds):
+    return [(seed, deal_for_seed(london_system, seed)) for seed in seeds]
+
+
+def save_schedule(filename, schedule):
+    with open(filename, "w") as file:
+        for seed, deal in schedule:
+            file.write(json.dumps({"seed": seed, "deal": deal_json(deal)}) + "\n")
+
+
+def load_schedule(filename):
+    with open(filename) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    return [(record["seed"], deal_from_json(record["deal"])) for record in records]
+
+
+def load_policy(name):
+    # a policy from POLICIES, or any module:function
+    if name in POLICIES:
+        return POLICIES[name]
+    module, _, function = name.partition(":")
+    if not function:
+        raise ValueError(
+            f"Unknown policy {name}, use one of {sorted(POLICIES)} or module:function"
+        )
+    return getattr(importlib.import_module(module), function)
+
+
+def evaluate(london_system, schedule, policy):
+    # the calculate_score total of every deal in the schedule
+    totals = np.empty(len(schedule))
+    for i, (seed, deal) in enumerate(schedule):
+        random.seed(seed)
+        totals[i] = sum(play_deal(london_system, deal, policy).values())
+    return totals
+
+
+def paired_statistics(totals, baseline):
+    # the mean difference of two policies on the same deals with its 95% interval. independent_games is how
+    # many deals each policy would need on its own random games for an interval as narrow, from the variances
+    # of the two score lists.
+    differences = totals - baseline
+    n = len(differences)
+    mean = float(differences.mean())
+    variance = float(differences.var(ddof=1)) if n > 1 else 0.0
+    stderr = math.sqrt(variance / n) if n else 0.0
+    independent_variance = (
+        float(totals.var(ddof=1) + baseline.var(ddof=1)) if n > 1 else 0.0
+    )
+    statistics = {
+        "games": n,
+        "mean": float(totals.mean()),
+        "baseline_mean": float(baseline.mean()),
+        "difference": mean,
+        "stderr": stderr,
+        "ci_low": mean - Z_95 * stderr,
+        "ci_high": mean + Z_95 * stderr,
+        # normal approximation of the two sided paired t test
+        "p_value": (
+            math.erfc(abs(mean) / stderr / math.sqrt(2))
+            if stderr > 0
+            else float(mean == 0)
+        ),
+        "correlation": (
+            float(np.corrcoef(totals, baseline)[0, 1]) if variance > 0 else 1.0
+        ),
+        "variance_reduction": (
+            independent_variance / variance if variance > 0 else float("inf")
+        ),
+    }
+    statistics["independent_games"] = (
+        math.ceil(n * statistics["variance_reduction"]) if variance > 0 else n
+    )
+    return statistics
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument(
+        "--policies",
+        nargs="+",
+        default=["random", "greedy"],
+        help="Policies to compare, the first is the baseline",
+    )
+    parser.add_argument("--seeds", type=int, default=500, help="Deals to play")
+    parser.add_argument("--first-seed", type=int, default=0, help="First seed")
+    parser.add_argument(
+        "--schedule",
+        help="Deal schedule file, read if it exists and written otherwise",
+    )
+    args = parser.parse_args()
+
+    london_system = LondonSystem()
+    london_system.verbose = False
+    london_system.load_graph(args.custom)
+    try:
+        schedule = load_schedule(args.schedule) if args.schedule else None
+    except FileNotFoundError:
+        schedule = None
+    if schedule is None:
+        seeds = range(args.first_seed, args.first_seed + args.seeds)
+        schedule = make_schedule(london_system, seeds)
+        if args.schedule:
+            save_schedule(args.schedule, schedule)
+    policies = {name: load_policy(name) for name in args.policies}
+
+    results = {}
+    for name, policy in policies.items():
+        started = time.perf_counter()
+        results[name] = evaluate(london_system, schedule, policy)
+        print(
+            f"{name}: mean {results[name].mean():.2f}, sd {results[name].std(ddof=1):.2f} "
+            f"over {len(schedule)} deals in {time.perf_counter() - started:.1f}s"
+        )
+    baseline_name = args.policies[0]
+    for name in args.policies[1:]:
+        statistics = paired_statistics(results[name], results[baseline_name])
+        print(
+            f"{name} - {baseline_name}: {statistics['difference']:+.2f} "
+            f"(95% CI {statistics['ci_low']:+.2f} to {statistics['ci_high']:+.2f}, p={statistics['p_value']:.2g})"
+        )
+        print(
+            f"  paired sd {statistics['stderr'] * math.sqrt(statistics['games']):.2f}, "
+            f"correlation {statistics['correlation']:.2f}, "
+            f"independent games would need {statistics['variance_reduction']:.1f}x as many deals "
+            f"(~{statistics['independent_games']} games each for the same interval)"
+        )
@@ -0,0 +1,457 @@
+import importlib
+import json
+import multiprocessing
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board_tables import blocked_edges, track_indices
+from card import Card
+from graph import CardType, node_key
+from london_system import COLORS, LondonSystem
+from multiplayer import MultiplayerLondonSystem
+
+# a trace is the list of events of one game, as json friendly lists:
+#   ["start", color], ["draw", card type name, card color], ["color", color], ["action", [edge, from, to]]
+# an action that isn't legal when it is replayed is skipped, like a draw of a card that isn't in the deck,
+# so any subset of a trace is still a trace. that is what lets failing traces be shrunk.
+
+
+# the engines are driven through the same few calls and report their state the same way. an engine that keeps
+# the raw tracks, every node in the order it was claimed with revisits, reports them as tracks. every engine
+# reports track_order, the distinct nodes in the order they were first visited. only the keys both engines
+# report are compared.
+#
+# the reference is the rules as the gui plays them: the nodes get_adjacent offers for the card are clicked with choose_node,
+# which claims the edge through choose_edge, and after a railroad card a node of the track can be clicked first
+# to re-anchor there. legal actions are the clicks that claim an edge, as (edge, from node, to node).
+class ReferenceEngine:
+    name = "reference"
+    # the gui has no order for its moves, they are compared as sets
+    ordered = False
+
+    def __init__(self, board):
+        self.london_system = LondonSystem()
+        self.london_system.verbose = False
+        self.london_system.load_graph(board)
+
+    # start_game leaves the swap and the current card of the last game alone, every trace starts from neither
+    def start(self, color):
+        graph = self.london_system.graph
+        graph.swap = False
+        graph.chose_after_swap = True
+        self.london_system.curr_card = None
+        self.london_system.start_game(color)
+
+    def can_draw(self, card):
+        london_system = self.london_system
+        return (
+            london_system.red_cards_played < 5
+            and card in london_system.cards
+            and london_system.graph.curr_node is not None
+        )
+
+    def draw(self, card):
+        return self.london_system.draw_card(card)
+
+    def next_color(self, color):
+        return self.london_system.next_color(color)
+
+    def click_source(self, target):
+        # the node choose_edge takes the edge from when target is clicked
+        graph = self.london_system.graph
+        if graph.chose_after_swap:
+            return graph.curr_node
+        return graph.swap_edge_source(target, graph.curr_color)
+
+    def legal_actions(self):
+        london_system = self.london_system
+        graph = london_system.graph
+        card = london_system.curr_card
+        if card is None or graph.curr_node is None:
+            return []
+        graph.ensure_index()
+        actions = set()
+
+        def click(source, target):
+            i = graph.get_edge_index(source, target)
+            if source is not None and i is not None and not graph.edges[i].blocked:
+                actions.add(
+                    (
+                        i,
+                        graph.node_index[node_key(source)],
+                        graph.node_index[node_key(target)],
+                    )
+                )
+
+        # get_adjacent uses up the swap, like a click does
+        swap = graph.swap
+        for target in graph.get_adjacent(card):
+            click(self.click_source(target), target)
+        if swap and card.type != CardType.RAILROAD:
+            # re-anchoring ends the swap, the move is then from the clicked node
+            graph.swap = False
+            for node in graph.railroad_nodes[graph.curr_color]:
+                for target in graph.get_adjacent(card, node):
+                    click(node, target)
+        graph.swap = swap
+        return list(actions)
+
+    def apply(self, action):
+        london_system = self.london_system
+        graph = london_system.graph
+        edge = graph.edges[action[0]]
+        source = graph.nodes[action[1]]
+        target = graph.nodes[action[2]]
+        # the node is clicked straight away when that claims the edge, otherwise the source is clicked first
+        if self.click_source(target) is not source:
+            london_system.reanchor(source)
+        color = graph.curr_color
+        claimed = len(graph.railroad_edges[color])
+        if not london_system.choose_node(target):
+            raise ValueError(f"Clicking node {action[2]} was not accepted")
+        if len(graph.railroad_edges[color]) == claimed:
+            raise ValueError(f"Clicking node {action[2]} claimed no edge")
+        if graph.railroad_edges[color][-1] is not edge:
+            raise ValueError(
+                f"Clicking node {action[2]} claimed another edge than {action[0]}"
+            )
+
+    def state(self, scores=True):
+        london_system = self.london_system
+        graph = london_system.graph
+        graph.ensure_index()
+        curr_node = -1
+        if graph.curr_node is not None:
+            curr_node = graph.node_index[node_key(graph.curr_node)]
+        state = {
+            "blocked": np.flatnonzero(blocked_edges(graph)).tolist(),
+            "curr_node": curr_node,
+            "swap": bool(graph.swap),
+            "tracks": [
+                [
+                    graph.node_index[node_key(node)]
+                    for node in graph.railroad_nodes[color]
+                ]
+                for color in COLORS
+            ],
+            "track_order": [track_indices(graph, color) for color in COLORS],
+        }
+        if scores:
+            state["scores"] = london_system.calculate_score()
+        return state
+
+
+# the canonical action api of LondonSystem, legal_actions and apply_action
+class ActionEngine(ReferenceEngine):
+    name = "actions"
+    ordered = True
+
+    def legal_actions(self):
+        return self.london_system.legal_actions()
+
+    def apply(self, action):
+        self.london_system.apply_action(action)
+
+
+# the batched multiplayer engine with a single player, fed the same cards and colors
+class BatchedEngine:
+    name = "batched"
+    ordered = True
+
+    def __init__(self, board):
+        dealer = LondonSystem()
+        dealer.verbose = False
+        dealer.load_graph(board)
+        self.multiplayer = MultiplayerLondonSystem(dealer, 1)
+
+    def start(self, color):
+        self.multiplayer.dealer.curr_card = None
+        self.multiplayer.start_game(color)
+
+    def draw(self, card):
+        return self.multiplayer.draw_card(card)
+
+    def next_color(self, color):
+        return self.multiplayer.next_color(color)
+
+    def legal_actions(self):
+        return self.multiplayer.legal_actions(0)
+
+    def apply(self, action):
+        self.multiplayer.apply_actions([action])
+
+    def state(self, scores=True):
+        multiplayer = self.multiplayer
+        state = {
+            "blocked": np.flatnonzero(multiplayer.blocked[0]).tolist(),
+            "curr_node": int(multiplayer.curr_node[0]),
+            "swap": bool(multiplayer.swap[0]),
+            "track_order": [
+                np.argsort(positions)[np.count_nonzero(positions < 0) :].tolist()
+                for positions in multiplayer.track_position[0]
+            ],
+        }
+        if scores:
+            state["scores"] = multiplayer.calculate_score(0)
+        return state
+
+
+def load_engine(path):
+    # an engine class given as module:Class
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def card_event(card):
+    return ["draw", card.type.name, card.color]
+
+
+def choose_action(actions, reference, rng, adversarial):
+    if not actions:
+        return None
+    if not adversarial:
+        return rng.choice(actions) if rng.random() < 0.9 else None
+    # go after the rules that are easy to get wrong: skipping the card after a railroad card so the swap is
+    # carried along, moving from somewhere other than the current node, revisiting nodes already on the track
+    # and moving onto RANDOM nodes
+    graph = reference.london_system.graph
+    if graph.swap and rng.random() < 0.4:
+        return None
+    graph.ensure_index()
+    curr = graph.node_index[node_key(graph.curr_node)]
+    track = set(track_indices(graph, graph.curr_color))
+    tricky = [
+        action
+        for action in actions
+        if action[1] != curr
+        or action[2] in track
+        or graph.nodes[action[2]].type == CardType.RANDOM
+    ]
+    if tricky and rng.random() < 0.7:
+        return rng.choice(tricky)
+    return rng.choice(actions)
+
+
+def random_trace(reference, seed, adversarial=False):
+    # plays one game on the reference engine and records it
+    rng = random.Random(seed)
+    london_system = reference.london_system
+    color = rng.choice(COLORS)
+    reference.start(color)
+    events = [["start", color]]
+    while True:
+        if london_system.red_cards_played < 5 and london_system.cards:
+            deck = london_system.cards
+            railroad = [card for card in deck if card.type == CardType.RAILROAD]
+            # adversarial games draw the railroad card late, so it is often the last card of a color
+            if adversarial and railroad and len(deck) > 2 and rng.random() < 0.8:
+                deck = [card for card in deck if card.type != CardType.RAILROAD]
+            card = rng.choice(deck)
+            reference.draw(card)
+            events.append(card_event(card))
+            action = choose_action(
+                reference.legal_actions(), reference, rng, adversarial
+            )
+            if action is not None:
+                reference.apply(action)
+                events.append(["action", list(action)])
+            continue
+        if not london_system.colors:
+            return events
+        color = rng.choice(london_system.colors)
+        reference.next_color(color)
+        events.append(["color", color])
+
+
+def compare(reference, engine, events):
+    # replays the events on both engines, returns None if they agree all the way, otherwise a description
+    # of the first difference
+    def mismatch(step, what, expected, actual):
+        return {
+            "step": step,
+            "event": events[step] if step < len(events) else None,
+            "what": what,
+            "reference": expected,
+            "engine": actual,
+        }
+
+    for step, event in enumerate(events):
+        try:
+            kind = event[0]
+            if kind == "start":
+                reference.start(event[1])
+                engine.start(event[1])
+            elif kind == "draw":
+                card = Card(CardType[event[1]], event[2])
+                if not reference.can_draw(card):
+                    continue
+                expected = reference.draw(card)
+                actual = engine.draw(card)
+                if expected is not actual:
+                    return mismatch(step, "card", repr(expected), repr(actual))
+            elif kind == "color":
+                expected = reference.next_color(event[1])
+                actual = engine.next_color(event[1])
+                if expected != actual:
+                    return mismatch(step, "color", expected, actual)
+            elif kind == "action":
+                action = tuple(event[1])
+                if action not in reference.legal_actions():
+                    continue
+                engine.apply(action)
+                reference.apply(action)
+        except Exception as error:
+            return mismatch(step, "exception", None, repr(error))
+
+        expected = reference.legal_actions()
+        actual = engine.legal_actions()
+        if not (reference.ordered and engine.ordered):
+            expected = sorted(expected)
+            actual = sorted(actual)
+        if expected != actual:
+            return mismatch(step, "legal actions", expected, actual)
+        # scores only change when something is claimed, and they are the slow part of the state
+        expected_state = reference.state(scores=kind == "action")
+        actual_state = engine.state(scores=kind == "action")
+        for key, value in expected_state.items():
+            if key in actual_state and actual_state[key] != value:
+                return mismatch(step, key, value, actual_state[key])
+    return None
+
+
+def shrink(reference, engine, events):
+    # delta debugging: drop ever smaller chunks of events as long as the engines still disagree
+    events = list(events)
+    chunk = max(1, len(events) // 2)
+    while True:
+        removed = False
+        start = 1
+        while start < len(events):
+            candidate = events[:start] + events[start + chunk :]
+            if compare(reference, engine, candidate) is not None:
+                events = candidate
+                removed = True
+            else:
+                start += chunk
+        if chunk == 1 and not removed:
+            return events
+        chunk = max(1, chunk // 2) if not removed else chunk
+
+
+def check_seeds(
+    board, reference_path, engine_paths, seeds, adversarial, shrink_failures=True
+):
+    reference = load_engine(reference_path)(board)
+    engines = [(path, load_engine(path)(board)) for path in engine_paths]
+    failures = []
+    for seed in seeds:
+        trace = random_trace(reference, seed, adversarial)
+        for path, engine in engines:
+            difference = compare(reference, engine, trace)
+            if difference is None:
+                continue
+            events = trace
+            if shrink_failures:
+                events = shrink(reference, engine, events)
+                difference = compare(reference, engine, events)
+            failures.append(
+                {
+                    "board": board,
+                    "reference": reference_path,
+                    "engine": path,
+                    "seed": seed,
+                    "events": events,
+                    "difference": difference,
+                }
+            )
+    return failures
+
+
+def _check_chunk(arguments):
+    return check_seeds(*arguments)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument(
+        "--reference",
+        default="differential_test:ReferenceEngine",
+        help="Engine the others are checked against, as module:Class",
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        default=["differential_test:ActionEngine", "differential_test:BatchedEngine"],
+        help="Engines to check against the reference, as module:Class",
+    )
+    parser.add_argument("--games", type=int, default=1000, help="Games to check")
+    parser.add_argument("--first-seed", type=int, default=0, help="First seed")
+    parser.add_argument(
+        "--adversarial", action="store_true", help="Play games that target rule quirks"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Processes to use")
+    parser.add_argument("--chunk-size", type=int, default=200, help="Games per task")
+    parser.add_argument(
+        "--output", "-o", default="differential_failures.json", help="Failures file"
+    )
+    parser.add_argument("--replay", help="Replay the traces in a failures file")
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay) as file:
+            failures = json.load(file)
+        for failure in failures:
+            reference = load_engine(failure["reference"])(failure["board"])
+            engine = load_engine(failure["engine"])(failure["board"])
+            difference = compare(reference, engine, failure["events"])
+            print(
+                f"seed {failure['seed']}, {failure['engine']}: {len(failure['events'])} events, "
+                f"{'still fails' if difference else 'passes'}"
+            )
+            if difference:
+                print(json.dumps(difference, indent=2, default=str))
+        sys.exit(0)
+
+    seeds = range(args.first_seed, args.first_seed + args.games)
+    chunks = [
+        (
+            args.custom,
+            args.reference,
+            args.engines,
+            seeds[i : i + args.chunk_size],
+            args.adversarial,
+        )
+        for i in range(0, len(seeds), args.chunk_size)
+    ]
+    started = time.perf_counter()
+    failures = []
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            for result in pool.imap_unordered(_check_chunk, chunks):
+                failures.extend(result)
+    else:
+        for chunk in chunks:
+            failures.extend(_check_chunk(chunk))
+    elapsed = time.perf_counter() - started
+    print(
+        f"Checked {len(seeds)} games in {elapsed:.1f}s ({len(seeds) / elapsed:.0f} games/s), "
+        f"{len(failures)} failures"
+    )
+    if failures:
+        failures.sort(key=lambda failure: (failure["seed"], failure["engine"]))
+        with open(args.output, "w") as file:
+            json.dump(failures, file, indent=2, default=str)
+        first = failures[0]
+        print(
+            f"First failure, seed {first['seed']} on {first['engine']}, "
+            f"shrunk to {len(first['events'])} events:"
+        )
+        print(json.dumps(first["difference"], indent=2, default=str))
+        sys.exit(1)
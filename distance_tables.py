@@ -0,0 +1,205 @@
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board_tables import BoardTables, blocked_edges
+from graph import CardType
+
+# hop counts are stored as int16 with -1 for nodes that can't be reached
+UNREACHABLE = -1
+
+
+class DistanceTables:
+    # shortest path tables over the unblocked edges of one board: all pairs hop counts, the card types needed
+    # along a shortest path and the distance from every node to the nearest tourist, other area and river crossing.
+    # everything is computed on first use and thrown away when graph.blocked_hash says choose_edge blocked something.
+    def __init__(self, graph, tables=None):
+        self.graph = graph
+        self.tables = tables if tables is not None else BoardTables(graph)
+        # a move onto a RANDOM node can be made with any card
+        self.constrained = self.tables.node_type != CardType.RANDOM.value
+        self.blocked_hash = None
+        self.refresh()
+
+    def refresh(self):
+        graph = self.graph
+        graph.ensure_index()
+        if graph.blocked_hash == self.blocked_hash:
+            return
+        self.blocked_hash = graph.blocked_hash
+        self.blocked = blocked_edges(graph)
+        open_edges = self.tables.edge_nodes[~self.blocked]
+        # both directions of every unblocked edge, sorted by the node they lead to
+        src = np.concatenate([open_edges[:, 0], open_edges[:, 1]])
+        dst = np.concatenate([open_edges[:, 1], open_edges[:, 0]])
+        order = np.argsort(dst, kind="stable")
+        self.src = src[order]
+        self.dst = dst[order]
+        self.dst_nodes, self.dst_starts = np.unique(self.dst, return_index=True)
+
+        self.pairs = None
+        self.rows = {}
+        self.predecessors = {}
+        self.tourist_distance = None
+        self.other_area_distance = None
+        self.river_distance = None
+        self.new_area_distances = {}
+
+    def multi_source(self, sources):
+        # hop count from every node to the nearest of the sources
+        num_nodes = self.tables.num_nodes
+        distance = np.full(num_nodes, UNREACHABLE, dtype=np.int16)
+        frontier = np.zeros(num_nodes, dtype=bool)
+        frontier[sources] = True
+        distance[frontier] = 0
+        depth = 0
+        while frontier.any():
+            depth += 1
+            reached = np.zeros(num_nodes, dtype=bool)
+            reached[self.dst[frontier[self.src]]] = True
+            frontier = reached & (distance == UNREACHABLE)
+            distance[frontier] = depth
+        return distance
+
+    def distances_from(self, node):
+        self.refresh()
+        if self.pairs is not None:
+            return self.pairs[node]
+        if node not in self.rows:
+            self.rows[node] = self.multi_source([node])
+        return self.rows[node]
+
+    def all_pairs(self):
+        # every source is searched at once, one bit per source, so each level is a single gather and or-reduce
+        self.refresh()
+        if self.pairs is not None:
+            return self.pairs
+        num_nodes = self.tables.num_nodes
+        pairs = np.full((num_nodes, num_nodes), UNREACHABLE, dtype=np.int16)
+        np.fill_diagonal(pairs, 0)
+        # row i holds the sources that have reached node i
+        reached = np.packbits(np.eye(num_nodes, dtype=bool), axis=1)
+        frontier = reached.copy()
+        depth = 0
+        while len(self.dst_nodes) and frontier.any():
+            depth += 1
+            gathered = np.bitwise_or.reduceat(
+                frontier[self.src], self.dst_starts, axis=0
+            )
+            frontier = np.zeros_like(reached)
+            frontier[self.dst_nodes] = gathered & ~reached[self.dst_nodes]
+            reached |= frontier
+            new = np.unpackbits(frontier, axis=1, count=num_nodes).astype(bool)
+            pairs.T[new] = depth
+        self.pairs = pairs
+        self.rows = {}
+        return pairs
+
+    def shortest_path_tree(self, source):
+        # among the shortest paths from source, the ones with the most RANDOM nodes need the fewest specific cards.
+        # returns the predecessor of every node on such a path.
+        self.refresh()
+        if source in self.predecessors:
+            return self.predecessors[source]
+        distance = self.distances_from(source)
+        num_nodes = self.tables.num_nodes
+        cost = np.zeros(num_nodes, dtype=np.int32)
+        predecessor = np.full(num_nodes, -1, dtype=np.int32)
+        for depth in range(1, int(distance.max()) + 1):
+            step = (distance[self.src] == depth - 1) & (distance[self.dst] == depth)
+            src, dst = self.src[step], self.dst[step]
+            # the cheapest predecessor of every node at this depth
+            order = np.lexsort((cost[src], dst))
+            src, dst = src[order], dst[order]
+            first = np.ones(len(dst), dtype=bool)
+            first[1:] = dst[1:] != dst[:-1]
+            src, dst = src[first], dst[first]
+            predecessor[dst] = src
+            cost[dst] = cost[src] + self.constrained[dst]
+        self.predecessors[source] = predecessor
+        return predecessor
+
+    def path(self, source, target):
+        if self.distances_from(source)[target] == UNREACHABLE:
+            return None
+        predecessor = self.shortest_path_tree(source)
+        path = [target]
+        while path[-1] != source:
+            path.append(int(predecessor[path[-1]]))
+        return path[::-1]
+
+    def card_sequence(self, source, target):
+        # the cards needed to walk from source to target in the fewest draws, RANDOM where any card will do
+        path = self.path(source, target)
+        if path is None:
+            return None
+        return [CardType(int(self.tables.node_type[node])) for node in path[1:]]
+
+    def nearest_tourist(self):
+        self.refresh()
+        if self.tourist_distance is None:
+            self.tourist_distance = self.multi_source(
+                np.flatnonzero(self.tables.tourist)
+            )
+        return self.tourist_distance
+
+    def nearest_other_area(self):
+        # hops from every node to the nearest node in a different area
+        self.refresh()
+        if self.other_area_distance is None:
+            location = self.tables.location
+            distance = np.full(self.tables.num_nodes, UNREACHABLE, dtype=np.int16)
+            for area in np.unique(location).tolist():
+                inside = location == area
+                distance[inside] = self.multi_source(np.flatnonzero(~inside))[inside]
+            self.other_area_distance = distance
+        return self.other_area_distance
+
+    def nearest_new_area(self, visited):
+        # hops from every node to the nearest area that isn't in visited, a collection of area indices
+        self.refresh()
+        visited = frozenset(visited)
+        if visited not in self.new_area_distances:
+            outside = ~np.isin(self.tables.location, list(visited))
+            self.new_area_distances[visited] = self.multi_source(
+                np.flatnonzero(outside)
+            )
+        return self.new_area_distances[visited]
+
+    def nearest_river_crossing(self):
+        # draws needed from every node to claim an unblocked edge that crosses the river
+        self.refresh()
+        if self.river_distance is None:
+            river = self.tables.crosses_river & ~self.blocked
+            distance = self.multi_source(self.tables.edge_nodes[river].ravel())
+            distance[distance != UNREACHABLE] += 1
+            self.river_distance = distance
+        return self.river_distance
+
+
+if __name__ == "__main__":
+    from london_system import LondonSystem
+
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    args = parser.parse_args()
+
+    london_system = LondonSystem()
+    london_system.load_graph(args.custom)
+    started = time.perf_counter()
+    distance_tables = DistanceTables(london_system.graph)
+    pairs = distance_tables.all_pairs()
+    elapsed = time.perf_counter() - started
+    reachable = pairs[pairs != UNREACHABLE]
+    print(
+        f"All pairs for {len(pairs)} nodes in {elapsed:.3f}s, diameter {reachable.max()}, mean {reachable.mean():.2f}"
+    )
+    for name, distance in [
+        ("tourist", distance_tables.nearest_tourist()),
+        ("other area", distance_tables.nearest_other_area()),
+        ("river crossing", distance_tables.nearest_river_crossing()),
+    ]:
+        print(f"Mean draws to the nearest {name}: {distance[distance >= 0].mean():.2f}")
@@ -0,0 +1,429 @@
+import copy
+import importlib
+import math
+import random
+import time
+from argparse import ArgumentParser
+from operator import add
+
+from board_tables import BoardTables
+from card import DECK
+from hindsight_oracle import (
+    MULTI_COLOR_VALUES,
+    RAILROAD,
+    HindsightOracle,
+    SearchBudgetExceeded,
+    bits,
+)
+from london_system import COLORS, LondonSystem
+from rollout import run_episode
+
+# the parts of the score the moments are kept for: the points of every color (areas and river crossings) and
+# the bi-, tri-, quad-color and tourist points shared between them. the total is kept too, it isn't the sum of
+# the variances.
+PARTS = COLORS + ["multi-color", "tourist"]
+MULTI_COLOR = len(COLORS)
+TOURIST = len(COLORS) + 1
+FULL_DECK = (1 << len(DECK)) - 1
+RED_CARDS = sum(1 << i for i, card in enumerate(DECK) if card.color == "red")
+CARD_TYPES = [card.type.value for card in DECK]
+ZERO = (0.0,) * (2 * len(PARTS) + 1)
+
+
+# a policy here is called with the evaluator, the color playing, the tracks of all colors and the legal moves
+# as (edge, source, other) in edge and then source order, and returns one of the moves or None to skip the
+# card. it has to be deterministic: the same arguments always give the same move. policies on LondonSystem are
+# evaluated through GamePolicy.
+def greedy_move(evaluator, color, tracks, moves):
+    # the move that gains the most points right away, the first of them on a tie
+    best = None
+    best_gain = -1
+    for move in moves:
+        gain = sum(evaluator.gains(color, tracks, move[0], move[2]))
+        if gain > best_gain:
+            best = move
+            best_gain = gain
+    return best
+
+
+def first_move(evaluator, color, tracks, moves):
+    return moves[0] if moves else None
+
+
+def skip_move(evaluator, color, tracks, moves):
+    return None
+
+
+# the same policies on LondonSystem, for checking the exact results against games played with rollout
+def greedy_first_policy(london_system, actions):
+    deltas = london_system.evaluate_moves().score_delta.tolist()
+    best = max(deltas)
+    return min(action for action, delta in zip(actions, deltas) if delta == best)
+
+
+def first_policy(london_system, actions):
+    return min(actions)
+
+
+def skip_policy(london_system, actions):
+    return None
+
+
+POLICIES = {
+    "greedy": (greedy_move, greedy_first_policy),
+    "first": (first_move, first_policy),
+    "skip": (skip_move, skip_policy),
+}
+
+
+def load_policy(name, london_system):
+    # a pair from POLICIES, or a module:function policy on LondonSystem, evaluated as a GamePolicy
+    if name in POLICIES:
+        return POLICIES[name]
+    module, _, function = name.partition(":")
+    if not function:
+        raise ValueError(
+            f"Unknown policy {name}, use one of {sorted(POLICIES)} or module:function"
+        )
+    policy = getattr(importlib.import_module(module), function)
+    return GamePolicy(policy, london_system), policy
+
+
+# any policy(london_system, actions) like the ones rollout.run_episode plays, for ExactEvaluator. every time it
+# has to choose, the state of the search is loaded into a copy of the game: the tracks, the claimed and blocked
+# edges, the colors and cards left and the card drawn, and the policy is called with the game and its legal
+# actions like in a real game. the policy has to be deterministic and only look at the game as it is, not at how
+# it got there: the nodes go on a track in index order and the moves before aren't replayed. it is much slower
+# than a policy on the search's own state, since no two states share a choice and every choice loads a game.
+class GamePolicy:
+    def __init__(self, policy, london_system):
+        self.policy = policy
+        self.game = copy.deepcopy(london_system)
+        self.game.verbose = False
+        self.game.skip_dead_ends = False
+
+    def __call__(self, colors, deck, card, color, curr, swap, blocked, tracks, edges):
+        game = self.game
+        game.reset_game()
+        graph = game.graph
+        graph.ensure_index()
+        for edge in bits(blocked):
+            graph.block_edge_index(edge)
+        for c, name in enumerate(COLORS):
+            graph.railroad_nodes[name] = [graph.nodes[node] for node in bits(tracks[c])]
+            graph.railroad_edges[name] = [graph.edges[edge] for edge in bits(edges[c])]
+            for edge in graph.railroad_edges[name]:
+                edge.color = name
+        game.colors = [COLORS[c] for c in bits(colors)]
+        graph.curr_color = COLORS[color]
+        graph.curr_node = graph.nodes[curr]
+        # the deck is what is left after the card was drawn, like after draw_card
+        game.cards = [DECK[i] for i in bits(deck)]
+        game.red_cards_played = (RED_CARDS & ~deck).bit_count()
+        game.curr_card = DECK[card]
+        graph.swap = swap
+        graph.chose_after_swap = not swap
+        actions = game.legal_actions()
+        action = self.policy(game, actions) if actions else None
+        return tuple(action) if action is not None else None
+
+
+# the exact expected score of a policy and its variance, from every way the game can be dealt instead of games
+# played at random. the cards still in the deck are a bitset over DECK, every card left is drawn with the same
+# chance and every color left is played next with the same chance, like draw_card and next_color deal them.
+# the tracks and blocked edges are the bitsets of HindsightOracle.
+#
+# the points a move adds are known when it's played, so a state stands for the points still to come, which
+# don't depend on how the board got there. the moments of those points are kept per state: the mean and the
+# mean square of every part and the mean square of the total. with the swap of a railroad card pending the
+# current node doesn't matter, so those states are kept without it. states already evaluated are looked up
+# again, so a whole round is one pass over its distinct states. max_states gives up on a game with more states
+# than that with SearchBudgetExceeded.
+class ExactEvaluator:
+    def __init__(self, tables, policy=greedy_move, max_states=None):
+        self.board = HindsightOracle(tables)
+        self.policy = policy
+        self.game_policy = isinstance(policy, GamePolicy)
+        self.max_states = max_states
+        self.memo = {}
+        self.steps = {}
+
+    def moves(self, track, curr, swap, blocked, card_type):
+        # the legal moves for the card, like LondonSystem.legal_actions
+        moves = self.board.moves
+        sources = bits(track) if swap and card_type != RAILROAD else (curr,)
+        legal = [
+            (edge, source, other)
+            for source in sources
+            for edge, other in moves[source][card_type]
+            if not blocked >> edge & 1
+        ]
+        legal.sort()
+        return legal
+
+    def gains(self, color, tracks, edge, other):
+        # the points the move adds to every part, edge -1 for the start node of a round
+        board = self.board
+        gained = [0] * len(PARTS)
+        if edge >= 0 and board.river >> edge & 1:
+            gained[color] = 2
+        track = tracks[color]
+        if not track >> other & 1:
+            gained[color] += board.area_score(track | 1 << other) - board.area_score(
+                track
+            )
+            count = sum(track >> other & 1 for track in tracks)
+            gained[MULTI_COLOR] = (
+                MULTI_COLOR_VALUES[count + 1] - MULTI_COLOR_VALUES[count]
+            )
+            if board.tourist >> other & 1:
+                tourists = sum((track & board.tourist).bit_count() for track in tracks)
+                gained[TOURIST] = board.tourist_score(
+                    tourists + 1
+                ) - board.tourist_score(tourists)
+        return gained
+
+    def game(self):
+        # the moments of a whole game, from the first color on
+        empty = (0,) * len(COLORS)
+        return self.results(self._next_color((1 << len(COLORS)) - 1, 0, empty, empty))
+
+    def round(self, color, blocked=0, tracks=None, edges=None):
+        # the moments of the points one color's round adds to the board, with no colors after it. edges are the
+        # edges every color claimed, only game policies look at them.
+        empty = (0,) * len(COLORS)
+        tracks = tuple(tracks) if tracks is not None else empty
+        edges = tuple(edges) if edges is not None else empty
+        return self.results(self._start_round(0, color, blocked, tracks, edges))
+
+    def results(self, moments):
+        # {part: (mean, variance)}, with the total last
+        parts = len(PARTS)
+        results = {}
+        for i, part in enumerate(PARTS + ["total"]):
+            if part == "total":
+                mean = sum(moments[:parts])
+                square = moments[-1]
+            else:
+                mean = moments[i]
+                square = moments[parts + i]
+            results[part] = (mean, max(square - mean * mean, 0.0))
+        return results
+
+    def _next_color(self, colors, blocked, tracks, edges):
+        if not colors:
+            return ZERO
+        left = list(bits(colors))
+        total = [0.0] * len(ZERO)
+        for color in left:
+            moments = self._start_round(
+                colors & ~(1 << color), color, blocked, tracks, edges
+            )
+            total = map(add, total, moments)
+        return tuple(value / len(left) for value in total)
+
+    def _start_round(self, colors, color, blocked, tracks, edges):
+        # the start node is the first node on the track
+        start = self.board.start[color]
+        track = tracks[color] | 1 << start
+        gained = self.gains(color, tracks, -1, start) if track != tracks[color] else ()
+        tracks = tracks[:color] + (track,) + tracks[color + 1 :]
+        moments = self._draw(
+            colors, color, FULL_DECK, start, False, blocked, tracks, edges
+        )
+        return _shift(moments, gained)
+
+    def _step(self, colors, deck, card, color, curr, swap, blocked, tracks, edges):
+        # where the policy takes the board with the card, drawn from deck: (curr, swap, blocked, tracks, the edge
+        # claimed or -1, points gained)
+        card_type = CARD_TYPES[card]
+        card_swap = swap or card_type == RAILROAD
+        moves = self.moves(tracks[color], curr, card_swap, blocked, card_type)
+        if not moves:
+            move = None
+        elif self.game_policy:
+            move = self.policy(
+                colors, deck, card, color, curr, card_swap, blocked, tracks, edges
+            )
+            if move is not None and move not in moves:
+                raise ValueError(f"The policy played {move}, which isn't legal")
+        else:
+            move = self.policy(self, color, tracks, moves)
+        if move is None:
+            return curr, card_swap, blocked, tracks, -1, ()
+        edge, _, other = move
+        track = tracks[color] | 1 << other
+        return (
+            other,
+            card_type == RAILROAD,
+            blocked | self.board.claims[edge],
+            tracks[:color] + (track,) + tracks[color + 1 :],
+            edge,
+            self.gains(color, tracks, edge, other),
+        )
+
+    def _draw(self, colors, color, deck, curr, swap, blocked, tracks, edges):
+        if (RED_CARDS & ~deck).bit_count() == 5 or not deck:
+            return self._next_color(colors, blocked, tracks, edges)
+        if self.game_policy:
+            # a game policy can look at anything in the game, so the whole game is the state and nothing is
+            # shared between states
+            key = (colors, deck, color, curr, swap, blocked, tracks, edges)
+            steps = {}
+        else:
+            # the deck has one railroad card, so a swap is never pending when the next one is drawn and the moves
+            # come from the whole track
+            if swap:
+                curr = -1
+            position = (color, curr, swap, blocked, tracks)
+            key = (colors, deck, position)
+        moments = self.memo.get(key)
+        if moments is not None:
+            return moments
+        if self.max_states is not None and len(self.memo) >= self.max_states:
+            raise SearchBudgetExceeded(f"More than {self.max_states} states")
+
+        if not self.game_policy:
+            # the same board comes up again with other cards left, so what the policy does with every card type
+            # on it is kept too. the claimed edges only matter to game policies.
+            steps = self.steps.get(position)
+            if steps is None:
+                steps = self.steps[position] = {}
+        total = [0.0] * len(ZERO)
+        cards = list(bits(deck))
+        for card in cards:
+            left = deck & ~(1 << card)
+            step = steps.get(CARD_TYPES[card])
+            if step is None:
+                step = self._step(
+                    colors, left, card, color, curr, swap, blocked, tracks, edges
+                )
+                if not self.game_policy:
+                    steps[CARD_TYPES[card]] = step
+            edge = step[4]
+            if edge >= 0:
+                claimed = edges[:color] + (edges[color] | 1 << edge,)
+                after = self._draw(
+                    colors, color, left, *step[:4], claimed + edges[color + 1 :]
+                )
+            else:
+                after = self._draw(colors, color, left, *step[:4], edges)
+            total = map(add, total, _shift(after, step[5]))
+        moments = tuple(value / len(cards) for value in total)
+        self.memo[key] = moments
+        return moments
+
+
+def _shift(moments, gained):
+    # the moments of the points to come plus the fixed points gained before them
+    if not any(gained):
+        return moments
+    parts = len(PARTS)
+    shifted = list(moments)
+    for i, points in enumerate(gained):
+        if points:
+            mean = moments[i]
+            shifted[i] = mean + points
+            shifted[parts + i] = moments[parts + i] + points * (2 * mean + points)
+    points = sum(gained)
+    mean = sum(moments[:parts])
+    shifted[-1] = moments[-1] + points * (2 * mean + points)
+    return tuple(shifted)
+
+
+def play_round(london_system, color, policy):
+    # one color's round on an empty board, scored like a whole game
+    london_system.verbose = False
+    london_system.skip_dead_ends = True
+    london_system.start_game(color)
+    while london_system.draw_card() is not None:
+        actions = london_system.legal_actions()
+        if actions:
+            action = policy(london_system, actions)
+            if action is not None:
+                london_system.apply_action(action)
+    return london_system.calculate_score()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument(
+        "--policy",
+        default="greedy",
+        help=f"One of {sorted(POLICIES)} or module:function, a policy on LondonSystem",
+    )
+    parser.add_argument(
+        "--round",
+        choices=COLORS,
+        help="Only evaluate this color's round on an empty board",
+    )
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=2000000,
+        help="Give up after this many states, they are all kept in memory",
+    )
+    parser.add_argument(
+        "--games",
+        type=int,
+        default=0,
+        help="Also play this many games to check the exact results against",
+    )
+    parser.add_argument(
+        "--precision",
+        type=float,
+        default=0.001,
+        help="Standard error of the mean to work out how many games would match the exact mean",
+    )
+    args = parser.parse_args()
+
+    london_system = LondonSystem()
+    london_system.verbose = False
+    london_system.load_graph(args.custom)
+    policy, london_policy = load_policy(args.policy, london_system)
+    evaluator = ExactEvaluator(
+        BoardTables(london_system.graph), policy, args.max_states
+    )
+    started = time.perf_counter()
+    try:
+        if args.round:
+            results = evaluator.round(COLORS.index(args.round))
+        else:
+            results = evaluator.game()
+    except SearchBudgetExceeded as error:
+        parser.exit(1, f"{error}, try --round or a smaller board\n")
+    exact_seconds = time.perf_counter() - started
+    for part, (mean, variance) in results.items():
+        print(f"{part:>12}: mean {mean:.4f}, variance {variance:.4f}")
+    print(f"Exact in {exact_seconds:.2f}s over {len(evaluator.memo)} states")
+
+    if args.games:
+        totals = []
+        started = time.perf_counter()
+        for seed in range(args.games):
+            random.seed(seed)
+            if args.round:
+                scores = play_round(london_system, args.round, london_policy)
+            else:
+                scores = run_episode(london_system, london_policy)
+            totals.append(sum(scores.values()))
+        seconds = (time.perf_counter() - started) / args.games
+        mean = sum(totals) / len(totals)
+        variance = sum((total - mean) ** 2 for total in totals) / max(
+            len(totals) - 1, 1
+        )
+        stderr = math.sqrt(variance / len(totals))
+        exact_mean, exact_variance = results["total"]
+        print(
+            f"{args.games} games: mean {mean:.4f} +- {stderr:.4f}, variance {variance:.4f}, "
+            f"{(mean - exact_mean) / stderr if stderr else 0:+.2f} standard errors from the exact mean"
+        )
+        # games played at random need variance / precision^2 of them for a mean that precise
+        needed = math.ceil(exact_variance / args.precision**2)
+        print(
+            f"For a standard error of {args.precision}: {needed} games, ~{needed * seconds:.0f}s "
+            f"({needed * seconds / exact_seconds:.0f}x the exact evaluation)"
+        )
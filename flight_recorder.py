@@ -0,0 +1,327 @@
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+from argparse import ArgumentParser
+from contextlib import contextmanager
+
+import numpy as np
+
+from card import DECK
+from graph import CardType
+from london_system import COLORS
+
+# every event is packed into one python integer while it is recorded: the event in the low 8 bits, then three
+# fields of 40 bits, so any node or edge index of a generated board fits. a field that is all ones is -1. the
+# ring is only unpacked into EVENT_DTYPE records, with 64 bits per field, when it is read.
+EVENTS = [
+    "game",
+    "color",
+    "no_color",
+    "draw",
+    "legal",
+    "move",
+    "round_end",
+    "dead_end",
+    "error",
+]
+FIELDS = {
+    "game": ("color", "", ""),
+    "color": ("color", "", ""),
+    "no_color": ("reason", "colors_left", ""),
+    "draw": ("card", "red", "red_cards"),
+    "legal": ("card", "actions", "swap"),
+    "move": ("edge", "from", "to"),
+    "round_end": ("red_cards", "cards_left", ""),
+    "dead_end": ("skipped", "red_cards", ""),
+    "error": ("reason", "", ""),
+}
+NO_COLOR_REASONS = ["no colors left", "color not left", "no start node"]
+ERROR_REASONS = ["no start node", "graph not set up"]
+FIELD_MASK = (1 << 40) - 1
+FIELD_SHIFTS = (8, 48, 88)
+EVENT_DTYPE = np.dtype([("event", np.uint8), ("fields", np.int64, (3,))])
+GAME, COLOR, NO_COLOR, DRAW, LEGAL, MOVE, ROUND_END, DEAD_END, ERROR = range(
+    len(EVENTS)
+)
+# the color field of the game and color events, already shifted into place
+COLOR_FIELDS = {color: i << 8 for i, color in enumerate(COLORS)}
+UNKNOWN_COLOR = FIELD_MASK << 8
+# the card field of the draw and legal events, already shifted into place, and the red field of a draw
+CARD_FIELDS = {card: card.type.value << 8 for card in DECK}
+RED_FIELDS = {card: (card.color == "red") << 48 for card in DECK}
+
+
+# the last size events of a game, kept in a ring of integers. LondonSystem calls the recorder when it is set,
+# and every call packs its event and stores it, so the recorder can stay on in long jobs. dump writes the ring
+# to an npz file, oldest event first, and decode_events turns it back into readable events.
+class FlightRecorder:
+    def __init__(self, size=4096):
+        # a power of two, so the position in the ring is a mask. a list stores the integers faster than an array
+        self.size = 1 << max(size - 1, 1).bit_length()
+        self.mask = self.size - 1
+        self.events = [0] * self.size
+        self.count = 0
+        self.games = 0
+
+    def game(self, color):
+        self.games += 1
+        self.events[self.count & self.mask] = GAME | COLOR_FIELDS.get(
+            color, UNKNOWN_COLOR
+        )
+        self.count += 1
+
+    def color(self, color):
+        self.events[self.count & self.mask] = COLOR | COLOR_FIELDS.get(
+            color, UNKNOWN_COLOR
+        )
+        self.count += 1
+
+    def no_color(self, reason, colors_left):
+        self.events[self.count & self.mask] = NO_COLOR | reason << 8 | colors_left << 48
+        self.count += 1
+
+    def draw(self, card, red_cards):
+        self.events[self.count & self.mask] = (
+            DRAW | CARD_FIELDS[card] | RED_FIELDS[card] | red_cards << 88
+        )
+        self.count += 1
+
+    def legal(self, card, actions, swap):
+        self.events[self.count & self.mask] = (
+            LEGAL | CARD_FIELDS.get(card, 0) | actions << 48 | swap << 88
+        )
+        self.count += 1
+
+    def move(self, action):
+        edge, source, target = action
+        # a negative index or one too wide for its field would be packed into the neighbouring field, and all
+        # ones reads back as -1
+        if not (
+            0 <= edge < FIELD_MASK
+            and 0 <= source < FIELD_MASK
+            and 0 <= target < FIELD_MASK
+        ):
+            raise ValueError(f"Action {action} doesn't fit the recorder's fields")
+        self.events[self.count & self.mask] = (
+            MOVE | edge << 8 | source << 48 | target << 88
+        )
+        self.count += 1
+
+    def round_end(self, red_cards, cards_left):
+        self.events[self.count & self.mask] = (
+            ROUND_END | red_cards << 8 | cards_left << 48
+        )
+        self.count += 1
+
+    def dead_end(self, skipped, red_cards):
+        self.events[self.count & self.mask] = DEAD_END | skipped << 8 | red_cards << 48
+        self.count += 1
+
+    def error(self, reason):
+        self.events[self.count & self.mask] = ERROR | reason << 8
+        self.count += 1
+
+    def recent(self):
+        # the events still in the ring, oldest first, as EVENT_DTYPE records
+        if self.count <= self.size:
+            return unpack_events(self.events[: self.count])
+        start = self.count & self.mask
+        return unpack_events(self.events[start:] + self.events[:start])
+
+    def dump(self, filename, reason=""):
+        events = self.recent()
+        meta = {
+            "reason": reason,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "count": self.count,
+            "games": self.games,
+        }
+        # written next to the target and renamed, so a dump is never read half written
+        temporary = f"{filename}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.savez(file, events=events, meta=np.array(json.dumps(meta)))
+        os.replace(temporary, filename)
+        return filename
+
+    @contextmanager
+    def dumping(self, filename):
+        # dumps the recorder when the block raises, then lets the exception go on. excepthook only sees exceptions
+        # in the main thread, so worker loops wrap themselves in this.
+        try:
+            yield self
+        except BaseException:
+            self.dump(filename, traceback.format_exc())
+            raise
+
+    def install(self, filename, signals=(signal.SIGUSR1, signal.SIGTERM)):
+        # dumps on an uncaught exception and on the signals. SIGUSR1 is a snapshot of a job that keeps running,
+        # the other signals go on to what they did before.
+        previous_hook = sys.excepthook
+
+        def excepthook(kind, value, trace):
+            self.dump(filename, "".join(traceback.format_exception(kind, value, trace)))
+            previous_hook(kind, value, trace)
+
+        sys.excepthook = excepthook
+        for number in signals:
+            previous = signal.getsignal(number)
+
+            def handler(number, frame, previous=previous):
+                self.dump(filename, f"signal {signal.Signals(number).name}")
+                if callable(previous):
+                    previous(number, frame)
+                elif previous == signal.SIG_DFL and number != signal.SIGUSR1:
+                    signal.signal(number, signal.SIG_DFL)
+                    os.kill(os.getpid(), number)
+
+            signal.signal(number, handler)
+
+
+def unpack_events(packed):
+    events = np.zeros(len(packed), dtype=EVENT_DTYPE)
+    events["event"] = [event & 0xFF for event in packed]
+    for i, shift in enumerate(FIELD_SHIFTS):
+        values = [(event >> shift) & FIELD_MASK for event in packed]
+        events["fields"][:, i] = [
+            -1 if value == FIELD_MASK else value for value in values
+        ]
+    return events
+
+
+def decode_events(events):
+    # (event name, {field: value}) for every EVENT_DTYPE record
+    decoded = []
+    for event, values in zip(events["event"].tolist(), events["fields"].tolist()):
+        name = EVENTS[event]
+        decoded.append(
+            (
+                name,
+                {field: value for field, value in zip(FIELDS[name], values) if field},
+            )
+        )
+    return decoded
+
+
+def format_event(name, fields):
+    parts = []
+    for field, value in fields.items():
+        if field == "card":
+            value = CardType(value).name if value > 0 else None
+        elif field == "color":
+            value = COLORS[value] if 0 <= value < len(COLORS) else "?"
+        elif field == "reason":
+            reasons = NO_COLOR_REASONS if name == "no_color" else ERROR_REASONS
+            value = reasons[value] if value < len(reasons) else value
+        elif field in ("red", "swap"):
+            value = bool(value)
+        parts.append(f"{field}={value}")
+    return f"{name:<10} " + " ".join(parts)
+
+
+def load_dump(filename):
+    with np.load(filename) as data:
+        return data["events"], json.loads(str(data["meta"]))
+
+
+def check_round_trip(num_nodes, filename):
+    # records a move to the last node of a generated board over its last edge, and the widest indices the fields
+    # take, dumps them and reads them back
+    from board_generator import generate_board
+
+    graph_data = generate_board(num_nodes)
+    last_node = len(graph_data["nodes"]) - 1
+    actions = [
+        (len(graph_data["edges"]) - 1, last_node - 1, last_node),
+        (FIELD_MASK - 1, FIELD_MASK - 1, FIELD_MASK - 1),
+    ]
+    recorder = FlightRecorder(len(actions))
+    for action in actions:
+        recorder.move(action)
+    try:
+        recorder.move((0, 0, FIELD_MASK))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a node index too wide for its field was recorded")
+    events, _ = load_dump(recorder.dump(filename))
+    decoded = [
+        (fields["edge"], fields["from"], fields["to"])
+        for _, fields in decode_events(events)
+    ]
+    if decoded != actions:
+        raise AssertionError(f"recorded {actions}, read back {decoded}")
+    return actions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("dump", nargs="?", help="Recorder dump to print")
+    parser.add_argument("--last", type=int, help="Only print the last events")
+    parser.add_argument(
+        "--benchmark",
+        help="Measure the recording overhead on this board instead",
+    )
+    parser.add_argument("--games", type=int, default=2000, help="Benchmark games")
+    parser.add_argument(
+        "--check",
+        type=int,
+        metavar="NODES",
+        help="Check that the indices of a generated board this size read back from a dump instead",
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            actions = check_round_trip(args.check, os.path.join(directory, "dump.npz"))
+        print(f"Round trip ok for moves {actions}")
+    elif args.benchmark:
+        import random
+
+        from london_system import LondonSystem
+        from rollout import run_episode
+
+        london_system = LondonSystem()
+        london_system.load_graph(args.benchmark)
+        recorder = FlightRecorder()
+        plain = []
+        recorded = []
+        # like the metrics benchmark: every seed with and without, alternating which goes first
+        for seed in range(args.games):
+            runs = [(plain, None), (recorded, recorder)]
+            for times, game_recorder in runs if seed % 2 else runs[::-1]:
+                london_system.recorder = game_recorder
+                random.seed(seed)
+                started = time.perf_counter()
+                run_episode(london_system)
+                times.append(time.perf_counter() - started)
+        overhead = np.median(np.array(recorded) / np.array(plain)) - 1
+        print(
+            f"Without recorder {1 / np.median(plain):.0f} games/s, with {1 / np.median(recorded):.0f} games/s"
+        )
+        print(
+            f"Overhead {100 * overhead:.2f}% (median of the per seed ratios), "
+            f"{recorder.count / args.games:.0f} events per game"
+        )
+    elif args.dump:
+        events, meta = load_dump(args.dump)
+        print(
+            f"{meta['count']} events over {meta['games']} games recorded by pid {meta['pid']} at "
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['time']))}"
+        )
+        first = meta["count"] - len(events)
+        decoded = decode_events(events)
+        if args.last is not None:
+            first += max(len(decoded) - args.last, 0)
+            decoded = decoded[-args.last :] if args.last else []
+        for number, (name, fields) in enumerate(decoded, first):
+            print(f"#{number:<8} {format_event(name, fields)}")
+        if meta["reason"]:
+            print(meta["reason"].rstrip())
+    else:
+        parser.error("give a dump to print, --benchmark or --check")
@@ -1,152 +1,330 @@
+import copy
+import queue
+import random
+import threading
 from argparse import ArgumentParser
 
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.backend_bases import MouseButton
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
 from matplotlib.widgets import Button
 
+from board_geometry import BOUNDARIES, DEFAULT_RIVER, to_board
 from graph import CardType, NodeLocation
 from london_system import LondonSystem
 
+# how often the gui looks for finished hints, in milliseconds
+HINT_POLL_INTERVAL = 100
+HINT_SEARCHES = ["off", "greedy", "rollout"]
 
-def draw_boundaries(graph_ax):
-    # draw outline around board
-    graph_ax.plot([-0.5, -0.5], [-0.5, 9.7], "k-")
-    graph_ax.plot([-0.5, 9.5], [-0.5, -0.5], "k-")
-    graph_ax.plot([9.5, 9.5], [9.7, -0.5], "k-")
-    graph_ax.plot([9.5, -0.5], [9.7, 9.7], "k-")
-    # draw top left corner line
-    graph_ax.plot([-0.5, 0.5], [8.5, 8.5], "k-")
-    graph_ax.plot([0.5, 0.5], [8.5, 9.7], "k-")
-    # draw top right corner line
-    graph_ax.plot([9.5, 8.5], [8.5, 8.5], "k-")
-    graph_ax.plot([8.5, 8.5], [8.5, 9.7], "k-")
-    # draw bottom left corner line
-    graph_ax.plot([-0.5, 0.5], [0.5, 0.5], "k-")
-    graph_ax.plot([0.5, 0.5], [0.5, -0.5], "k-")
-    # draw bottom right corner line
-    graph_ax.plot([9.5, 8.5], [0.5, 0.5], "k-")
-    graph_ax.plot([8.5, 8.5], [0.5, -0.5], "k-")
-
-    # draw inner boundaries
-    graph_ax.plot([-0.5, 9.5], [6.5, 6.5], "k-")
-    graph_ax.plot([-0.5, 9.5], [2.5, 2.5], "k-")
-    graph_ax.plot([2.5, 2.5], [-0.5, 9.7], "k-")
-    graph_ax.plot([6.5, 6.5], [-0.5, 9.7], "k-")
+
+def draw_boundaries(graph_ax, scale=1):
+    segments = [
+        np.column_stack([to_board(x, scale), to_board(y, scale)]) for x, y in BOUNDARIES
+    ]
+    graph_ax.add_collection(LineCollection(segments, colors="k"))
+
+
+def node_icon(node):
+    if node.type == CardType.CIRCLE:
+        return "●" if node.tourist or node.start else "○"
+    elif node.type == CardType.SQUARE:
+        return "■" if node.tourist or node.start else "□"
+    elif node.type == CardType.TRIANGLE:
+        return "▲" if node.tourist or node.start else "△"
+    elif node.type == CardType.PENTAGON:
+        return "✪" if node.tourist or node.start else "⬠"
+    return "?"
 
 
 def draw_nodes(graph, graph_ax):
+    fontsize = max(4, 12 / graph.scale)
     for node in graph.nodes:
-        if node.type == CardType.CIRCLE:
-            icon = "●" if node.tourist or node.start else "○"
-        elif node.type == CardType.SQUARE:
-            icon = "■" if node.tourist or node.start else "□"
-        elif node.type == CardType.TRIANGLE:
-            icon = "▲" if node.tourist or node.start else "△"
-        elif node.type == CardType.PENTAGON:
-            icon = "✪" if node.tourist or node.start else "⬠"
-        else:
-            icon = "?"
         color = node.color if node.start else "black"
         fontweight = "bold" if node.start else "normal"
         graph_ax.text(
             node.xy[0],
             node.xy[1] - 0.08,
-            icon,
-            fontsize=12,
+            node_icon(node),
+            fontsize=fontsize,
             color=color,
             ha="center",
             fontweight=fontweight,
         )
 
-        if node.highlighted:
-            # draw a box around the node
-            graph_ax.plot(
-                [node.xy[0] - 0.2, node.xy[0] + 0.2],
-                [node.xy[1] + 0.22, node.xy[1] + 0.22],
-                "r-",
-            )
-            graph_ax.plot(
-                [node.xy[0] - 0.2, node.xy[0] + 0.2],
-                [node.xy[1] - 0.22, node.xy[1] - 0.22],
-                "r-",
-            )
-            graph_ax.plot(
-                [node.xy[0] - 0.2, node.xy[0] - 0.2],
-                [node.xy[1] - 0.22, node.xy[1] + 0.22],
-                "r-",
+
+def draw_river(graph, graph_ax):
+    river = np.asarray(graph.river if graph.river is not None else DEFAULT_RIVER)
+    graph_ax.plot(river[:, 0], river[:, 1], "b-")
+
+
+def playout(game, rng):
+    # finishes the game with random cards, colors and moves from rng, leaving the random module alone so the
+    # game being played in the gui deals the same cards with or without hints
+    while True:
+        if game.red_cards_played == 5 or not game.cards:
+            if not game.colors:
+                break
+            game.next_color(rng.choice(game.colors))
+            continue
+        game.draw_card(rng.choice(game.cards))
+        actions = game.legal_actions()
+        if actions:
+            game.apply_action(rng.choice(actions))
+    return sum(game.calculate_score().values())
+
+
+def rank_moves(game, search="greedy", rollouts=16, rng=None, cancelled=None):
+    # the legal actions for the current card, best first, with their value: the immediate score change for
+    # greedy, the mean final score of random playouts after the move for rollout. returns None as soon as
+    # cancelled() is true.
+    actions = game.legal_actions()
+    if search == "greedy":
+        deltas = game.evaluate_moves().score_delta.tolist()
+        return sorted(zip(actions, deltas), key=lambda hint: -hint[1])
+    rng = rng or random.Random()
+    ranked = []
+    for action in actions:
+        after = copy.deepcopy(game)
+        # the copies would otherwise log every move and score of their playouts like the game in the gui
+        after.verbose = False
+        after.apply_action(action)
+        total = 0
+        for _ in range(rollouts):
+            if cancelled is not None and cancelled():
+                return None
+            total += playout(copy.deepcopy(after), rng)
+        ranked.append((action, total / rollouts))
+    return sorted(ranked, key=lambda hint: -hint[1])
+
+
+# works out move hints away from the gui thread. every submit or cancel starts a new generation, a search
+# checks it between playouts and stops once it is stale, and only results of the current generation are ever
+# handed back. the search works on a copy of the game taken when it was submitted, and the gui picks results
+# up with poll from a timer, so matplotlib is only touched from its own thread.
+class HintWorker:
+    def __init__(self, search="greedy", rollouts=16, count=3):
+        self.search = search
+        self.rollouts = rollouts
+        self.count = count
+        self.generation = 0
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.generation += 1
+
+    def submit(self, london_system):
+        self.cancel()
+        game = copy.deepcopy(london_system)
+        game.verbose = False
+        self.requests.put((self.generation, game))
+
+    def run(self):
+        rng = random.Random()
+        while True:
+            generation, game = self.requests.get()
+            if generation != self.generation:
+                continue
+            hints = rank_moves(
+                game,
+                self.search,
+                self.rollouts,
+                rng,
+                lambda: generation != self.generation,
             )
-            graph_ax.plot(
-                [node.xy[0] + 0.2, node.xy[0] + 0.2],
-                [node.xy[1] - 0.22, node.xy[1] + 0.22],
-                "r-",
+            if hints is not None:
+                self.results.put((generation, hints[: self.count]))
+
+    def poll(self):
+        # the hints of the latest submit if they are ready, otherwise None
+        hints = None
+        while True:
+            try:
+                generation, result = self.results.get_nowait()
+            except queue.Empty:
+                return hints
+            if generation == self.generation:
+                hints = result
+
+
+class BoardView:
+    # the static parts of the board (boundaries, river, node glyphs) are drawn once and cached as the blit
+    # background. edges, highlights and the card text are animated artists that are redrawn on top of it.
+    def __init__(self, graph, graph_ax, card_ax):
+        self.graph = graph
+        self.graph_ax = graph_ax
+        self.card_ax = card_ax
+        self.canvas = graph_ax.figure.canvas
+        self.background = None
+
+        self.coords = np.array([node.xy for node in graph.nodes], dtype=float)
+        self.node_index = {tuple(node.xy): i for i, node in enumerate(graph.nodes)}
+        self.edge_index = {id(edge): i for i, edge in enumerate(graph.edges)}
+        self.highlighted = []
+        self.edge_colors = {}
+
+        graph_ax.cla()
+        low, high = to_board([-1, 10], graph.scale)
+        graph_ax.set_xlim(low, high)
+        graph_ax.set_ylim(low, high)
+        draw_nodes(graph, graph_ax)
+        draw_boundaries(graph_ax, graph.scale)
+        draw_river(graph, graph_ax)
+        graph_ax.axis("off")
+
+        # unclaimed edges never change, so they are part of the background and only claimed edges are redrawn
+        self.segments = np.array(
+            [[edge.node1.xy, edge.node2.xy] for edge in graph.edges], dtype=float
+        ).reshape(-1, 2, 2)
+        graph_ax.add_collection(
+            LineCollection(
+                self.segments, colors="black", linewidths=0.2, linestyles="--"
             )
+        )
+        self.claimed = LineCollection(
+            [], linewidths=0.8, linestyles="--", animated=True
+        )
+        graph_ax.add_collection(self.claimed)
+        self.highlights = LineCollection([], colors="r", animated=True)
+        graph_ax.add_collection(self.highlights)
 
+        # the hint overlay: the suggested edges, their ranks and values at the target nodes, and a summary line
+        self.hint_lines = LineCollection(
+            [], colors="limegreen", linewidths=2.5, alpha=0.7, animated=True
+        )
+        graph_ax.add_collection(self.hint_lines)
+        self.hint_labels = []
+        self.hint_text = graph_ax.text(
+            0.5, 1.0, "", transform=graph_ax.transAxes, ha="center", animated=True
+        )
 
-def draw_edges(graph, graph_ax):
-    for edge in graph.edges:
-        x_values = [edge.node1.xy[0], edge.node2.xy[0]]
-        y_values = [edge.node1.xy[1], edge.node2.xy[1]]
-        color = edge.color
-        line_width = 0.2
-        if color != "black":
-            line_width = 0.8
-        # draw the edge dotted and thin
-        graph_ax.plot(
-            x_values, y_values, color=color, linestyle="--", linewidth=line_width
+        card_ax.cla()
+        card_ax.axis("off")
+        self.card_text = card_ax.text(
+            0.5, 0.5, "", fontsize=12, ha="center", animated=True
         )
 
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def on_draw(self, event):
+        # a full draw happened (first show, resize), so the cached background has to be captured again
+        self.background = self.canvas.copy_from_bbox(self.graph_ax.figure.bbox)
+        self.draw_animated()
+
+    def draw_animated(self):
+        self.graph_ax.draw_artist(self.claimed)
+        self.graph_ax.draw_artist(self.highlights)
+        self.graph_ax.draw_artist(self.hint_lines)
+        for label in self.hint_labels:
+            self.graph_ax.draw_artist(label)
+        self.graph_ax.draw_artist(self.hint_text)
+        self.card_ax.draw_artist(self.card_text)
 
-def redraw_graph(graph, graph_ax):
-    graph_ax.cla()  # Clear only the graph axes
-    graph_ax.set_xlim(-1, 10)
-    graph_ax.set_ylim(-1, 10)
-    draw_nodes(graph, graph_ax)
-    draw_edges(graph, graph_ax)
-    draw_boundaries(graph_ax)
-
-    def river(x):
-        if -0.5 <= x <= 2:
-            return 5.5
-        elif 2 < x <= 4:
-            return 7.5 - x
-        elif 4 < x <= 5:
-            return 3.5
-        elif 5 < x <= 6:
-            return x - 1.5
-        elif 6 < x <= 9.5:
-            return 4.5
-
-    x_river = np.linspace(-0.5, 9.5, 1000)
-    y_river = np.array([river(x) for x in x_river])
-    graph_ax.plot(x_river, y_river, "b-")
-    graph_ax.axis("off")
-    plt.draw()  # Refresh the plot
-
-
-def show_card(card, card_ax):
-    card_ax.cla()
+    def set_hints(self, hints, search=""):
+        # hints are (action, value) pairs, best first. no hints clears the overlay
+        while len(self.hint_labels) < len(hints):
+            self.hint_labels.append(
+                self.graph_ax.text(
+                    0, 0, "", color="darkgreen", fontsize=8, animated=True
+                )
+            )
+        self.hint_lines.set_segments([self.segments[edge] for (edge, _, _), _ in hints])
+        for i, label in enumerate(self.hint_labels):
+            if i < len(hints):
+                (_, _, target), value = hints[i]
+                label.set_position(self.coords[target] + (0.15, 0.15))
+                label.set_text(f"{i + 1}: {value:.1f}")
+            else:
+                label.set_text("")
+        if hints:
+            self.hint_text.set_text(f"{search} hint, best value {hints[0][1]:.1f}")
+        else:
+            self.hint_text.set_text("")
+
+    def nearest_node(self, x, y):
+        distances = np.sum((self.coords - (x, y)) ** 2, axis=1)
+        return self.graph.nodes[int(np.argmin(distances))]
+
+    def update_edges(self):
+        # only the claimed edges are drawn on top of the background, and only rebuilt when a claim changed
+        colors = {}
+        for color, edges in self.graph.railroad_edges.items():
+            for edge in edges:
+                colors[self.edge_index[id(edge)]] = edge.color
+        if colors == self.edge_colors:
+            return
+        self.edge_colors = colors
+        claimed = list(colors)
+        self.claimed.set_segments(self.segments[claimed])
+        self.claimed.set_color([to_rgba(colors[i]) for i in claimed])
+
+    def update_highlights(self):
+        # only the current node, the color tracks and whatever was highlighted before can be highlighted now
+        candidates = set(self.highlighted)
+        nodes = [self.graph.curr_node] if self.graph.curr_node is not None else []
+        for track in self.graph.railroad_nodes.values():
+            nodes.extend(track)
+        for node in nodes:
+            candidates.add(self.node_index[tuple(node.xy)])
+        highlighted = sorted(i for i in candidates if self.graph.nodes[i].highlighted)
+        if highlighted == self.highlighted:
+            return
+        self.highlighted = highlighted
+        # draw a box around every highlighted node
+        x = self.coords[highlighted, 0][:, None]
+        y = self.coords[highlighted, 1][:, None]
+        corners_x = np.hstack([x - 0.2, x + 0.2, x + 0.2, x - 0.2, x - 0.2])
+        corners_y = np.hstack([y + 0.22, y + 0.22, y - 0.22, y - 0.22, y + 0.22])
+        self.highlights.set_segments(list(np.stack([corners_x, corners_y], axis=2)))
+
+    def set_card_text(self, text, fontsize=12, y=0.5):
+        self.card_text.set_text(text)
+        self.card_text.set_fontsize(fontsize)
+        self.card_text.set_y(y)
+
+    def refresh(self):
+        self.update_edges()
+        self.update_highlights()
+        if self.background is None:
+            # nothing has been drawn yet, the first draw_event will capture the background
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_animated()
+        self.canvas.blit(self.graph_ax.figure.bbox)
+
+
+def show_card(card, board_view):
     try:
-        card_ax.text(
-            0.5, 0.5, f"{card.type.name} {card.color}", fontsize=12, ha="center"
-        )
+        board_view.set_card_text(f"{card.type.name} {card.color}")
     except AttributeError:
-        card_ax.text(0.5, 0.5, f"Switching Colors To {card}!", fontsize=12, ha="center")
-    card_ax.axis("off")
-    plt.draw()
+        board_view.set_card_text(f"Switching Colors To {card}!")
+    board_view.refresh()
+
 
+def show_scores(scores, total_score, board_view):
+    scores_text = "\n".join(f"{key}: {value}" for key, value in scores.items())
+    scores_text += f"\nTotal: {total_score}"
+    board_view.set_card_text(f"Scores:\n{scores_text}", fontsize=8, y=0.01)
+    board_view.refresh()
 
-def restart_game(event, london_system, graph_ax):
+
+def restart_game(event, london_system, board_view):
     if london_system.colors == []:
         # add a calculate score function
         london_system.start_game()
-        redraw_graph(london_system.graph, graph_ax)
     else:
         london_system.start_game()
-        redraw_graph(london_system.graph, graph_ax)
+    board_view.set_card_text("")
+    board_view.refresh()
 
 
-def play_game(london_system):
+def play_game(london_system, hint_worker=None):
     london_system.start_game()
     fig, graph_ax = plt.subplots(
         figsize=(8, 8)
@@ -162,84 +340,69 @@ def play_game(london_system):
     )
 
     # Draw the initial graph
-    redraw_graph(london_system.graph, graph_ax)
+    board_view = BoardView(london_system.graph, graph_ax, card_ax)
+    board_view.refresh()
 
     # Add a button in a separate axes below the graph
     ax_button = plt.axes([0.8, 0.01, 0.1, 0.075])
     button = Button(ax_button, "Draw Card", color="lightgray", hovercolor="gray")
 
+    def clear_hints():
+        if hint_worker is not None:
+            hint_worker.cancel()
+            board_view.set_hints([])
+
     def draw_card(event):
-        if london_system.graph.railroad_nodes[london_system.graph.curr_color] == []:
-            london_system.graph.railroad_nodes[london_system.graph.curr_color].append(
-                london_system.graph.get_start_node()
-            )
-            print(f"London System railroad_nodes: {london_system.graph.railroad_nodes}")
+        clear_hints()
         card = london_system.draw_card()
-        redraw_graph(london_system.graph, graph_ax)
+        if card is not None and hint_worker is not None:
+            hint_worker.submit(london_system)
         try:
             print(f"Card: {card.type.name} {card.color}")
-            show_card(card, card_ax)
+            show_card(card, board_view)
         except AttributeError:
             print(f"Time To Switch Colors!")
             new_color = london_system.next_color()
             print(f"New Color: {new_color}")
             if new_color is None:
-                show_card("No More Colors!", card_ax)
                 scores = london_system.calculate_score()
                 total_score = sum(scores.values())
                 print(f"Scores: {scores}")
                 print(f"Total Score: {total_score}")
-                card_ax.cla()
-                card_ax.axis("off")
-                scores_text = "\n".join(
-                    f"{key}: {value}" for key, value in scores.items()
-                )
-                scores_text += f"\nTotal: {total_score}"
-                card_ax.text(
-                    0.5, 0.01, f"Scores:\n{scores_text}", fontsize=8, ha="center"
-                )
+                show_scores(scores, total_score, board_view)
             else:
-                show_card(new_color, card_ax)
+                show_card(new_color, board_view)
 
     def on_click(event):
         if event.inaxes == graph_ax:  # Ensure the click is on the graph axes
             if event.button == MouseButton.LEFT:
-                distances = [
-                    np.linalg.norm(
-                        np.array([event.xdata, event.ydata]) - np.array(node.xy)
-                    )
-                    for node in london_system.graph.nodes
-                ]
-                closest_node = london_system.graph.nodes[np.argmin(distances)]
+                # whatever the click does, the hints for the position before it are stale
+                clear_hints()
+                closest_node = board_view.nearest_node(event.xdata, event.ydata)
                 if closest_node.highlighted:
-                    london_system.graph.unhighlight_all_color()
-                    closest_node.highlighted = True
-                    london_system.graph.curr_node = closest_node
-                    london_system.graph.chose_after_swap = True
-                    london_system.graph.swap = False
+                    london_system.reanchor(closest_node)
                 else:
-                    adjacent_nodes = london_system.graph.get_adjacent(
-                        london_system.curr_card
-                    )
-                    if (
-                        closest_node in adjacent_nodes
-                        and london_system.curr_card is not None
-                    ):
-                        london_system.graph.curr_node.highlighted = False
-                        # this will need to be updated if I add a confirm button
-                        london_system.graph.railroad_nodes[
-                            london_system.graph.curr_color
-                        ].append(closest_node)
-                        london_system.graph.choose_edge(
-                            closest_node, london_system.graph.curr_color
-                        )
-                        closest_node.highlighted = not closest_node.highlighted
-                        london_system.curr_card = None
-                redraw_graph(london_system.graph, graph_ax)  # Redraw the graph
+                    # this will need to be updated if I add a confirm button
+                    london_system.choose_node(closest_node)
+                board_view.refresh()  # Redraw the changed parts of the graph
+
+    def restart(event):
+        clear_hints()
+        restart_game(event, london_system, board_view)
+
+    def poll_hints():
+        hints = hint_worker.poll()
+        if hints is not None:
+            board_view.set_hints(hints, hint_worker.search)
+            board_view.refresh()
 
     fig.canvas.mpl_connect("button_press_event", on_click)
     button.on_clicked(draw_card)
-    reset_button.on_clicked(lambda event: restart_game(event, london_system, graph_ax))
+    reset_button.on_clicked(restart)
+    if hint_worker is not None:
+        timer = fig.canvas.new_timer(interval=HINT_POLL_INTERVAL)
+        timer.add_callback(poll_hints)
+        timer.start()
     plt.show()
 
 
@@ -248,8 +411,26 @@ if __name__ == "__main__":
     parser.add_argument(
         "--custom", "-c", default="london_system_default.json", help="Custom graph file"
     )
+    parser.add_argument(
+        "--hints",
+        choices=HINT_SEARCHES,
+        default="off",
+        help="Suggest moves after every draw",
+    )
+    parser.add_argument(
+        "--hint-rollouts",
+        type=int,
+        default=16,
+        help="Random playouts per move for rollout hints",
+    )
+    parser.add_argument(
+        "--hint-count", type=int, default=3, help="Number of moves to suggest"
+    )
     args = parser.parse_args()
     london_system = LondonSystem()
     london_system.load_graph(args.custom)
     london_system.reset_deck()
-    play_game(london_system)
+    hint_worker = None
+    if args.hints != "off":
+        hint_worker = HintWorker(args.hints, args.hint_rollouts, args.hint_count)
+    play_game(london_system, hint_worker)
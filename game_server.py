@@ -0,0 +1,352 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board_registry import build_graph, node_arrays
+from board_tables import BoardTables
+from london_system import COLORS, LondonSystem
+
+# the protocol is one json object per line each way. requests look like
+#   {"id": 1, "cmd": "draw_card", "session": "3"}
+# and every request gets one response with the same id, either {"id": 1, "ok": true, "result": ...}
+# or {"id": 1, "ok": false, "error": "..."}. commands:
+#   new [seed]               open a session, the result is its id
+#   start_game [color]       start a game, the result is the first color
+#   draw_card                the card drawn, or null when the color is over
+#   next_color [color]       the next color, or null when the game is over
+#   legal                    the legal [edge, from node, to node] actions for the current card
+#   choose action            play one of the legal actions
+#   score                    calculate_score with the total added
+#   close                    close the session
+
+
+# a request the server can't carry out, reported back to the client
+class RequestError(Exception):
+    pass
+
+
+def card_json(card):
+    if card is None:
+        return None
+    return {"type": card.type.name, "color": card.color}
+
+
+class Session:
+    def __init__(self, london_system, seed):
+        self.london_system = london_system
+        # sessions draw from their own random numbers so a seed gives the same game whatever else is running
+        self.rng = random.Random(seed)
+        self.last_used = time.monotonic()
+
+
+# hosts many games in one process. the board is loaded and compiled once and every session builds its own
+# graph from the shared arrays, which is much cheaper than loading or copying it.
+class GameServer:
+    def __init__(self, board, idle_timeout=300.0, max_sessions=10000):
+        template = LondonSystem()
+        template.verbose = False
+        template.load_graph(board)
+        self.graph = template.graph
+        self.tables = BoardTables(self.graph)
+        self.node_arrays = node_arrays(self.graph)
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.requests = 0
+        self.evicted = 0
+        self.commands = {
+            "new": self.new_session,
+            "start_game": self.start_game,
+            "draw_card": self.draw_card,
+            "next_color": self.next_color,
+            "legal": self.legal,
+            "choose": self.choose,
+            "score": self.score,
+            "close": self.close,
+        }
+
+    def new_session(self, request):
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise ValueError("Too many sessions")
+        london_system = LondonSystem()
+        london_system.verbose = False
+        london_system.graph = build_graph(
+            self.tables, *self.node_arrays, self.graph.river, self.graph.scale
+        )
+        session_id = str(next(self.session_ids))
+        self.sessions[session_id] = Session(london_system, request.get("seed"))
+        return session_id
+
+    def session(self, request):
+        session = self.sessions.get(str(request.get("session")))
+        if session is None:
+            raise RequestError(f"No session {request.get('session')}")
+        session.last_used = time.monotonic()
+        return session
+
+    def start_game(self, request):
+        session = self.session(request)
+        london_system = session.london_system
+        color = request.get("color")
+        # checked before anything changes, a bad request leaves the session as it was
+        if color is not None and color not in COLORS:
+            raise RequestError(f"Unknown color {color}")
+        if color is None:
+            color = session.rng.choice(COLORS)
+        # start_game leaves the swap and the card of the last game alone, a new game in a session starts clean
+        london_system.graph.swap = False
+        london_system.graph.chose_after_swap = True
+        london_system.curr_card = None
+        london_system.start_game(color)
+        return london_system.graph.curr_color
+
+    def draw_card(self, request):
+        session = self.session(request)
+        london_system = session.london_system
+        card = session.rng.choice(london_system.cards) if london_system.cards else None
+        return card_json(london_system.draw_card(card))
+
+    def next_color(self, request):
+        session = self.session(request)
+        london_system = session.london_system
+        color = request.get("color")
+        if color is None:
+            if not london_system.colors:
+                return None
+            color = session.rng.choice(london_system.colors)
+        elif color not in london_system.colors:
+            raise RequestError(f"Color {color} isn't left to play")
+        return london_system.next_color(color)
+
+    def legal(self, request):
+        return self.session(request).london_system.legal_actions()
+
+    def choose(self, request):
+        london_system = self.session(request).london_system
+        if "action" not in request:
+            raise RequestError("choose needs an action")
+        action = tuple(request["action"])
+        edge = london_system.apply_action(action)
+        return {"edge": action[0], "color": edge.color}
+
+    def score(self, request):
+        scores = self.session(request).london_system.calculate_score()
+        scores["total"] = sum(scores.values())
+        return scores
+
+    def close(self, request):
+        return self.sessions.pop(str(request.get("session")), None) is not None
+
+    def handle(self, request):
+        self.requests += 1
+        response = {"id": request.get("id")}
+        command = self.commands.get(request.get("cmd"))
+        if command is None:
+            response["ok"] = False
+            response["error"] = f"Unknown command {request.get('cmd')}"
+            return response
+        try:
+            response["result"] = command(request)
+            response["ok"] = True
+        except (RequestError, ValueError, TypeError, IndexError) as error:
+            response["ok"] = False
+            response["error"] = str(error)
+        except Exception as error:
+            # a bug in a command fails the request, not the connection and its other sessions
+            response["ok"] = False
+            response["error"] = f"Internal error: {type(error).__name__}: {error}"
+        return response
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [
+            key for key, session in self.sessions.items() if session.last_used < cutoff
+        ]
+        for key in idle:
+            del self.sessions[key]
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def evict_periodically(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 30.0))
+            self.evict_idle()
+
+    async def client_connected(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as error:
+                    response = {"id": None, "ok": False, "error": f"Bad json: {error}"}
+                else:
+                    if isinstance(request, dict):
+                        response = self.handle(request)
+                    else:
+                        response = {"id": None, "ok": False, "error": "Not an object"}
+                try:
+                    data = json.dumps(response)
+                except (TypeError, ValueError) as error:
+                    data = json.dumps(
+                        {
+                            "id": (
+                                request.get("id") if isinstance(request, dict) else None
+                            ),
+                            "ok": False,
+                            "error": f"Internal error: {error}",
+                        }
+                    )
+                writer.write(data.encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.client_connected, path)
+        else:
+            server = await asyncio.start_server(self.client_connected, host, port)
+        eviction = asyncio.ensure_future(self.evict_periodically())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            eviction.cancel()
+
+
+class GameClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.latencies = []
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765, path=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, cmd, **arguments):
+        started = time.perf_counter()
+        request = {"id": next(self.ids), "cmd": cmd, **arguments}
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        response = json.loads(await self.reader.readline())
+        self.latencies.append(time.perf_counter() - started)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    async def play_game(self, rng):
+        # a whole game with random moves, like rollout.run_episode over the protocol
+        session = await self.request("new", seed=rng.getrandbits(32))
+        await self.request("start_game", session=session)
+        while True:
+            card = await self.request("draw_card", session=session)
+            if card is None:
+                if await self.request("next_color", session=session) is None:
+                    break
+                continue
+            actions = await self.request("legal", session=session)
+            if actions:
+                await self.request(
+                    "choose", session=session, action=rng.choice(actions)
+                )
+        scores = await self.request("score", session=session)
+        await self.request("close", session=session)
+        return scores
+
+    def close(self):
+        self.writer.close()
+
+
+async def load_test(clients, games, host="127.0.0.1", port=8765, path=None, seed=0):
+    connected = [await GameClient.connect(host, port, path) for _ in range(clients)]
+    games_left = iter(range(games))
+
+    async def run(client, rng):
+        totals = []
+        while next(games_left, None) is not None:
+            totals.append((await client.play_game(rng))["total"])
+        return totals
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *[run(client, random.Random(seed + i)) for i, client in enumerate(connected)]
+    )
+    elapsed = time.perf_counter() - started
+    for client in connected:
+        client.close()
+    latencies = np.concatenate([client.latencies for client in connected])
+    totals = [total for result in results for total in result]
+    return {
+        "games": len(totals),
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "mean_score": float(np.mean(totals)),
+        "latency_p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "latency_p90_ms": 1000 * float(np.percentile(latencies, 90)),
+        "latency_p99_ms": 1000 * float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--unix", help="Listen on this unix socket instead")
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=300,
+        help="Seconds before an idle session is closed",
+    )
+    parser.add_argument(
+        "--max-sessions", type=int, default=10000, help="Most open sessions"
+    )
+    parser.add_argument(
+        "--load-test",
+        action="store_true",
+        help="Run the load test client against a server",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=100, help="Load test connections"
+    )
+    parser.add_argument("--games", type=int, default=1000, help="Load test games")
+    args = parser.parse_args()
+
+    if args.load_test:
+        report = asyncio.run(
+            load_test(args.clients, args.games, args.host, args.port, args.unix)
+        )
+        for name, value in report.items():
+            print(
+                f"{name}: {value:.3f}"
+                if isinstance(value, float)
+                else f"{name}: {value}"
+            )
+    else:
+        game_server = GameServer(args.custom, args.idle_timeout, args.max_sessions)
+        where = args.unix or f"{args.host}:{args.port}"
+        print(f"Serving {args.custom} on {where}")
+        asyncio.run(game_server.serve(args.host, args.port, args.unix))
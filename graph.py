@@ -1,3 +1,5 @@
+import itertools
+import random
 from enum import Enum
 
 
@@ -27,6 +29,8 @@ class NodeLocation(Enum):
 
 
 class Node:
+    __slots__ = ("type", "tourist", "location", "xy", "start", "color", "highlighted")
+
     def __init__(
         self,
         type=None,
@@ -68,10 +72,22 @@ class Node:
 
 
 class Edge:
-    def __init__(self, node1=None, node2=None, blocks_edges=[], crosses_river=False):
+    __slots__ = (
+        "node1",
+        "node2",
+        "blocks_edges",
+        "blocked",
+        "crosses_river",
+        "highlighted",
+        "target",
+        "color",
+    )
+
+    def __init__(self, node1=None, node2=None, blocks_edges=None, crosses_river=False):
         self.node1 = node1
         self.node2 = node2
-        self.blocks_edges = blocks_edges
+        # every edge gets its own list, a shared default would be changed through any one of them
+        self.blocks_edges = blocks_edges if blocks_edges is not None else []
         self.blocked = False
         self.crosses_river = crosses_river
         self.highlighted = False
@@ -107,6 +123,14 @@ class Edge:
         return self.node1 == other.node1 and self.node2 == other.node2
 
 
+def node_key(node):
+    # nodes are compared by position, and the same position can show up as a list or a tuple
+    return tuple(node.xy)
+
+
+_index_tokens = itertools.count(1)
+
+
 class Graph:
     def __init__(self):
         self.nodes = []
@@ -117,6 +141,19 @@ class Graph:
         self.curr_color = None
         self.swap = False
         self.chose_after_swap = True
+        # custom boards can bring their own river polyline and size, the default board uses neither
+        self.river = None
+        self.scale = 1
+        # the edge index and the railroad frontiers are built lazily, see ensure_index
+        self._indexed = None
+        self.incident = {}
+        self.edge_lookup = {}
+        self.node_index = {}
+        self.edge_ids = {}
+        self._frontiers = {}
+        self.index_token = 0
+        # zobrist hash of the blocked edges, kept up to date as edges are blocked and unblocked
+        self.blocked_hash = 0
 
     def add_node(self, node):
         self.nodes.append(node)
@@ -124,6 +161,39 @@ class Graph:
     def add_edge(self, edge):
         self.edges.append(edge)
 
+    # the edges of each node and the edge between every pair of nodes are indexed so we don't have to scan
+    # every edge. the index is rebuilt whenever the node or edge lists are replaced or grow.
+    def ensure_index(self):
+        indexed = (id(self.nodes), len(self.nodes), id(self.edges), len(self.edges))
+        if self._indexed == indexed:
+            return
+        self.node_index = {node_key(node): i for i, node in enumerate(self.nodes)}
+        self.incident = {key: [] for key in self.node_index}
+        self.edge_lookup = {}
+        self.edge_ids = {id(edge): i for i, edge in enumerate(self.edges)}
+        for i, edge in enumerate(self.edges):
+            key1 = node_key(edge.node1)
+            key2 = node_key(edge.node2)
+            self.incident.setdefault(key1, []).append(i)
+            if key2 != key1:
+                self.incident.setdefault(key2, []).append(i)
+            # get_edge has always returned the first matching edge, so later duplicates are ignored
+            self.edge_lookup.setdefault((key1, key2), i)
+            self.edge_lookup.setdefault((key2, key1), i)
+        self._frontiers = {}
+        # a new token every time any graph is indexed, so caches keyed on it never mix up two boards, or a board
+        # before and after it changed, the way a reused id() or the fixed zobrist seeds can
+        self.index_token = next(_index_tokens)
+        # fixed seeds so that the same board always hashes the same way
+        rng = random.Random(0)
+        self._edge_hashes = [rng.getrandbits(64) for _ in self.edges]
+        self._node_hashes = {key: rng.getrandbits(64) for key in self.incident}
+        self.blocked_hash = 0
+        for i, edge in enumerate(self.edges):
+            if edge.blocked:
+                self.blocked_hash ^= self._edge_hashes[i]
+        self._indexed = indexed
+
     def get_start_node(self):
         for node in self.nodes:
             if node.start and node.color == self.curr_color:
@@ -138,9 +208,77 @@ class Graph:
         for node in self.railroad_nodes[self.curr_color]:
             node.highlighted = False
 
+    @staticmethod
+    def matches(card, node):
+        return (
+            node.type == card.type
+            or card.type == CardType.RANDOM
+            or node.type == CardType.RANDOM
+        )
+
+    # every color keeps a frontier: the unblocked edges leaving any node on its track, bucketed by the type of
+    # the node they lead to. it is extended when nodes are appended to railroad_nodes and edges are dropped
+    # from it as they are blocked, so moves after a railroad swap are a lookup instead of a scan per track node.
+    def frontier(self, color):
+        self.ensure_index()
+        track = self.railroad_nodes[color]
+        state = self._frontiers.get(color)
+        if state is None or state["track"] is not track or state["size"] > len(track):
+            state = {
+                "track": track,
+                "size": 0,
+                "positions": {},
+                "buckets": {card_type: {} for card_type in CardType},
+                "by_edge": {},
+                "hash": 0,
+            }
+            self._frontiers[color] = state
+        positions = state["positions"]
+        for position in range(state["size"], len(track)):
+            key = node_key(track[position])
+            # a node visited twice is only expanded the first time
+            if key in positions:
+                continue
+            positions[key] = position
+            state["hash"] ^= self._node_hashes[key]
+            for i in self.incident.get(key, []):
+                edge = self.edges[i]
+                if edge.blocked:
+                    continue
+                other = edge.node2 if node_key(edge.node1) == key else edge.node1
+                state["buckets"][other.type][(i, key)] = other
+                state["by_edge"].setdefault(i, []).append((other.type, (i, key)))
+        state["size"] = len(track)
+        return state
+
+    # zobrist hash of the distinct nodes on a color track
+    def track_hash(self, color):
+        return self.frontier(color)["hash"]
+
+    def frontier_moves(self, color, card):
+        # returns (edge index, from key, target node) for every move the card allows from anywhere on the track,
+        # in track order and then edge order like the old recursive search
+        state = self.frontier(color)
+        if card.type == CardType.RANDOM:
+            card_types = list(CardType)
+        else:
+            card_types = [card.type, CardType.RANDOM]
+        moves = []
+        for card_type in set(card_types):
+            for (i, key), target in state["buckets"][card_type].items():
+                if not self.edges[i].blocked:
+                    moves.append((state["positions"][key], i, key, target))
+        moves.sort(key=lambda move: move[:2])
+        return [(i, key, target) for _, i, key, target in moves]
+
+    def _blocked(self, i):
+        for state in self._frontiers.values():
+            for card_type, entry in state["by_edge"].pop(i, []):
+                state["buckets"][card_type].pop(entry, None)
+
     def get_adjacent(self, card=None, start_node=None):
         adj = []
-        # we have the start node as none initially so that the railroad use case can recursively call this function
+        # we have the start node as none initially so that the railroad use case can use the color track instead
         if start_node is None:
             start_node = self.curr_node
 
@@ -148,52 +286,62 @@ class Graph:
         if card is not None and card.type != CardType.RAILROAD and self.swap:
             self.swap = False
             # all of the valid nodes next to any node in the current color track are valid
-            for node in self.railroad_nodes[self.curr_color]:
-                adj += self.get_adjacent(card, node)
+            seen = set()
+            for _, _, target in self.frontier_moves(self.curr_color, card):
+                if node_key(target) not in seen:
+                    seen.add(node_key(target))
+                    adj.append(target)
             return adj
 
         # search the edges that connect to our current node and add them to the adjacent list if they are not blocked
         # and the next node is of the correct type
-        for edge in self.edges:
-            if edge.node1 == start_node and not edge.blocked:
-                if card is not None and (
-                    edge.node2.type == card.type
-                    or card.type == CardType.RANDOM
-                    or edge.node2.type == CardType.RANDOM
-                ):
-                    adj.append(edge.node2)
-                elif card is None:
-                    adj.append(edge.node2)
-            elif edge.node2 == start_node and not edge.blocked:
-                if card is not None and (
-                    edge.node1.type == card.type
-                    or card.type == CardType.RANDOM
-                    or edge.node1.type == CardType.RANDOM
-                ):
-                    adj.append(edge.node1)
-                elif card is None:
-                    adj.append(edge.node1)
+        self.ensure_index()
+        start_key = node_key(start_node)
+        for i in self.incident.get(start_key, []):
+            edge = self.edges[i]
+            if edge.blocked:
+                continue
+            if node_key(edge.node1) == start_key:
+                other = edge.node2
+            else:
+                other = edge.node1
+            if card is None or self.matches(card, other):
+                adj.append(other)
         return adj
 
-    # this searches all of the edges for the edge that contains the two nodes
+    # this looks up the edge that contains the two nodes
+    def get_edge_index(self, node1, node2):
+        self.ensure_index()
+        return self.edge_lookup.get((node_key(node1), node_key(node2)))
+
     def get_edge(self, node1, node2):
-        for edge in self.edges:
-            if edge.node1 == node1 and edge.node2 == node2:
-                return edge
-            elif edge.node1 == node2 and edge.node2 == node1:
-                return edge
-        return None
+        i = self.get_edge_index(node1, node2)
+        if i is None:
+            return None
+        return self.edges[i]
+
+    def block_edge_index(self, i):
+        self.ensure_index()
+        if not self.edges[i].blocked:
+            self.blocked_hash ^= self._edge_hashes[i]
+        self.edges[i].block()
+        self._blocked(i)
 
     # given two nodes, find the edge that connects them and block it
     def block_edge(self, node1, node2):
-        edge = self.get_edge(node1, node2)
-        if edge:
-            edge.block()
+        i = self.get_edge_index(node1, node2)
+        if i is not None:
+            self.block_edge_index(i)
 
     def unblock_edge(self, node1, node2):
-        edge = self.get_edge(node1, node2)
-        if edge:
+        i = self.get_edge_index(node1, node2)
+        if i is not None:
+            edge = self.edges[i]
+            if edge.blocked:
+                self.blocked_hash ^= self._edge_hashes[i]
             edge.unblock()
+            # the edge has to go back into the frontiers, so they are rebuilt on their next use
+            self._frontiers = {}
 
     # we must turn all edges back into black, and ensure they are not highlighted, blocked, or targeted
     def reset_graph(self):
@@ -202,6 +350,26 @@ class Graph:
             edge.highlighted = False
             edge.target = False
             edge.color = "black"
+        self._frontiers = {}
+        self.blocked_hash = 0
+
+    # after a railroad swap the edge is taken from the first node on the track that has an unblocked edge to the target
+    def swap_edge_source(self, target, color):
+        state = self.frontier(color)
+        target_key = node_key(target)
+        best = None
+        for i in self.incident.get(target_key, []):
+            edge = self.edges[i]
+            other = edge.node2 if node_key(edge.node1) == target_key else edge.node1
+            position = state["positions"].get(node_key(other))
+            if position is None or (best is not None and position >= best):
+                continue
+            first = self.edge_lookup[(node_key(other), target_key)]
+            if not self.edges[first].blocked:
+                best = position
+        if best is None:
+            return None
+        return self.railroad_nodes[color][best]
 
     # this function will add a desired edge to the graph. by default it'll use the current node, but it can be overridden
     def choose_edge(self, target, color, curr_node=None):
@@ -212,16 +380,16 @@ class Graph:
         if not self.chose_after_swap:
             self.chose_after_swap = True
             self.unhighlight_all_color()
-            for node in self.railroad_nodes[color]:
-                # this returns false if it fails to choose the edge.
-                if self.choose_edge(target, color, node):
-                    return True
-            return False
-
-        edge = self.get_edge(curr_node, target)
-        if edge and not edge.blocked:
+            source = self.swap_edge_source(target, color)
+            if source is None:
+                return False
+            return self.choose_edge(target, color, source)
+
+        i = self.get_edge_index(curr_node, target)
+        if i is not None and not self.edges[i].blocked:
+            edge = self.edges[i]
             # after choosing an edge, we must block it, change it to the correct color, and then block all edges that intersect with it
-            edge.block()
+            self.block_edge_index(i)
             edge.color = color
             for block_edge in edge.blocks_edges:
                 b_edge = self.edges[block_edge]
@@ -0,0 +1,543 @@
+import json
+import multiprocessing
+import random
+import time
+from argparse import ArgumentParser
+
+from board_tables import BoardTables
+from card import Card
+from graph import CardType
+from london_system import COLORS, MULTI_COLOR_SCORES, TOURIST_SCORES, LondonSystem
+from rollout import random_policy
+
+RAILROAD = CardType.RAILROAD.value
+MULTI_COLOR_VALUES = [MULTI_COLOR_SCORES.get(n, 0) for n in range(len(COLORS) + 1)]
+# scores are whole numbers, so a bound below the best score plus one can't beat it. the bounds are sums of
+# fractions, this keeps rounding from pruning a line that ties.
+EPSILON = 1e-9
+
+
+class SearchBudgetExceeded(Exception):
+    pass
+
+
+def bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def reset_game(london_system):
+    # start_game leaves the swap and the card of the last game alone, a deal is always played from neither
+    london_system.graph.swap = False
+    london_system.graph.chose_after_swap = True
+    london_system.curr_card = None
+
+
+def deal_for_seed(london_system, seed):
+    # the colors and cards draw_card and next_color deal after random.seed(seed) when nothing else draws random
+    # numbers, as a list of (color, cards) rounds. the cards of a round are every card drawn before it ended.
+    london_system.verbose = False
+    reset_game(london_system)
+    random.seed(seed)
+    london_system.start_game()
+    deal = [(london_system.graph.curr_color, [])]
+    while True:
+        card = london_system.draw_card()
+        if card is not None:
+            deal[-1][1].append(card)
+            continue
+        color = london_system.next_color()
+        if color is None:
+            return deal
+        deal.append((color, []))
+
+
+def play_deal(london_system, deal, policy=random_policy, line=None):
+    # plays a deal like rollout.run_episode plays a random game. with a line (one action or None per card, from
+    # HindsightOracle.solve) the line is played instead of the policy.
+    london_system.verbose = False
+    reset_game(london_system)
+    for r, (color, cards) in enumerate(deal):
+        if r == 0:
+            london_system.start_game(color)
+        else:
+            london_system.next_color(color)
+        for i, card in enumerate(cards):
+            london_system.draw_card(card)
+            if line is not None:
+                action = line[r][i]
+            else:
+                actions = london_system.legal_actions()
+                action = policy(london_system, actions) if actions else None
+            if action is not None:
+                london_system.apply_action(tuple(action))
+    return london_system.calculate_score()
+
+
+def deal_json(deal):
+    return [
+        [color, [[card.type.name, card.color] for card in cards]]
+        for color, cards in deal
+    ]
+
+
+def deal_from_json(data):
+    return [
+        (
+            color,
+            [Card(CardType[card_type], card_color) for card_type, card_color in cards],
+        )
+        for color, cards in data
+    ]
+
+
+# the best score a player could have reached knowing the whole deal in advance. the search goes through the
+# deal card by card, trying every legal action and skipping the card, on bitsets: nodes on each color track,
+# edges claimed by each color, and the blocked edges. states reached a second time are skipped.
+#
+# a round (one color) is cheap to search on its own, so every time a round starts the rest of the game is bounded
+# by searching each remaining round alone: its color score, plus a weight for every node it adds standing in for
+# the bi-, tri-, quad-color and tourist points. a node's weight is the most those points can gain per color
+# that could still add it, so the weights of the colors that end up adding it cover the points it scores.
+# the rounds after the current one ignore the edges the current one will block, which only loosens the bound.
+#
+# most of the time goes into the round searches of the bounds, which have to be redone whenever the tracks change
+# the weights. that is nowhere near thousands of seeds a minute, and it gets much slower as boards get denser. on
+# one core, generate_board(53) with the default degree proves about 50 seeds a minute on the 61 edge board of
+# seed 0. on the 86 edge board of seed 1 it proves about 4 a minute over the first 13 seeds (median 5s, slowest
+# 54s), and the 14th took over 20 minutes. on the 104 edge board of seed 2 single seeds take from 36s to over 10
+# minutes. runs over many seeds use every core (--workers), and --max-nodes caps the states of a seed, which then
+# only reports the bound from the start of the game. a looser bound checked before the round searches, from the
+# color score of a round without weights and its largest weights, pruned too little to pay for itself.
+class HindsightOracle:
+    def __init__(self, tables):
+        self.tables = tables
+        self.num_nodes = tables.num_nodes
+        first_edge = tables.first_edge.tolist()
+        # the edges an action claims: itself and the first edge of every edge it crosses
+        self.claims = []
+        for e in range(tables.num_edges):
+            mask = 1 << e
+            for crossed in tables.blocks(e).tolist():
+                mask |= 1 << first_edge[crossed]
+            self.claims.append(mask)
+        # (edge, other node) for every first edge leaving a node to a node the card type matches
+        self.moves = [
+            [[] for _ in range(len(CardType) + 1)] for _ in range(self.num_nodes)
+        ]
+        for node in range(self.num_nodes):
+            edges, others = tables.incident(node)
+            for edge, other in zip(edges.tolist(), others.tolist()):
+                if first_edge[edge] != edge:
+                    continue
+                for card_type in CardType:
+                    if tables.matches(card_type, other):
+                        self.moves[node][card_type.value].append((edge, other))
+        location = tables.location.tolist()
+        self.location_masks = []
+        for area in range(tables.num_locations):
+            mask = sum(1 << n for n in range(self.num_nodes) if location[n] == area)
+            if mask:
+                self.location_masks.append(mask)
+        self.tourist = sum(
+            1 << n for n, tourist in enumerate(tables.tourist.tolist()) if tourist
+        )
+        self.river = sum(
+            1 << e for e, river in enumerate(tables.crosses_river.tolist()) if river
+        )
+        self.start = tables.start.tolist()
+        self.area_scores = {}
+
+    def area_score(self, track):
+        score = self.area_scores.get(track)
+        if score is None:
+            areas = 0
+            most = 0
+            for mask in self.location_masks:
+                count = (track & mask).bit_count()
+                if count:
+                    areas += 1
+                    most = max(most, count)
+            score = areas * most
+            self.area_scores[track] = score
+        return score
+
+    def multi_color_score(self, tracks):
+        counts = [0] * self.num_nodes
+        for track in tracks:
+            for node in bits(track):
+                counts[node] += 1
+        return sum(MULTI_COLOR_VALUES[count] for count in counts)
+
+    def tourist_score(self, tourists):
+        return TOURIST_SCORES[min(tourists, len(TOURIST_SCORES) - 1)]
+
+    def final_score(self, tracks, edges):
+        # calculate_score of the tracks and claimed edges
+        score = sum(self.area_score(track) for track in tracks)
+        score += 2 * sum((claimed & self.river).bit_count() for claimed in edges)
+        score += self.multi_color_score(tracks)
+        tourists = sum((track & self.tourist).bit_count() for track in tracks)
+        return score + self.tourist_score(tourists)
+
+    def reach(self, track, cards, blocked):
+        # every node a round could still add: the neighbours of the track the card types allow, card after card
+        for card_type in cards:
+            added = 0
+            for node in bits(track):
+                for edge, other in self.moves[node][card_type]:
+                    if not blocked >> edge & 1:
+                        added |= 1 << other
+            track |= added
+        return track
+
+    def weights(self, rounds, r, blocked, tracks):
+        # the weights of the nodes for the rounds from r on. a node on m tracks that p more colors could add gains
+        # at most (points at m + k - points at m) / k per color for some k <= p, the most of that is its weight.
+        # the tourist points grow with the total, so every tourist node gets the same weight on top.
+        on_tracks = [0] * self.num_nodes
+        for track in tracks:
+            for node in bits(track):
+                on_tracks[node] += 1
+        possible = [0] * self.num_nodes
+        tourists = sum((track & self.tourist).bit_count() for track in tracks)
+        possible_tourists = 0
+        for color, cards in rounds[r:]:
+            c = COLORS.index(color)
+            track = tracks[c] | 1 << self.start[c]
+            added = self.reach(track, cards, blocked) & ~tracks[c]
+            for node in bits(added):
+                possible[node] += 1
+            # a round adds at most one node per card
+            possible_tourists += min(len(cards), (added & self.tourist).bit_count())
+        base = self.tourist_score(tourists)
+        tourist_weight = max(
+            [
+                (self.tourist_score(tourists + k) - base) / k
+                for k in range(1, possible_tourists + 1)
+            ],
+            default=0,
+        )
+        weights = [0] * self.num_nodes
+        for node, p in enumerate(possible):
+            if not p:
+                continue
+            m = on_tracks[node]
+            base = MULTI_COLOR_VALUES[m]
+            weights[node] = max(
+                (MULTI_COLOR_VALUES[min(m + k, len(COLORS))] - base) / k
+                for k in range(1, p + 1)
+            )
+            if self.tourist >> node & 1:
+                weights[node] += tourist_weight
+        return weights
+
+    def round_bounds(self, cards, curr, swap, blocked, track, weights, claims, memo):
+        # searches one round on its own. memo gets, for every state of the round, the best area score plus the
+        # weights of the nodes added from there on. river points are added by the caller.
+        moves = self.moves
+        river = self.river
+        area_score = self.area_score
+        last = len(cards)
+
+        def best(i, curr, swap, blocked, track):
+            if i == last:
+                return area_score(track)
+            # while the swap is on, either the round's railroad card has been drawn and every move is from the
+            # track, or nothing has moved since the round started. either way the current node adds nothing.
+            key = (i, -1 if swap else curr, swap, blocked, track)
+            value = memo.get(key)
+            if value is not None:
+                return value
+            card_type = cards[i]
+            swap = swap or card_type == RAILROAD
+            value = best(i + 1, curr, swap, blocked, track)
+            sources = bits(track) if swap and card_type != RAILROAD else (curr,)
+            for source in sources:
+                for edge, other in moves[source][card_type]:
+                    if blocked >> edge & 1:
+                        continue
+                    gain = 2 if river >> edge & 1 else 0
+                    if not track >> other & 1:
+                        gain += weights[other]
+                    child = gain + best(
+                        i + 1,
+                        other,
+                        card_type == RAILROAD,
+                        blocked | claims[edge],
+                        track | 1 << other,
+                    )
+                    if child > value:
+                        value = child
+            memo[key] = value
+            return value
+
+        return best(0, curr, swap, blocked, track)
+
+    def solve(self, deal, max_nodes=None):
+        # returns the best score, the line reaching it (for every round, an action or None per card), whether it
+        # is proven best, an upper bound on the best score and the number of states searched. with max_nodes the
+        # search stops there and returns the best line found so far.
+        rounds = [(color, [card.type.value for card in cards]) for color, cards in deal]
+        colors = [COLORS.index(color) for color, _ in rounds]
+        # a round only ever looks at the edges around the nodes it could reach on an empty board, and only its
+        # weights for those nodes matter. round searches are keyed by just those, so searches that only differ
+        # elsewhere are shared.
+        relevant = []
+        for c, (_, cards) in zip(colors, rounds):
+            reach = self.reach(1 << self.start[c], cards, 0)
+            mask = 0
+            for node in bits(reach):
+                for card_type in set(cards):
+                    for edge, _ in self.moves[node][card_type]:
+                        mask |= 1 << edge
+            claims = [claimed & mask for claimed in self.claims]
+            relevant.append((mask, list(bits(reach)), claims))
+        round_searches = {}
+        # once a state has been searched nothing under it can beat the best line, which only gets better, so a
+        # state seen again is skipped
+        seen = set()
+        best = {"score": -1, "line": [], "bound": None}
+        line = []
+        nodes = 0
+
+        def beats_best(bound):
+            return bound >= best["score"] + 1 - EPSILON
+
+        def round_search(r, swap, blocked, weights):
+            # the bound of round r searched alone from its start, and the bounds of all its states
+            mask, reach, claims = relevant[r]
+            key = (r, swap, blocked & mask, tuple(weights[node] for node in reach))
+            found = round_searches.get(key)
+            if found is None:
+                start = self.start[colors[r]]
+                bounds = {}
+                value = self.round_bounds(
+                    rounds[r][1],
+                    start,
+                    swap,
+                    blocked & mask,
+                    1 << start,
+                    weights,
+                    claims,
+                    bounds,
+                )
+                found = round_searches[key] = (value, bounds)
+            return found
+
+        def round_start(r, swap, blocked, tracks, edges):
+            if r == len(rounds):
+                score = self.final_score(tracks, edges)
+                if score > best["score"]:
+                    best["score"] = score
+                    best["line"] = list(line)
+                return
+            key = (r, swap, blocked, tracks, edges)
+            if key in seen:
+                return
+            seen.add(key)
+            c = colors[r]
+            tracks = list(tracks)
+            tracks[c] |= 1 << self.start[c]
+            tracks = tuple(tracks)
+            weights = self.weights(rounds, r, blocked, tracks)
+            # everything the rounds before scored, and the rounds after searched alone
+            fixed = self.multi_color_score(tracks) + self.tourist_score(
+                sum((track & self.tourist).bit_count() for track in tracks)
+            )
+            for done in colors[:r]:
+                fixed += self.area_score(tracks[done])
+                fixed += 2 * (edges[done] & self.river).bit_count()
+            for later in range(r + 1, len(rounds)):
+                start = self.start[colors[later]]
+                fixed += (
+                    weights[start] + round_search(later, False, blocked, weights)[0]
+                )
+            value, bounds = round_search(r, swap, blocked, weights)
+            bound = fixed + value
+            if r == 0:
+                best["bound"] = bound
+            if beats_best(bound):
+                context = (fixed, bounds, weights)
+                search(r, 0, self.start[c], swap, blocked, tracks, edges, 0, context)
+
+        def search(r, i, curr, swap, blocked, tracks, edges, added, context):
+            # added is the weight of the nodes this round added so far, which the bounds of the round leave out
+            nonlocal nodes
+            cards = rounds[r][1]
+            if i == len(cards):
+                round_start(r + 1, swap, blocked, tracks, edges)
+                return
+            key = (r, i, -1 if swap else curr, swap, blocked, tracks, edges)
+            if key in seen:
+                return
+            nodes += 1
+            if max_nodes is not None and nodes > max_nodes:
+                raise SearchBudgetExceeded()
+            c = colors[r]
+            track = tracks[c]
+            fixed, bounds, weights = context
+            mask = relevant[r][0]
+            base = fixed + added + 2 * (edges[c] & self.river).bit_count()
+
+            def bound(i, curr, swap, blocked, track):
+                if i == len(cards):
+                    return base + self.area_score(track)
+                key = (i, -1 if swap else curr, swap, blocked & mask, track)
+                return base + bounds[key]
+
+            card_type = cards[i]
+            swap = swap or card_type == RAILROAD
+            children = []
+            sources = bits(track) if swap and card_type != RAILROAD else (curr,)
+            for source in sources:
+                for edge, other in self.moves[source][card_type]:
+                    if blocked >> edge & 1:
+                        continue
+                    weight = 0 if track >> other & 1 else weights[other]
+                    child_bound = bound(
+                        i + 1,
+                        other,
+                        card_type == RAILROAD,
+                        blocked | self.claims[edge],
+                        track | 1 << other,
+                    )
+                    child_bound += weight + (2 if self.river >> edge & 1 else 0)
+                    children.append((child_bound, edge, source, other, weight))
+            # the most promising actions first, so a good line is found early and prunes the rest
+            children.sort(reverse=True)
+            for child_bound, edge, source, other, weight in children:
+                if not beats_best(child_bound):
+                    break
+                child_tracks = list(tracks)
+                child_tracks[c] |= 1 << other
+                child_edges = list(edges)
+                child_edges[c] |= 1 << edge
+                line.append((r, i, (edge, source, other)))
+                search(
+                    r,
+                    i + 1,
+                    other,
+                    card_type == RAILROAD,
+                    blocked | self.claims[edge],
+                    tuple(child_tracks),
+                    tuple(child_edges),
+                    added + weight,
+                    context,
+                )
+                line.pop()
+            if beats_best(bound(i + 1, curr, swap, blocked, track)):
+                search(r, i + 1, curr, swap, blocked, tracks, edges, added, context)
+            seen.add(key)
+
+        optimal = True
+        try:
+            round_start(0, False, 0, (0,) * len(COLORS), (0,) * len(COLORS))
+        except SearchBudgetExceeded:
+            optimal = False
+        lines = [[None] * len(cards) for _, cards in rounds]
+        for r, i, action in best["line"]:
+            lines[r][i] = action
+        return {
+            "score": best["score"],
+            "line": lines,
+            "optimal": optimal,
+            "bound": best["score"] if optimal else int(best["bound"] + EPSILON),
+            "nodes": nodes,
+        }
+
+
+def solve_seeds(board, seeds, max_nodes=None, regret=False):
+    london_system = LondonSystem()
+    london_system.verbose = False
+    london_system.load_graph(board)
+    oracle = HindsightOracle(BoardTables(london_system.graph))
+    records = []
+    for seed in seeds:
+        deal = deal_for_seed(london_system, seed)
+        started = time.perf_counter()
+        result = oracle.solve(deal, max_nodes)
+        seconds = time.perf_counter() - started
+        # the line is played on the real game, so the search can't report a score it doesn't reach
+        scores = play_deal(london_system, deal, line=result["line"])
+        if sum(scores.values()) != result["score"]:
+            raise AssertionError(
+                f"seed {seed}: the line scores {sum(scores.values())}, not {result['score']}"
+            )
+        record = {"seed": seed, "deal": deal_json(deal), **result, "seconds": seconds}
+        if regret:
+            random.seed(seed)
+            record["random_policy"] = sum(play_deal(london_system, deal).values())
+        records.append(record)
+    return records
+
+
+def _solve_chunk(arguments):
+    return solve_seeds(*arguments)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--seeds", type=int, default=100, help="Seeds to solve")
+    parser.add_argument("--first-seed", type=int, default=0, help="First seed")
+    parser.add_argument(
+        "--max-nodes", type=int, help="Give up on proving a seed after this many states"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Processes to use, every core by default",
+    )
+    parser.add_argument("--chunk-size", type=int, default=10, help="Seeds per task")
+    parser.add_argument(
+        "--output", "-o", default="hindsight_lines.jsonl", help="Optimal lines file"
+    )
+    parser.add_argument(
+        "--regret",
+        action="store_true",
+        help="Also play the random policy on every deal and report its regret",
+    )
+    args = parser.parse_args()
+
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    chunks = [
+        (args.custom, seeds[i : i + args.chunk_size], args.max_nodes, args.regret)
+        for i in range(0, len(seeds), args.chunk_size)
+    ]
+    started = time.perf_counter()
+    records = []
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            for result in pool.imap_unordered(_solve_chunk, chunks):
+                records.extend(result)
+    else:
+        for chunk in chunks:
+            records.extend(_solve_chunk(chunk))
+    elapsed = time.perf_counter() - started
+    records.sort(key=lambda record: record["seed"])
+    with open(args.output, "w") as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+    proven = sum(record["optimal"] for record in records)
+    seconds = sorted(record["seconds"] for record in records)
+    print(
+        f"Solved {len(records)} seeds in {elapsed:.1f}s ({60 * len(records) / elapsed:.0f} per minute), "
+        f"{proven} proven best"
+    )
+    print(
+        f"Per seed: median {seconds[len(seconds) // 2]:.2f}s, slowest {seconds[-1]:.2f}s, "
+        f"mean {sum(record['nodes'] for record in records) / len(records):.0f} states"
+    )
+    print(
+        f"Mean best score {sum(record['score'] for record in records) / len(records):.2f}"
+    )
+    if args.regret:
+        regrets = [record["score"] - record["random_policy"] for record in records]
+        print(f"Random policy mean regret {sum(regrets) / len(regrets):.2f}")
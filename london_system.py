@@ -1,63 +1,115 @@
+import hashlib
 import json
 import random
+from collections import OrderedDict
 from enum import Enum
 
-from card import Card
-from graph import CardType, Edge, Graph, Node, NodeLocation
+import numpy as np
+
+from card import DECK
+from graph import CardType, Edge, Graph, Node, NodeLocation, node_key
+
+# how many legal action lists and masks are remembered per game
+ACTION_CACHE_SIZE = 4096
+
+COLORS = ["red", "blue", "green", "purple"]
+
+# points for a node on 2, 3 or 4 color tracks, and for the number of tourist stations visited, from the board game rules
+MULTI_COLOR_SCORES = {2: 2, 3: 5, 4: 9}
+TOURIST_SCORES = [0, 1, 2, 4, 6, 8, 11, 14, 17, 21, 25]
+
+# one row of evaluate_moves
+MOVE_DTYPE = np.dtype(
+    [
+        ("edge", np.int32),
+        ("source", np.int32),
+        ("target", np.int32),
+        ("score_delta", np.int32),
+        ("area_delta", np.int32),
+        ("new_area", np.bool_),
+        ("river", np.bool_),
+        ("multi_color_delta", np.int32),
+        ("tourist_delta", np.int32),
+        ("newly_blocked", np.int32),
+    ]
+)
 
 
 class LondonSystem:
     def __init__(self):
-        self.cards = [
-            Card(CardType.CIRCLE, "red"),
-            Card(CardType.CIRCLE, "blue"),
-            Card(CardType.TRIANGLE, "red"),
-            Card(CardType.TRIANGLE, "blue"),
-            Card(CardType.SQUARE, "red"),
-            Card(CardType.SQUARE, "blue"),
-            Card(CardType.PENTAGON, "red"),
-            Card(CardType.PENTAGON, "blue"),
-            Card(CardType.RANDOM, "red"),
-            Card(CardType.RANDOM, "blue"),
-            Card(CardType.RAILROAD, None),
-        ]
+        self.cards = list(DECK)
         self.red_cards_played = 0
         self.graph = None
         self.colors = ["red", "blue", "green", "purple"]
         self.curr_card = None
-
-    def start_game(self):
+        self.action_cache = OrderedDict()
+        # rollouts play thousands of games, so they can turn off the messages meant for someone at the gui
+        self.verbose = True
+        # with skip_dead_ends, draw_card ends a color as soon as no card left in the deck can make a move. the
+        # cards it would still have drawn are kept in skipped_draws as (color, card).
+        self.skip_dead_ends = False
+        self.skipped_draws = []
+        # a flight_recorder.FlightRecorder, told about every color, draw, legal_actions call and move
+        self.recorder = None
+
+    # the action cache is only a speed up, so copies and pickles of a game start without it. they start without
+    # the recorder too, it belongs to the game being played.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["action_cache"] = OrderedDict()
+        state["recorder"] = None
+        return state
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def start_game(self, color=None):
         self.reset_game()
-        self.graph.curr_color = random.choice(self.colors)
+        if color is None:
+            color = random.choice(self.colors)
+        self.graph.curr_color = color
         self.colors.remove(self.graph.curr_color)
+        if self.recorder is not None:
+            self.recorder.game(color)
         self.graph.curr_node = self.graph.get_start_node()
         self.graph.curr_node.highlighted = True
 
     def reset_game(self):
         self.red_cards_played = 0
+        self.skipped_draws = []
         self.reset_deck()
         self.colors = ["red", "blue", "green", "purple"]
         self.graph.railroad_edges = {"red": [], "blue": [], "green": [], "purple": []}
         self.graph.railroad_nodes = {"red": [], "blue": [], "green": [], "purple": []}
         self.graph.reset_graph()
 
-    def next_color(self):
+    # the color and card can be given to replay a known sequence, otherwise they are drawn at random
+    def next_color(self, color=None):
         try:
-            self.graph.curr_color = random.choice(self.colors)
+            if color is None:
+                color = random.choice(self.colors)
+            self.graph.curr_color = color
             self.colors.remove(self.graph.curr_color)
             self.reset_deck()
         except:
-            print("No more colors left")
+            if self.recorder is not None:
+                self.recorder.no_color(1 if self.colors else 0, len(self.colors))
+            self.log("No more colors left")
             return None
         try:
             self.graph.curr_node = self.graph.get_start_node()
             self.graph.curr_node.highlighted = True
         except:
-            print(f"No start node for color: {self.graph.curr_color}")
+            if self.recorder is not None:
+                self.recorder.no_color(2, len(self.colors))
+            self.log(f"No start node for color: {self.graph.curr_color}")
             return None
+        if self.recorder is not None:
+            self.recorder.color(color)
         return self.graph.curr_color
 
-    def draw_card(self):
+    def draw_card(self, card=None):
         if self.graph.curr_color is None:
             self.graph.curr_color = random.choice(self.colors)
             self.colors.remove(self.graph.curr_color)
@@ -65,17 +117,49 @@ class LondonSystem:
                 self.graph.curr_node = self.graph.get_start_node()
                 self.graph.curr_node.highlighted = True
             except:
-                print("graph has not been set up")
+                if self.recorder is not None:
+                    self.recorder.error(1)
+                self.log("graph has not been set up")
                 return None
 
         if self.graph.curr_node is None:
             # this would only happen in a custom game where the start node is not set
+            if self.recorder is not None:
+                self.recorder.error(0)
             raise Exception(f"No start node found for color {self.graph.curr_color}")
 
+        # the start node is the first node on every color track
+        if self.graph.railroad_nodes[self.graph.curr_color] == []:
+            self.graph.railroad_nodes[self.graph.curr_color].append(
+                self.graph.get_start_node()
+            )
+
         if self.red_cards_played == 5 or len(self.cards) == 0:
+            if self.recorder is not None:
+                self.recorder.round_end(self.red_cards_played, len(self.cards))
+            return None
+
+        if card is None and self.skip_dead_ends and self.dead_end():
+            # the rest of the color is still drawn, so a seeded game deals the same cards with or without skipping
+            skipped = len(self.skipped_draws)
+            while self.red_cards_played < 5 and len(self.cards) > 0:
+                card = random.choice(self.cards)
+                self.take_card(card)
+                self.skipped_draws.append((self.graph.curr_color, card))
+            if self.recorder is not None:
+                self.recorder.dead_end(
+                    len(self.skipped_draws) - skipped, self.red_cards_played
+                )
             return None
 
-        card = random.choice(self.cards)
+        if card is None:
+            card = random.choice(self.cards)
+        self.take_card(card)
+        if self.recorder is not None:
+            self.recorder.draw(card, self.red_cards_played)
+        return card
+
+    def take_card(self, card):
         self.cards.remove(card)
         if card.color == "red":
             self.red_cards_played += 1
@@ -84,7 +168,301 @@ class LondonSystem:
             self.graph.swap = True
             self.graph.chose_after_swap = False
             self.graph.highlight_all_color()
-        return card
+
+    # true when none of the cards left can make a move, whatever order they come in. nothing changes the track
+    # until a move is made, so moves can only ever come from the current node, or from anywhere on the track
+    # once a railroad card has been drawn.
+    def dead_end(self):
+        graph = self.graph
+        graph.ensure_index()
+        curr_key = node_key(graph.curr_node)
+        cards = {card.type: card for card in self.cards}
+        for card in cards.values():
+            for i in graph.incident.get(curr_key, []):
+                edge = graph.edges[i]
+                if edge.blocked:
+                    continue
+                other = edge.node2 if node_key(edge.node1) == curr_key else edge.node1
+                if (
+                    graph.matches(card, other)
+                    and graph.edge_lookup[(curr_key, node_key(other))] == i
+                ):
+                    return False
+        if graph.swap or CardType.RAILROAD in cards:
+            for card in cards.values():
+                if card.type == CardType.RAILROAD:
+                    continue
+                for i, key, target in graph.frontier_moves(graph.curr_color, card):
+                    if graph.edge_lookup[(key, node_key(target))] == i:
+                        return False
+        return True
+
+    # this is what happens when a player clicks a node that is not highlighted: the node is claimed if the current card can reach it
+    def choose_node(self, node):
+        adjacent_nodes = self.graph.get_adjacent(self.curr_card)
+        if node not in adjacent_nodes or self.curr_card is None:
+            return False
+        self.graph.curr_node.highlighted = False
+        self.graph.railroad_nodes[self.graph.curr_color].append(node)
+        self.graph.choose_edge(node, self.graph.curr_color)
+        node.highlighted = not node.highlighted
+        self.curr_card = None
+        return True
+
+    # clicking a highlighted node (a node on the track after a railroad card) moves the current node there
+    def reanchor(self, node):
+        self.graph.unhighlight_all_color()
+        node.highlighted = True
+        self.graph.curr_node = node
+        self.graph.chose_after_swap = True
+        self.graph.swap = False
+
+    # every legal action for a card is an (edge index, from node index, to node index) tuple. after a railroad
+    # card every edge leaving the track is an action, which is re-anchoring on the from node and then moving.
+    def legal_actions(self, card=None):
+        actions = self._legal(card)[0]
+        if self.recorder is not None:
+            self.recorder.legal(
+                card if card is not None else self.curr_card,
+                len(actions),
+                self.graph.swap,
+            )
+        return list(actions)
+
+    # a read only boolean array over all edges, true for the edges of the legal actions
+    def legal_action_mask(self, card=None):
+        return self._legal(card)[2]
+
+    def _legal(self, card):
+        if card is None:
+            card = self.curr_card
+        graph = self.graph
+        if card is None or graph.curr_node is None:
+            mask = np.zeros(len(graph.edges), dtype=bool)
+            mask.setflags(write=False)
+            return (), frozenset(), mask
+
+        graph.ensure_index()
+        swap = card.type != CardType.RAILROAD and graph.swap
+        if swap:
+            position = graph.track_hash(graph.curr_color)
+        else:
+            position = node_key(graph.curr_node)
+        key = (
+            graph.index_token,
+            graph.blocked_hash,
+            graph.curr_color,
+            card.type,
+            swap,
+            position,
+        )
+        cached = self.action_cache.get(key)
+        if cached is not None:
+            self.action_cache.move_to_end(key)
+            return cached
+
+        if swap:
+            moves = graph.frontier_moves(graph.curr_color, card)
+        else:
+            curr_key = node_key(graph.curr_node)
+            moves = []
+            for i in graph.incident.get(curr_key, []):
+                edge = graph.edges[i]
+                if edge.blocked:
+                    continue
+                other = edge.node2 if node_key(edge.node1) == curr_key else edge.node1
+                if graph.matches(card, other):
+                    moves.append((i, curr_key, other))
+        actions = []
+        for i, from_key, target in moves:
+            target_key = node_key(target)
+            # only the first edge between two nodes can ever be chosen
+            if graph.edge_lookup[(from_key, target_key)] == i:
+                actions.append(
+                    (i, graph.node_index[from_key], graph.node_index[target_key])
+                )
+        actions = tuple(actions)
+        mask = np.zeros(len(graph.edges), dtype=bool)
+        mask[[action[0] for action in actions]] = True
+        mask.setflags(write=False)
+
+        cached = (actions, frozenset(actions), mask)
+        self.action_cache[key] = cached
+        if len(self.action_cache) > ACTION_CACHE_SIZE:
+            self.action_cache.popitem(last=False)
+        return cached
+
+    def apply_action(self, action):
+        if action not in self._legal(None)[1]:
+            raise ValueError(f"Action {action} is not legal for the current card")
+        edge_index, from_index, to_index = action
+        graph = self.graph
+        source = graph.nodes[from_index]
+        target = graph.nodes[to_index]
+        # the card after a railroad card uses up the swap, just like it does when clicking
+        if self.curr_card.type != CardType.RAILROAD and graph.swap:
+            graph.swap = False
+        # the edge is taken from the chosen node, so we clean up the railroad highlight ourselves
+        if not graph.chose_after_swap:
+            graph.chose_after_swap = True
+            graph.unhighlight_all_color()
+        graph.curr_node.highlighted = False
+        graph.railroad_nodes[graph.curr_color].append(target)
+        graph.choose_edge(target, graph.curr_color, source)
+        target.highlighted = True
+        self.curr_card = None
+        if self.recorder is not None:
+            self.recorder.move(action)
+        return graph.edges[edge_index]
+
+    # a digest of everything the rest of the game depends on, the same in every process and run, for caching
+    # results by position. tracks are sets of nodes and edges, the order they were claimed in doesn't matter.
+    # the current card can be left out for positions between draws, where it is only the last card played.
+    def state_key(self, card=True):
+        graph = self.graph
+        graph.ensure_index()
+        state = [
+            graph.curr_color,
+            sorted(self.colors),
+            sorted((c.type.value, c.color or "") for c in self.cards),
+            self.red_cards_played,
+            graph.swap,
+            graph.chose_after_swap,
+            (
+                graph.node_index[node_key(graph.curr_node)]
+                if graph.curr_node is not None
+                else -1
+            ),
+            [i for i, edge in enumerate(graph.edges) if edge.blocked],
+        ]
+        if card:
+            state.append(
+                [self.curr_card.type.value, self.curr_card.color or ""]
+                if self.curr_card is not None
+                else None
+            )
+        for color in COLORS:
+            state.append(
+                sorted(
+                    {
+                        graph.node_index[node_key(node)]
+                        for node in graph.railroad_nodes[color]
+                    }
+                )
+            )
+            state.append(
+                sorted(
+                    {graph.edge_ids[id(edge)] for edge in graph.railroad_edges[color]}
+                )
+            )
+        return hashlib.blake2b(json.dumps(state).encode(), digest_size=16).hexdigest()
+
+    # a dictionary of numpy arrays describing the game for agents. colors are numbered from 1 in COLORS order,
+    # with 0 meaning no color, and the card is its CardType value with 0 meaning no card
+    def observation(self):
+        graph = self.graph
+        graph.ensure_index()
+        edge_owner = np.zeros(len(graph.edges), dtype=np.int8)
+        for i, color in enumerate(COLORS):
+            for edge in graph.railroad_edges[color]:
+                edge_owner[graph.edge_ids[id(edge)]] = i + 1
+        blocked = np.fromiter(
+            (edge.blocked for edge in graph.edges), dtype=bool, count=len(graph.edges)
+        )
+        curr_node = -1
+        if graph.curr_node is not None:
+            curr_node = graph.node_index[node_key(graph.curr_node)]
+        card = self.curr_card
+        return {
+            "edge_owner": edge_owner,
+            "blocked": blocked,
+            "curr_node": np.int32(curr_node),
+            "card": np.int8(card.type.value if card is not None else 0),
+            "card_red": np.bool_(card is not None and card.color == "red"),
+            "color": np.int8(
+                COLORS.index(graph.curr_color) + 1 if graph.curr_color in COLORS else 0
+            ),
+            "swap": np.bool_(graph.swap),
+            "red_cards_played": np.int8(self.red_cards_played),
+            "legal": self.legal_action_mask(),
+        }
+
+    # what every legal action for the card would do, as a numpy record array with a MOVE_DTYPE row per action
+    # in legal_actions order: the change in the calculate_score total and in its parts, whether the target
+    # opens a new area for the color and how many edges the move would block. the game isn't changed.
+    def evaluate_moves(self, card=None):
+        actions = self._legal(card)[0]
+        graph = self.graph
+        color = graph.curr_color
+        # the counts calculate_score works from: the distinct nodes of every track, the nodes per area of the
+        # current color and the tourist stations visited over all colors
+        tracks = {
+            track_color: {
+                node_key(node): node for node in graph.railroad_nodes[track_color]
+            }
+            for track_color in COLORS
+        }
+        area_counts = {}
+        for node in tracks.get(color, {}).values():
+            area_counts[node.location] = area_counts.get(node.location, 0) + 1
+        num_areas = len(area_counts)
+        most_in_area = max(area_counts.values(), default=0)
+        tourists = sum(
+            node.tourist for track in tracks.values() for node in track.values()
+        )
+        tourist_score = TOURIST_SCORES[min(tourists, len(TOURIST_SCORES) - 1)]
+
+        rows = []
+        for edge_index, source, target in actions:
+            edge = graph.edges[edge_index]
+            node = graph.nodes[target]
+            key = node_key(node)
+            area_delta = 0
+            new_area = False
+            multi_color_delta = 0
+            tourist_delta = 0
+            # a node already on the track is visited again, only the edge counts
+            if key not in tracks[color]:
+                count = area_counts.get(node.location, 0) + 1
+                new_area = count == 1
+                area_delta = (num_areas + new_area) * max(
+                    most_in_area, count
+                ) - num_areas * most_in_area
+                on_tracks = sum(key in track for track in tracks.values())
+                multi_color_delta = MULTI_COLOR_SCORES.get(
+                    on_tracks + 1, 0
+                ) - MULTI_COLOR_SCORES.get(on_tracks, 0)
+                if node.tourist:
+                    tourist_delta = (
+                        TOURIST_SCORES[min(tourists + 1, len(TOURIST_SCORES) - 1)]
+                        - tourist_score
+                    )
+            # choose_edge blocks the edge and the first edge between the ends of every edge it crosses
+            blocking = {edge_index}
+            for crossed in edge.blocks_edges:
+                crossed_edge = graph.edges[crossed]
+                blocking.add(
+                    graph.edge_lookup[
+                        (node_key(crossed_edge.node1), node_key(crossed_edge.node2))
+                    ]
+                )
+            newly_blocked = sum(not graph.edges[i].blocked for i in blocking)
+            river = bool(edge.crosses_river)
+            rows.append(
+                (
+                    edge_index,
+                    source,
+                    target,
+                    area_delta + 2 * river + multi_color_delta + tourist_delta,
+                    area_delta,
+                    new_area,
+                    river,
+                    multi_color_delta,
+                    tourist_delta,
+                    newly_blocked,
+                )
+            )
+        return np.rec.array(np.array(rows, dtype=MOVE_DTYPE))
 
     def choose_card(self, type, color):
         for card in self.cards:
@@ -94,19 +472,7 @@ class LondonSystem:
         return None  # TODO: add some kind of error handling
 
     def reset_deck(self):
-        self.cards = [
-            Card(CardType.CIRCLE, "red"),
-            Card(CardType.CIRCLE, "blue"),
-            Card(CardType.TRIANGLE, "red"),
-            Card(CardType.TRIANGLE, "blue"),
-            Card(CardType.SQUARE, "red"),
-            Card(CardType.SQUARE, "blue"),
-            Card(CardType.PENTAGON, "red"),
-            Card(CardType.PENTAGON, "blue"),
-            Card(CardType.RANDOM, "red"),
-            Card(CardType.RANDOM, "blue"),
-            Card(CardType.RAILROAD, None),
-        ]
+        self.cards = list(DECK)
         self.red_cards_played = 0
         if self.graph.curr_node is not None:
             self.graph.curr_node.highlighted = False
@@ -116,16 +482,24 @@ class LondonSystem:
             "nodes": [node.to_dict() for node in self.graph.nodes],
             "edges": [edge.to_dict() for edge in self.graph.edges],
         }
+        if self.graph.river is not None:
+            graph_data["river"] = self.graph.river
+        if self.graph.scale != 1:
+            graph_data["scale"] = self.graph.scale
 
         with open(filename, "w") as file:
             json.dump(graph_data, file, indent=4)
 
-        print(f"Graph saved to {filename}")
+        self.log(f"Graph saved to {filename}")
 
     def load_graph(self, filename):
         with open(filename, "r") as file:
             graph_data = json.load(file)
+        self.load_graph_data(graph_data)
+        self.log(f"Graph loaded from {filename}")
 
+    # builds the graph from the dictionary that save_graph writes
+    def load_graph_data(self, graph_data):
         graph = Graph()
         for node_data in graph_data["nodes"]:
             node = Node()
@@ -137,8 +511,11 @@ class LondonSystem:
             edge.from_dict(edge_data)
             graph.add_edge(edge)
 
+        graph.river = graph_data.get("river")
+        graph.scale = graph_data.get("scale", 1)
         self.graph = graph
-        print(f"Graph loaded from {filename}")
+        # the cached actions belong to the old board
+        self.action_cache.clear()
 
     def calculate_score(self):
         color_scores = {}
@@ -170,7 +547,7 @@ class LondonSystem:
                     river_crossings += 1
             # each river crossing is worth 2 points
             color_scores[color] = num_areas * most_in_area + 2 * river_crossings
-            print(
+            self.log(
                 f"{color} areas: {num_areas}, most in area: {most_in_area}, river crossings: {river_crossings}"
             )
 
@@ -193,15 +570,14 @@ class LondonSystem:
             elif num_in_colors == 4:
                 color_scores["quad-color"] += 1
         # these counts are worth 2,5, and 9 point each based on the board game rules.
-        color_scores["bi-color"] = color_scores["bi-color"] * 2
-        color_scores["tri-color"] = color_scores["tri-color"] * 5
-        color_scores["quad-color"] = color_scores["quad-color"] * 9
+        color_scores["bi-color"] = color_scores["bi-color"] * MULTI_COLOR_SCORES[2]
+        color_scores["tri-color"] = color_scores["tri-color"] * MULTI_COLOR_SCORES[3]
+        color_scores["quad-color"] = color_scores["quad-color"] * MULTI_COLOR_SCORES[4]
         # this array of tourist scores is just the scoring given in the board game
-        tourist_scores = [0, 1, 2, 4, 6, 8, 11, 14, 17, 21, 25]
-        if color_scores["tourist"] < len(tourist_scores):
-            color_scores["tourist"] = tourist_scores[color_scores["tourist"]]
+        if color_scores["tourist"] < len(TOURIST_SCORES):
+            color_scores["tourist"] = TOURIST_SCORES[color_scores["tourist"]]
         else:
-            color_scores["tourist"] = 25
+            color_scores["tourist"] = TOURIST_SCORES[-1]
         return color_scores
 
     def setup_graph(self):
@@ -0,0 +1,112 @@
+import copy
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from london_system import LondonSystem
+
+
+def play_cards(london_system, num_cards):
+    # plays some random moves so the games being measured have tracks, claimed and blocked edges
+    for _ in range(num_cards):
+        card = london_system.draw_card()
+        if card is None:
+            if london_system.next_color() is None:
+                return
+            continue
+        actions = london_system.legal_actions()
+        if actions:
+            london_system.apply_action(random.choice(actions))
+
+
+def bytes_per_game(template, num_games):
+    # the memory traced while num_games copies of the game are alive, divided by the number of games
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        games = [copy.deepcopy(template) for _ in range(num_games)]
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del games
+    return (after - before) / num_games
+
+
+def load_history(filename):
+    try:
+        with open(filename) as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--games", type=int, default=1000, help="Live games to measure")
+    parser.add_argument(
+        "--cards", type=int, default=20, help="Cards played in each game first"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--history",
+        default="memory_history.jsonl",
+        help="File the results are appended to and compared against",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.05,
+        help="Fail if a game grew by more than this fraction over the best result so far",
+    )
+    parser.add_argument("--label", default="", help="Label stored with the result")
+    args = parser.parse_args()
+
+    template = LondonSystem()
+    template.verbose = False
+    template.load_graph(args.custom)
+    random.seed(args.seed)
+    template.start_game()
+    play_cards(template, args.cards)
+
+    result = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "label": args.label,
+        "board": args.custom,
+        "nodes": len(template.graph.nodes),
+        "edges": len(template.graph.edges),
+        "cards": args.cards,
+        "games": args.games,
+        "bytes_per_game": round(bytes_per_game(template, args.games)),
+    }
+    print(
+        f"{result['bytes_per_game']} bytes per live game "
+        f"({result['nodes']} nodes, {result['edges']} edges, {args.games} games)"
+    )
+
+    # only results for the same board and setup can be compared
+    comparable = [
+        entry["bytes_per_game"]
+        for entry in load_history(args.history)
+        if all(
+            entry.get(key) == result[key]
+            for key in ["board", "nodes", "edges", "cards"]
+        )
+    ]
+    with open(args.history, "a") as file:
+        file.write(json.dumps(result) + "\n")
+    if comparable:
+        best = min(comparable)
+        change = result["bytes_per_game"] / best - 1
+        print(f"Best so far {best} bytes per game, change {100 * change:+.1f}%")
+        if change > args.tolerance:
+            print(f"Memory per game grew by more than {100 * args.tolerance:.0f}%")
+            sys.exit(1)
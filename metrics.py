@@ -0,0 +1,309 @@
+import bisect
+import os
+import random
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from london_system import LondonSystem
+from rollout import run_episode
+
+SCORE_BUCKETS = [0, 1, 2, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128]
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# the counters and histograms of the rollout workers in one process, written out in the prometheus text
+# exposition format. a game only appends its result to a list and every sample_every-th legal_actions call is
+# timed, the counting and bucketing is done when the metrics are written, so rollouts barely notice them.
+class RolloutMetrics:
+    def __init__(self, sample_every=16, window=10000):
+        self.lock = threading.Lock()
+        self.sample_every = sample_every
+        # deque appends and pops are atomic, so rollout threads add to these without taking the lock and collect
+        # only takes what it pops, never losing an append made while it drains them
+        self.pending_games = deque()
+        self.pending_times = deque()
+        self.games = 0
+        self.steps = 0
+        self.dead_ends = 0
+        self.score_counts = {}
+        self.score_sums = {}
+        self.adjacency_times = deque(maxlen=window)
+        self.adjacency_count = 0
+        self.adjacency_sum = 0.0
+        # the last exposition, for the per second gauges
+        self.last_time = time.time()
+        self.last_games = 0
+        self.last_steps = 0
+
+    def observe_adjacency(self, seconds):
+        self.pending_times.append(seconds)
+
+    def record_game(self, scores, steps, dead_ends):
+        self.pending_games.append((scores, steps, dead_ends))
+
+    def collect(self):
+        # moves everything the rollouts reported into the counters and histograms
+        games = _drain(self.pending_games)
+        times = _drain(self.pending_times)
+        for scores, steps, dead_ends in games:
+            self.games += 1
+            self.steps += steps
+            self.dead_ends += dead_ends
+            scores = dict(scores)
+            scores["total"] = sum(scores.values())
+            for component, score in scores.items():
+                counts = self.score_counts.setdefault(
+                    component, [0] * (len(SCORE_BUCKETS) + 1)
+                )
+                # cumulative buckets are worked out when the metrics are written
+                counts[bisect.bisect_left(SCORE_BUCKETS, score)] += 1
+                self.score_sums[component] = self.score_sums.get(component, 0) + score
+        self.adjacency_times.extend(times)
+        self.adjacency_count += len(times)
+        self.adjacency_sum += sum(times)
+
+    def exposition(self):
+        with self.lock:
+            self.collect()
+            now = time.time()
+            elapsed = max(now - self.last_time, 1e-9)
+            games_per_second = (self.games - self.last_games) / elapsed
+            steps_per_second = (self.steps - self.last_steps) / elapsed
+            self.last_time, self.last_games, self.last_steps = (
+                now,
+                self.games,
+                self.steps,
+            )
+            games, steps, dead_ends = self.games, self.steps, self.dead_ends
+            score_counts = {
+                key: list(value) for key, value in self.score_counts.items()
+            }
+            score_sums = dict(self.score_sums)
+            adjacency_times = np.array(self.adjacency_times, dtype=float)
+            adjacency_count, adjacency_sum = self.adjacency_count, self.adjacency_sum
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(
+                    f"{name}{suffix}{format_labels(labels)} {format_value(value)}"
+                )
+
+        metric(
+            "london_system_games_total", "counter", "Games played.", [("", [], games)]
+        )
+        metric(
+            "london_system_steps_total",
+            "counter",
+            "Cards drawn and given to the policy.",
+            [("", [], steps)],
+        )
+        metric(
+            "london_system_dead_ends_total",
+            "counter",
+            "Cards drawn with no legal move.",
+            [("", [], dead_ends)],
+        )
+        metric(
+            "london_system_dead_end_ratio",
+            "gauge",
+            "Fraction of cards drawn with no legal move.",
+            [("", [], dead_ends / steps if steps else 0.0)],
+        )
+        metric(
+            "london_system_games_per_second",
+            "gauge",
+            "Games per second since the last scrape.",
+            [("", [], games_per_second)],
+        )
+        metric(
+            "london_system_steps_per_second",
+            "gauge",
+            "Steps per second since the last scrape.",
+            [("", [], steps_per_second)],
+        )
+
+        samples = []
+        for component in sorted(score_counts):
+            cumulative = np.cumsum(score_counts[component]).tolist()
+            for bound, count in zip(SCORE_BUCKETS + [float("inf")], cumulative):
+                le = "+Inf" if bound == float("inf") else str(bound)
+                samples.append(
+                    ("_bucket", [("component", component), ("le", le)], count)
+                )
+            samples.append(("_sum", [("component", component)], score_sums[component]))
+            samples.append(("_count", [("component", component)], cumulative[-1]))
+        metric(
+            "london_system_score",
+            "histogram",
+            "Final calculate_score components per game.",
+            samples,
+        )
+
+        samples = []
+        if len(adjacency_times):
+            for quantile, value in zip(
+                QUANTILES, np.quantile(adjacency_times, QUANTILES)
+            ):
+                samples.append(("", [("quantile", str(quantile))], float(value)))
+        samples.append(("_sum", [], adjacency_sum))
+        samples.append(("_count", [], adjacency_count))
+        metric(
+            "london_system_legal_actions_seconds",
+            "summary",
+            "Latency of sampled legal_actions calls.",
+            samples,
+        )
+        return "\n".join(lines) + "\n"
+
+
+def _drain(pending):
+    items = []
+    for _ in range(len(pending)):
+        items.append(pending.popleft())
+    return items
+
+
+def write_textfile(metrics, filename):
+    # written next to the target and renamed, so a textfile collector never reads half a file
+    directory = os.path.dirname(os.path.abspath(filename))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(descriptor, "w") as file:
+        file.write(metrics.exposition())
+    os.replace(temporary, filename)
+
+
+def start_http_server(metrics, port=9100, host="127.0.0.1"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.exposition().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument(
+        "--games", type=int, default=0, help="Games to play, 0 to run forever"
+    )
+    parser.add_argument(
+        "--port", type=int, help="Serve the metrics over http on this port"
+    )
+    parser.add_argument("--textfile", help="Write the metrics to this file")
+    parser.add_argument(
+        "--interval", type=float, default=10, help="Seconds between textfile writes"
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Measure the overhead of the metrics instead",
+    )
+    args = parser.parse_args()
+
+    london_system = LondonSystem()
+    london_system.load_graph(args.custom)
+    metrics = RolloutMetrics()
+
+    if args.benchmark:
+        games = args.games or 2000
+        # each arm plays on its own game, so neither finds legal actions the other cached. the arms take turns
+        # over blocks of the same seeds, going first every other block, and the overhead is the ratio of their
+        # total times. the spread of the per block ratios shows how much of it is noise.
+        arms = {
+            "plain": (london_system, None),
+            "measured": (LondonSystem(), metrics),
+        }
+        arms["measured"][0].load_graph(args.custom)
+        totals = {name: [] for name in arms}
+        block = 20
+        for first in range(0, games, block):
+            names = list(arms) if first // block % 2 else list(arms)[::-1]
+            for name in names:
+                game, game_metrics = arms[name]
+                started = time.perf_counter()
+                for seed in range(first, min(first + block, games)):
+                    random.seed(seed)
+                    run_episode(game, metrics=game_metrics)
+                totals[name].append(time.perf_counter() - started)
+        plain = np.array(totals["plain"])
+        measured = np.array(totals["measured"])
+        overhead = measured.sum() / plain.sum() - 1
+        low, high = np.quantile(measured / plain - 1, [0.25, 0.75])
+        print(
+            f"Without metrics {games / plain.sum():.0f} games/s, with {games / measured.sum():.0f} games/s"
+        )
+        print(
+            f"Overhead {100 * overhead:.2f}% of the total time, per block of {block} games "
+            f"{100 * low:.1f}% to {100 * high:.1f}% (interquartile range)"
+        )
+        # the same comparison is too noisy to resolve a fraction of a percent, so the work the metrics add to a
+        # game is also timed on its own: one record_game and the timed legal_actions calls, less the calls
+        scratch = RolloutMetrics()
+        calls = 100000
+        started = time.perf_counter()
+        for _ in range(calls):
+            timed = time.perf_counter()
+            scratch.observe_adjacency(time.perf_counter() - timed)
+        per_timing = (time.perf_counter() - started) / calls
+        started = time.perf_counter()
+        for _ in range(calls):
+            scratch.record_game({}, 0, 0)
+        per_game = (time.perf_counter() - started) / calls
+        metrics.collect()
+        timings = metrics.adjacency_count / max(metrics.games, 1)
+        added = per_game + timings * per_timing
+        print(
+            f"Metrics work per game {1e6 * added:.2f}us, {100 * added * games / plain.sum():.3f}% of a game"
+        )
+        print(metrics.exposition())
+    else:
+        if args.port is not None:
+            start_http_server(metrics, args.port)
+            print(f"Serving metrics on http://127.0.0.1:{args.port}/metrics")
+        last_write = time.time()
+        played = 0
+        while args.games == 0 or played < args.games:
+            run_episode(london_system, metrics=metrics)
+            played += 1
+            if args.textfile and time.time() - last_write >= args.interval:
+                write_textfile(metrics, args.textfile)
+                last_write = time.time()
+        if args.textfile:
+            write_textfile(metrics, args.textfile)
@@ -0,0 +1,278 @@
+import random
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board_tables import BoardTables
+from graph import CardType
+from london_system import COLORS, MULTI_COLOR_SCORES, TOURIST_SCORES, LondonSystem
+
+
+def random_policy(multiplayer, player, actions):
+    return random.choice(actions)
+
+
+# every player builds on their own copy of the board from one shared deck and color order. the deck is dealt by
+# a LondonSystem (the dealer) and the boards are numpy arrays with one row per player, so a draw or a round of
+# moves updates every board at once. moves follow the same rules as LondonSystem.legal_actions and apply_action.
+class MultiplayerLondonSystem:
+    def __init__(self, dealer, num_players):
+        self.dealer = dealer
+        self.dealer.verbose = False
+        self.num_players = num_players
+        self.tables = BoardTables(dealer.graph)
+        tables = self.tables
+        self.node1 = tables.edge_nodes[:, 0]
+        self.node2 = tables.edge_nodes[:, 1]
+        self.is_first_edge = tables.first_edge == np.arange(tables.num_edges)
+        self.tourist_values = np.array(TOURIST_SCORES)
+        self.location_onehot = (
+            tables.location[:, None] == np.arange(tables.num_locations)
+        ).astype(np.int32)
+        self.reset_boards()
+
+    def reset_boards(self):
+        k, tables = self.num_players, self.tables
+        self.blocked = np.zeros((k, tables.num_edges), dtype=bool)
+        # the color number (from 1 in COLORS order) that claimed each edge, 0 for none
+        self.owner = np.zeros((k, tables.num_edges), dtype=np.int8)
+        # the order each node joined each color track, -1 for nodes that aren't on it
+        self.track_position = np.full(
+            (k, len(COLORS), tables.num_nodes), -1, dtype=np.int16
+        )
+        self.track_size = np.zeros((k, len(COLORS)), dtype=np.int16)
+        self.curr_node = np.full(k, -1, dtype=np.int32)
+        self.swap = np.zeros(k, dtype=bool)
+        # players that already used the current card
+        self.played = np.zeros(k, dtype=bool)
+
+    @property
+    def color(self):
+        return self.dealer.graph.curr_color
+
+    # like in LondonSystem the card stays current until another card is drawn
+    @property
+    def curr_card(self):
+        return self.dealer.curr_card
+
+    def start_game(self, color=None):
+        self.dealer.start_game(color)
+        self.reset_boards()
+        self.start_color()
+
+    def start_color(self):
+        self.curr_node[:] = self.tables.start[COLORS.index(self.color)]
+
+    def next_color(self, color=None):
+        color = self.dealer.next_color(color)
+        if color is not None:
+            self.start_color()
+        return color
+
+    def draw_card(self, card=None):
+        first_draw = self.dealer.graph.curr_color is None
+        card = self.dealer.draw_card(card)
+        if first_draw and self.dealer.graph.curr_color is not None:
+            self.start_color()
+        if self.color is not None and self.curr_node[0] >= 0:
+            # the start node is the first node on every color track
+            c = COLORS.index(self.color)
+            empty = self.track_size[:, c] == 0
+            self.track_position[empty, c, self.curr_node[empty]] = 0
+            self.track_size[empty, c] = 1
+        if card is not None:
+            self.played[:] = False
+            if card.type == CardType.RAILROAD:
+                self.swap[:] = True
+        return card
+
+    def type_matches(self, card):
+        node_type = self.tables.node_type
+        if card.type == CardType.RANDOM:
+            return np.ones(len(node_type), dtype=bool)
+        return (node_type == card.type.value) | (node_type == CardType.RANDOM.value)
+
+    def legal_masks(self, card=None):
+        # one row per player, true for the edges a legal action claims
+        current = card is None
+        card = card if card is not None else self.curr_card
+        if card is None or self.color is None:
+            return np.zeros_like(self.blocked)
+        matches = self.type_matches(card)
+        open_edges = ~self.blocked & self.is_first_edge
+        # moves from the current node
+        masks = (self.node1 == self.curr_node[:, None]) & matches[self.node2]
+        masks |= (self.node2 == self.curr_node[:, None]) & matches[self.node1]
+        if card.type != CardType.RAILROAD and self.swap.any():
+            # after a railroad card the move can start anywhere on the track
+            on_track = self.track_position[:, COLORS.index(self.color)] >= 0
+            swap_masks = on_track[:, self.node1] & matches[self.node2]
+            swap_masks |= on_track[:, self.node2] & matches[self.node1]
+            masks = np.where(self.swap[:, None], swap_masks, masks)
+        masks &= open_edges
+        if current:
+            masks &= ~self.played[:, None]
+        return masks
+
+    def legal_actions(self, player, card=None, masks=None):
+        # the (edge index, from node index, to node index) actions of one player, in LondonSystem order.
+        # masks from legal_masks can be passed in so they aren't worked out again for every player.
+        if card is None and self.played[player]:
+            return []
+        card = card if card is not None else self.curr_card
+        if card is None or self.color is None:
+            return []
+        if masks is None:
+            masks = self.legal_masks(card)
+        edges = np.flatnonzero(masks[player])
+        matches = self.type_matches(card)
+        if card.type != CardType.RAILROAD and self.swap[player]:
+            position = self.track_position[player, COLORS.index(self.color)]
+            moves = []
+            for e, a, b in zip(
+                edges.tolist(), self.node1[edges].tolist(), self.node2[edges].tolist()
+            ):
+                if position[a] >= 0 and matches[b]:
+                    moves.append((position[a], e, a, b))
+                if a != b and position[b] >= 0 and matches[a]:
+                    moves.append((position[b], e, b, a))
+            moves.sort()
+            return [(e, a, b) for _, e, a, b in moves]
+        curr = int(self.curr_node[player])
+        return [
+            (e, curr, b if a == curr else a)
+            for e, a, b in zip(
+                edges.tolist(), self.node1[edges].tolist(), self.node2[edges].tolist()
+            )
+        ]
+
+    def apply_actions(self, actions):
+        # actions has one entry per player, an action from legal_actions or None to skip the card
+        players = [k for k, action in enumerate(actions) if action is not None]
+        if not players:
+            return
+        if self.curr_card is None:
+            raise ValueError("There is no card to play")
+        players = np.array(players)
+        chosen = np.array([actions[k] for k in players], dtype=np.int64).reshape(-1, 3)
+        edges, sources, targets = chosen.T
+        c = COLORS.index(self.color)
+        legal = self.legal_masks()[players, edges]
+        legal &= self.type_matches(self.curr_card)[targets]
+        legal &= np.where(
+            self.swap[players] & (self.curr_card.type != CardType.RAILROAD),
+            self.track_position[players, c, sources] >= 0,
+            self.curr_node[players] == sources,
+        )
+        legal &= ((self.node1[edges] == sources) & (self.node2[edges] == targets)) | (
+            (self.node2[edges] == sources) & (self.node1[edges] == targets)
+        )
+        if not legal.all():
+            bad = int(players[np.argmin(legal)])
+            raise ValueError(
+                f"Action {actions[bad]} is not legal for player {bad} and the current card"
+            )
+
+        # the card after a railroad card uses up the swap
+        if self.curr_card.type != CardType.RAILROAD:
+            self.swap[players] = False
+        # claim the edge and block it and every edge it crosses
+        self.blocked[players, edges] = True
+        self.owner[players, edges] = c + 1
+        begin = self.tables.blocks_indptr[edges]
+        counts = self.tables.blocks_indptr[edges + 1] - begin
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        crossed = self.tables.blocks_indices[np.repeat(begin, counts) + offsets]
+        self.blocked[np.repeat(players, counts), self.tables.first_edge[crossed]] = True
+        # extend the tracks
+        new = self.track_position[players, c, targets] < 0
+        self.track_position[players[new], c, targets[new]] = self.track_size[
+            players[new], c
+        ]
+        self.track_size[players[new], c] += 1
+        self.curr_node[players] = targets
+        self.played[players] = True
+
+    def score_breakdown(self):
+        # calculate_score for every player at once, as arrays with one entry per player
+        tables = self.tables
+        on_track = self.track_position >= 0
+        # nodes per color and area
+        areas = on_track.astype(np.int32) @ self.location_onehot
+        river = np.zeros((self.num_players, len(COLORS) + 1), dtype=np.int64)
+        players, edges = np.nonzero(self.owner[:, tables.crosses_river])
+        np.add.at(
+            river, (players, self.owner[:, tables.crosses_river][players, edges]), 1
+        )
+        river = river[:, 1:]
+        color_scores = (areas > 0).sum(axis=2) * areas.max(axis=2) + 2 * river
+        breakdown = {color: color_scores[:, c] for c, color in enumerate(COLORS)}
+        num_colors = on_track.sum(axis=1)
+        for key, n in [("bi-color", 2), ("tri-color", 3), ("quad-color", 4)]:
+            breakdown[key] = (num_colors == n).sum(axis=1) * MULTI_COLOR_SCORES[n]
+        tourists = (on_track & tables.tourist).sum(axis=(1, 2))
+        breakdown["tourist"] = self.tourist_values[
+            np.minimum(tourists, len(TOURIST_SCORES) - 1)
+        ]
+        return breakdown
+
+    def calculate_score(self, player):
+        return {
+            key: int(values[player]) for key, values in self.score_breakdown().items()
+        }
+
+    def total_scores(self):
+        return sum(self.score_breakdown().values())
+
+    def ranking(self):
+        # 1 for the best total, players with the same total share a rank
+        totals = self.total_scores()
+        return 1 + (totals[None, :] > totals[:, None]).sum(axis=1)
+
+    def play_game(self, policies):
+        # policies has one function per player, called like the rollout policies with the player number added
+        self.start_game()
+        while True:
+            card = self.draw_card()
+            if card is None:
+                if self.next_color() is None:
+                    break
+                continue
+            masks = self.legal_masks()
+            actions = []
+            for player, policy in enumerate(policies):
+                legal = self.legal_actions(player, masks=masks)
+                actions.append(policy(self, player, legal) if legal else None)
+            self.apply_actions(actions)
+        return self.total_scores(), self.ranking()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--players", type=int, default=32, help="Number of players")
+    parser.add_argument("--games", type=int, default=20, help="Number of games")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    dealer = LondonSystem()
+    dealer.load_graph(args.custom)
+    multiplayer = MultiplayerLondonSystem(dealer, args.players)
+    policies = [random_policy] * args.players
+    wins = np.zeros(args.players, dtype=int)
+    started = time.perf_counter()
+    for _ in range(args.games):
+        totals, ranks = multiplayer.play_game(policies)
+        wins += ranks == 1
+    elapsed = time.perf_counter() - started
+    print(
+        f"Played {args.games} games with {args.players} players in {elapsed:.2f}s "
+        f"({args.games * args.players / elapsed:.0f} boards per second)"
+    )
+    print(f"Wins per player: {wins.tolist()}")
@@ -0,0 +1,277 @@
+import multiprocessing
+import queue
+import random
+import resource
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from functools import partial
+
+import numpy as np
+
+from london_system import LondonSystem
+from rollout import random_policy
+
+# episode numbers of different workers start this far apart so they never collide
+EPISODES_PER_WORKER = 2**32
+
+
+# every stage is a generator over the items of the one before it, so nothing is played, recorded or batched
+# before the consumer asks for it, and only the items in flight between stages are ever in memory. a
+# transition is a dictionary with the episode number, the observation, the action (edge index, -1 for a
+# skipped card), the reward (change in the calculate_score total) and whether it ends the game.
+def game_transitions(london_system, policy=random_policy, games=None, episode=0):
+    # plays games one after another with the policy. a transition is held back until the next one, so the
+    # last one of a game can be marked done.
+    played = 0
+    while games is None or played < games:
+        london_system.verbose = False
+        london_system.skip_dead_ends = True
+        london_system.start_game()
+        score = 0
+        pending = None
+        while True:
+            card = london_system.draw_card()
+            if card is None:
+                if london_system.next_color() is None:
+                    break
+                continue
+            actions = london_system.legal_actions()
+            if not actions:
+                continue
+            observation = london_system.observation()
+            action = policy(london_system, actions)
+            reward = 0
+            if action is not None:
+                london_system.apply_action(action)
+                total = sum(london_system.calculate_score().values())
+                reward = total - score
+                score = total
+            if pending is not None:
+                yield pending
+            pending = {
+                "episode": episode,
+                "observation": observation,
+                "action": action[0] if action is not None else -1,
+                "reward": reward,
+                "done": False,
+            }
+        if pending is not None:
+            pending["done"] = True
+            yield pending
+        episode += 1
+        played += 1
+
+
+def record(items, recorder):
+    # hands every item to the recorder, a replay buffer append or a metrics call, on its way through
+    for item in items:
+        recorder(item)
+        yield item
+
+
+def keep(items, predicate):
+    return (item for item in items if predicate(item))
+
+
+def reward_at_least(minimum, transition):
+    return transition["reward"] >= minimum
+
+
+def episodes(transitions):
+    # whole games as lists of transitions
+    episode = []
+    for transition in transitions:
+        episode.append(transition)
+        if transition["done"]:
+            yield episode
+            episode = []
+
+
+def batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stack(transition_batches):
+    # lists of transitions as dictionaries of numpy arrays, one row per transition
+    for batch in transition_batches:
+        stacked = {
+            field: np.stack([transition["observation"][field] for transition in batch])
+            for field in batch[0]["observation"]
+        }
+        for field, dtype in (
+            ("episode", np.int64),
+            ("action", np.int32),
+            ("reward", np.float32),
+            ("done", np.bool_),
+        ):
+            stacked[field] = np.fromiter(
+                (transition[field] for transition in batch), dtype, len(batch)
+            )
+        yield stacked
+
+
+def compose(items, *stages):
+    for stage in stages:
+        items = stage(items)
+    return items
+
+
+# makes the items for one producer worker: its own game on the board, played by the policy and passed
+# through the stages, which are functions of the items like partial(keep, predicate=...). it is pickled into
+# producer processes, so the policy and stages have to be picklable there.
+class GameSource:
+    def __init__(self, board, policy=random_policy, games=None, stages=(), seed=None):
+        self.board = board
+        self.policy = policy
+        self.games = games
+        self.stages = stages
+        self.seed = seed
+
+    def __call__(self, worker):
+        london_system = LondonSystem()
+        london_system.verbose = False
+        london_system.load_graph(self.board)
+        # threads share the random module, so only producer processes play the same games every run
+        if self.seed is not None:
+            random.seed(self.seed + worker)
+        transitions = game_transitions(
+            london_system, self.policy, self.games, worker * EPISODES_PER_WORKER
+        )
+        return compose(transitions, *self.stages)
+
+
+def _put(items, message, stop):
+    # blocks while the queue is full, which is what holds the producers back, but gives up once the
+    # consumer has stopped
+    while not stop.is_set():
+        try:
+            items.put(message, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(source, worker, items, stop):
+    try:
+        for item in source(worker):
+            if not _put(items, ("item", item), stop):
+                break
+    except Exception:
+        _put(items, ("error", traceback.format_exc()), stop)
+    else:
+        _put(items, ("done", worker), stop)
+    if stop.is_set() and hasattr(items, "cancel_join_thread"):
+        # a process queue would otherwise wait at exit for its unread items to be taken
+        items.cancel_join_thread()
+
+
+# runs source(worker) for every worker in threads or processes and yields their items as they arrive. the
+# queue between them holds at most max_queue items, so producers that get ahead of the consumer wait instead
+# of piling up games in memory. closing the generator stops the producers.
+def stream(source, workers=1, max_queue=1024, processes=False):
+    if processes:
+        items = multiprocessing.Queue(max_queue)
+        stop = multiprocessing.Event()
+        producers = [
+            multiprocessing.Process(
+                target=_produce, args=(source, worker, items, stop), daemon=True
+            )
+            for worker in range(workers)
+        ]
+    else:
+        items = queue.Queue(max_queue)
+        stop = threading.Event()
+        producers = [
+            threading.Thread(
+                target=_produce, args=(source, worker, items, stop), daemon=True
+            )
+            for worker in range(workers)
+        ]
+    for producer in producers:
+        producer.start()
+    running = workers
+    try:
+        while running:
+            kind, payload = items.get()
+            if kind == "item":
+                yield payload
+            elif kind == "done":
+                running -= 1
+            else:
+                raise RuntimeError(f"Producer failed:\n{payload}")
+    finally:
+        stop.set()
+        for producer in producers:
+            producer.join(timeout=1)
+            if processes and producer.is_alive():
+                producer.terminate()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Producer workers")
+    parser.add_argument(
+        "--processes", action="store_true", help="Produce in processes, not threads"
+    )
+    parser.add_argument("--max-queue", type=int, default=1024, help="Queue size")
+    parser.add_argument(
+        "--batch-size", type=int, default=256, help="Transitions per batch"
+    )
+    parser.add_argument("--batches", type=int, default=200, help="Batches to train on")
+    parser.add_argument(
+        "--train-time",
+        type=float,
+        default=0.0,
+        help="Seconds per simulated training step",
+    )
+    parser.add_argument(
+        "--min-reward",
+        type=float,
+        help="Only keep transitions with at least this reward",
+    )
+    args = parser.parse_args()
+
+    stages = []
+    if args.min_reward is not None:
+        stages.append(
+            partial(keep, predicate=partial(reward_at_least, args.min_reward))
+        )
+    source = GameSource(args.custom, stages=stages, seed=0)
+    trainer_batches = compose(
+        stream(source, args.workers, args.max_queue, args.processes),
+        partial(batches, batch_size=args.batch_size),
+        stack,
+    )
+    waiting = 0.0
+    transitions = 0
+    episodes_done = 0
+    started = time.perf_counter()
+    for step in range(args.batches):
+        waited = time.perf_counter()
+        batch = next(trainer_batches)
+        waiting += time.perf_counter() - waited
+        transitions += len(batch["action"])
+        episodes_done += int(batch["done"].sum())
+        time.sleep(args.train_time)
+    elapsed = time.perf_counter() - started
+    trainer_batches.close()
+    print(
+        f"{transitions} transitions, {episodes_done} games in {elapsed:.2f}s: "
+        f"{transitions / elapsed:.0f} transitions/s, trainer waited {100 * waiting / elapsed:.1f}% of the time"
+    )
+    print(
+        f"Peak memory {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MB"
+    )
@@ -0,0 +1,231 @@
+import asyncio
+import copy
+import queue
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+
+from london_system import LondonSystem
+from rollout import run_episode
+
+# the observation fields that are fed to the model, in order
+MODEL_FIELDS = ["edge_owner", "blocked", "legal"]
+
+
+def flatten_observation(observation):
+    parts = [np.asarray(observation[field], dtype=np.float32) for field in MODEL_FIELDS]
+    parts.append(
+        np.array(
+            [observation["curr_node"], observation["card"], observation["color"]],
+            dtype=np.float32,
+        )
+    )
+    return np.concatenate(parts)
+
+
+class NumpyPolicy:
+    # a stand-in for a learned model: one random linear layer from a flat observation to a logit per edge
+    def __init__(self, num_edges, seed=0):
+        rng = np.random.default_rng(seed)
+        num_inputs = len(MODEL_FIELDS) * num_edges + 3
+        self.weights = rng.standard_normal((num_inputs, num_edges)).astype(np.float32)
+
+    def __call__(self, observations):
+        return observations @ self.weights
+
+
+def resolve(set_outcome, value):
+    # a future that is already done must not stop the serve thread, every later request would wait on it forever
+    try:
+        set_outcome(value)
+    except InvalidStateError:
+        pass
+
+
+class BatchedPolicyServer:
+    # collects single observations from many games into batches and calls one batched policy function for them.
+    # a batch is sent when it is full or when the oldest request has waited max_latency seconds.
+    def __init__(self, policy_fn, max_batch_size=64, max_latency=0.002):
+        self.policy_fn = policy_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.batch_sizes = deque(maxlen=10000)
+        self.queue_latencies = deque(maxlen=10000)
+        self.inference_times = deque(maxlen=10000)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        # taken under the lock so no request can be queued after serve has seen running go false
+        with self.lock:
+            self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, observation):
+        future = Future()
+        with self.lock:
+            # nothing would ever take the request off the queue
+            if not self.running:
+                raise RuntimeError("The policy server is not running")
+            self.requests.put((time.perf_counter(), observation, future))
+        return future
+
+    def __call__(self, observation):
+        return self.submit(observation).result()
+
+    async def infer(self, observation):
+        return await asyncio.wrap_future(self.submit(observation))
+
+    def next_batch(self):
+        try:
+            first = self.requests.get(timeout=0.05)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[0] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self.requests.get(timeout=remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def serve(self):
+        while self.running or not self.requests.empty():
+            # requests cancelled by their caller, for example on a timeout, are dropped. the rest can't be
+            # cancelled any more once they are running.
+            batch = [
+                request
+                for request in self.next_batch()
+                if request[2].set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            futures = [future for _, _, future in batch]
+            try:
+                results = self.policy_fn(np.stack([obs for _, obs, _ in batch]))
+                # a short result would leave the requests past its end waiting forever
+                if len(results) != len(batch):
+                    raise ValueError(
+                        f"policy_fn returned {len(results)} results for a batch of {len(batch)}"
+                    )
+            except Exception as error:
+                for future in futures:
+                    resolve(future.set_exception, error)
+                continue
+            finished = time.perf_counter()
+            for future, result in zip(futures, results):
+                resolve(future.set_result, result)
+            with self.lock:
+                self.num_requests += len(batch)
+                self.num_batches += 1
+                self.batch_sizes.append(len(batch))
+                self.queue_latencies.extend(
+                    started - submitted for submitted, _, _ in batch
+                )
+                self.inference_times.append(finished - started)
+
+    def metrics(self):
+        with self.lock:
+            batch_sizes = np.array(self.batch_sizes, dtype=float)
+            queue_latencies = np.array(self.queue_latencies, dtype=float)
+            inference_times = np.array(self.inference_times, dtype=float)
+            num_requests = self.num_requests
+            num_batches = self.num_batches
+        if num_batches == 0:
+            return {"requests": 0, "batches": 0}
+        return {
+            "requests": num_requests,
+            "batches": num_batches,
+            "mean_batch_size": batch_sizes.mean(),
+            "batch_fill": batch_sizes.mean() / self.max_batch_size,
+            "queue_latency_p50": np.percentile(queue_latencies, 50),
+            "queue_latency_p95": np.percentile(queue_latencies, 95),
+            "queue_latency_p99": np.percentile(queue_latencies, 99),
+            "inference_time_mean": inference_times.mean(),
+        }
+
+
+class ServerPolicy:
+    # a rollout policy that asks the server for edge logits and plays the legal action with the highest one
+    def __init__(self, server):
+        self.server = server
+
+    def __call__(self, london_system, actions):
+        logits = self.server(flatten_observation(london_system.observation()))
+        return max(actions, key=lambda action: logits[action[0]])
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--games", type=int, default=256, help="Number of games")
+    parser.add_argument(
+        "--threads", type=int, default=64, help="Number of game threads"
+    )
+    parser.add_argument("--batch-size", type=int, default=64, help="Maximum batch size")
+    parser.add_argument(
+        "--max-latency", type=float, default=0.002, help="Seconds to wait for a batch"
+    )
+    args = parser.parse_args()
+
+    template = LondonSystem()
+    template.load_graph(args.custom)
+    model = NumpyPolicy(len(template.graph.edges))
+    games_left = iter(range(args.games))
+    games_lock = threading.Lock()
+    totals = []
+
+    with BatchedPolicyServer(model, args.batch_size, args.max_latency) as server:
+        policy = ServerPolicy(server)
+
+        def play():
+            while True:
+                with games_lock:
+                    if next(games_left, None) is None:
+                        return
+                scores = run_episode(copy.deepcopy(template), policy)
+                totals.append(sum(scores.values()))
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=play) for _ in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    print(
+        f"Played {len(totals)} games in {elapsed:.2f}s, mean score {np.mean(totals):.2f}"
+    )
+    for name, value in server.metrics().items():
+        print(f"{name}: {value}")
@@ -0,0 +1,276 @@
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board_geometry import BOUNDARIES, DEFAULT_RIVER, to_board
+from graph import CardType
+from london_system import COLORS, LondonSystem
+
+# rgb values of the matplotlib colors the gui uses, indexed by the color numbers of LondonSystem.observation
+PALETTE = np.array(
+    [[0, 0, 0], [255, 0, 0], [0, 0, 255], [0, 128, 0], [128, 0, 128]], dtype=np.uint8
+)
+BACKGROUND = (255, 255, 255)
+EDGE_COLOR = (200, 200, 200)
+RIVER_COLOR = (0, 0, 255)
+HIGHLIGHT_COLOR = (255, 0, 0)
+
+# the corners of the node glyphs, on a unit radius
+GLYPH_CORNERS = {
+    CardType.TRIANGLE: [
+        (np.cos(a), np.sin(a)) for a in np.pi / 2 + np.arange(3) * 2 * np.pi / 3
+    ],
+    CardType.SQUARE: [(-0.8, -0.8), (0.8, -0.8), (0.8, 0.8), (-0.8, 0.8)],
+    CardType.PENTAGON: [
+        (np.cos(a), np.sin(a)) for a in np.pi / 2 + np.arange(5) * 2 * np.pi / 5
+    ],
+}
+
+
+def glyph_mask(card_type, radius, filled):
+    # a boolean sprite for a node type, centred in a (2 * radius + 1) square. y points up like on the board.
+    offsets = np.arange(-radius, radius + 1)
+    x, y = np.meshgrid(offsets, -offsets)
+
+    def inside(r):
+        if card_type == CardType.CIRCLE:
+            return x**2 + y**2 <= r**2
+        if card_type in GLYPH_CORNERS:
+            corners = np.array(GLYPH_CORNERS[card_type]) * r
+            mask = np.ones_like(x, dtype=bool)
+            # the corners go counter clockwise, so the inside is to the left of every side
+            for (x1, y1), (x2, y2) in zip(corners, np.roll(corners, -1, axis=0)):
+                mask &= (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1) >= -0.5
+            return mask
+        # RANDOM nodes are drawn as a question mark in the gui, here they are a cross
+        return (np.abs(x) <= max(r // 4, 0)) | (np.abs(y) <= max(r // 4, 0))
+
+    mask = inside(radius)
+    if not filled and card_type != CardType.RANDOM and radius > 2:
+        mask &= ~inside(radius - 1.5)
+    return mask
+
+
+def line_pixels(starts, ends, shape, width=1):
+    # flat pixel indices covered by every segment, as a compressed sparse row: segment i covers
+    # pixels[indptr[i]:indptr[i + 1]]
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    height, width_px = shape
+    lengths = np.ceil(2 * np.hypot(*(ends - starts).T)).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    step = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    t = step / np.maximum(lengths[segment] - 1, 1)
+    points = starts[segment] + (ends - starts)[segment] * t[:, None]
+    rows = []
+    segments = []
+    for dx in range(width):
+        for dy in range(width):
+            col = np.round(points[:, 0]).astype(np.int64) + dx - width // 2
+            row = np.round(points[:, 1]).astype(np.int64) + dy - width // 2
+            keep = (col >= 0) & (col < width_px) & (row >= 0) & (row < height)
+            rows.append(row[keep] * width_px + col[keep])
+            segments.append(segment[keep])
+    pixels = np.concatenate(rows)
+    segment = np.concatenate(segments)
+    # every pixel once per segment, grouped by segment
+    unique = np.unique(segment * (height * width_px) + pixels)
+    segment, pixels = np.divmod(unique, height * width_px)
+    indptr = np.zeros(len(starts) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(segment, minlength=len(starts)))
+    return indptr, pixels
+
+
+def gather(indptr, pixels, rows):
+    # the pixels of the given rows of a compressed sparse row table, and which of the rows each one came from
+    begin = indptr[rows]
+    counts = indptr[np.asarray(rows) + 1] - begin
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return pixels[np.repeat(begin, counts) + offsets], np.repeat(
+        np.arange(len(counts)), counts
+    )
+
+
+# draws board states into uint8 rgb arrays without matplotlib. everything that never changes (boundaries, river,
+# unclaimed edges, node glyphs) is drawn once, and the pixels of every edge and every highlight box are kept so a
+# state is the static image with those pixels colored in.
+class BoardRasterizer:
+    def __init__(self, graph, size=256):
+        self.graph = graph
+        self.size = size
+        self.shape = (size, size)
+        graph.ensure_index()
+        self.low, self.high = to_board([-1, 10], graph.scale)
+        self.pixels_per_unit = size / (self.high - self.low)
+
+        self.coords = self.to_pixels([node.xy for node in graph.nodes])
+        edge_starts = self.to_pixels([edge.node1.xy for edge in graph.edges])
+        edge_ends = self.to_pixels([edge.node2.xy for edge in graph.edges])
+        line_width = max(1, round(self.pixels_per_unit / 40))
+        self.edge_indptr, self.edge_pixels = line_pixels(
+            edge_starts, edge_ends, self.shape, line_width
+        )
+
+        # the box update_highlights draws around a node
+        corners = np.array([(-0.2, 0.22), (0.2, 0.22), (0.2, -0.22), (-0.2, -0.22)])
+        box_starts = []
+        box_ends = []
+        for xy in np.array([node.xy for node in graph.nodes], dtype=float).reshape(
+            -1, 2
+        ):
+            box = self.to_pixels(xy + corners)
+            box_starts.append(box)
+            box_ends.append(np.roll(box, -1, axis=0))
+        self.box_indptr, self.box_pixels = line_pixels(
+            np.concatenate(box_starts) if box_starts else [],
+            np.concatenate(box_ends) if box_ends else [],
+            self.shape,
+        )
+        # four sides per node
+        self.box_indptr = self.box_indptr[::4]
+
+        self.static = self.draw_static()
+
+    def to_pixels(self, xy):
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        return np.column_stack(
+            [
+                (xy[:, 0] - self.low) * self.pixels_per_unit,
+                (self.high - xy[:, 1]) * self.pixels_per_unit,
+            ]
+        )
+
+    def draw_lines(self, image, starts, ends, color):
+        _, pixels = line_pixels(starts, ends, self.shape)
+        image.reshape(-1, 3)[pixels] = color
+
+    def draw_static(self):
+        image = np.empty((self.size, self.size, 3), dtype=np.uint8)
+        image[:] = BACKGROUND
+        image.reshape(-1, 3)[self.edge_pixels] = EDGE_COLOR
+
+        boundaries = [
+            self.to_pixels(
+                np.column_stack(
+                    [to_board(x, self.graph.scale), to_board(y, self.graph.scale)]
+                )
+            )
+            for x, y in BOUNDARIES
+        ]
+        self.draw_lines(
+            image,
+            [line[0] for line in boundaries],
+            [line[1] for line in boundaries],
+            (0, 0, 0),
+        )
+        river = self.to_pixels(
+            self.graph.river if self.graph.river is not None else DEFAULT_RIVER
+        )
+        self.draw_lines(image, river[:-1], river[1:], RIVER_COLOR)
+
+        # node glyphs like node_icon, filled for tourist and start nodes and in the track color for start nodes
+        radius = max(1, round(0.2 * self.pixels_per_unit))
+        sprites = {}
+        for node, (x, y) in zip(self.graph.nodes, self.coords):
+            filled = bool(node.tourist or node.start)
+            key = (node.type, filled)
+            if key not in sprites:
+                rows, cols = np.nonzero(glyph_mask(node.type, radius, filled))
+                sprites[key] = (rows - radius, cols - radius)
+            rows, cols = sprites[key]
+            rows = rows + int(round(y))
+            cols = cols + int(round(x))
+            keep = (rows >= 0) & (rows < self.size) & (cols >= 0) & (cols < self.size)
+            color = (0, 0, 0)
+            if node.start and node.color in COLORS:
+                color = PALETTE[COLORS.index(node.color) + 1]
+            image[rows[keep], cols[keep]] = color
+        return image
+
+    def render_batch(self, edge_owner, highlighted=None, out=None):
+        # edge_owner is (states, edges) color numbers like observation()["edge_owner"] and highlighted is
+        # (states, nodes) booleans. returns a (states, size, size, 3) uint8 array.
+        edge_owner = np.asarray(edge_owner).reshape(-1, len(self.graph.edges))
+        num_states = len(edge_owner)
+        if out is None:
+            out = np.empty((num_states, self.size, self.size, 3), dtype=np.uint8)
+        out[:] = self.static
+        flat = out.reshape(-1, 3)
+        image_size = self.size * self.size
+
+        states, edges = np.nonzero(edge_owner)
+        pixels, which = gather(self.edge_indptr, self.edge_pixels, edges)
+        flat[states[which] * image_size + pixels] = PALETTE[
+            edge_owner[states, edges][which]
+        ]
+
+        if highlighted is not None:
+            highlighted = np.asarray(highlighted, dtype=bool).reshape(num_states, -1)
+            states, nodes = np.nonzero(highlighted)
+            pixels, which = gather(self.box_indptr, self.box_pixels, nodes)
+            flat[states[which] * image_size + pixels] = HIGHLIGHT_COLOR
+        return out
+
+    def render(self, edge_owner, highlighted=None):
+        highlighted = None if highlighted is None else [highlighted]
+        return self.render_batch([edge_owner], highlighted)[0]
+
+    def render_game(self, london_system):
+        return self.render(
+            london_system.observation()["edge_owner"],
+            node_highlights(london_system.graph),
+        )
+
+
+def node_highlights(graph):
+    graph.ensure_index()
+    return np.array([node.highlighted for node in graph.nodes], dtype=bool)
+
+
+if __name__ == "__main__":
+    import random
+
+    from rollout import run_episode
+
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--size", type=int, default=128, help="Image width and height")
+    parser.add_argument("--frames", type=int, default=4096, help="Frames to render")
+    parser.add_argument("--batch-size", type=int, default=256, help="Frames per batch")
+    parser.add_argument("--output", "-o", help="Save the last frame as a png")
+    args = parser.parse_args()
+
+    london_system = LondonSystem()
+    london_system.load_graph(args.custom)
+    started = time.perf_counter()
+    rasterizer = BoardRasterizer(london_system.graph, args.size)
+    print(f"Static layers drawn in {1000 * (time.perf_counter() - started):.1f}ms")
+
+    # states from finished random games, so the frames have realistic numbers of claimed edges
+    random.seed(0)
+    owners = []
+    highlights = []
+    for _ in range(16):
+        run_episode(london_system)
+        owners.append(london_system.observation()["edge_owner"])
+        highlights.append(node_highlights(london_system.graph))
+    owners = np.array(owners)
+    highlights = np.array(highlights)
+
+    out = np.empty((args.batch_size, args.size, args.size, 3), dtype=np.uint8)
+    picks = np.arange(args.batch_size) % len(owners)
+    started = time.perf_counter()
+    for _ in range(args.frames // args.batch_size):
+        rasterizer.render_batch(owners[picks], highlights[picks], out)
+    elapsed = time.perf_counter() - started
+    frames = args.frames // args.batch_size * args.batch_size
+    print(
+        f"Rendered {frames} frames of {args.size}x{args.size} at {frames / elapsed:.0f} fps"
+    )
+    if args.output:
+        import matplotlib.pyplot as plt
+
+        plt.imsave(args.output, rasterizer.render_game(london_system))
@@ -0,0 +1,332 @@
+import multiprocessing
+import queue
+import time
+from argparse import ArgumentParser
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from london_system import LondonSystem
+from pipeline import game_transitions
+from rollout import random_policy
+
+# columns start on cache lines, so writers filling neighbouring rows of different columns don't share one
+ALIGNMENT = 64
+
+
+def transition_columns(num_edges):
+    # (name, dtype, shape of one row) for every column: the fields of LondonSystem.observation, then the
+    # action (edge index, -1 for a skipped card), the reward (change in the calculate_score total), the done
+    # flag, the sampling priority and the stamp that tells readers a row is complete
+    return [
+        ("edge_owner", np.int8, (num_edges,)),
+        ("blocked", np.bool_, (num_edges,)),
+        ("curr_node", np.int32, ()),
+        ("card", np.int8, ()),
+        ("card_red", np.bool_, ()),
+        ("color", np.int8, ()),
+        ("swap", np.bool_, ()),
+        ("red_cards_played", np.int8, ()),
+        ("legal", np.bool_, (num_edges,)),
+        ("action", np.int32, ()),
+        ("reward", np.float32, ()),
+        ("done", np.bool_, ()),
+        ("priority", np.float64, ()),
+        ("stamp", np.int64, ()),
+    ]
+
+
+OBSERVATION_FIELDS = [name for name, _, _ in transition_columns(0)[:9]]
+BATCH_FIELDS = [name for name, _, _ in transition_columns(0)[:12]]
+
+
+def _attach(name, num_edges, capacity, num_writers):
+    return ReplayBuffer(num_edges, capacity, num_writers, name=name)
+
+
+# a fixed size replay buffer in one shared memory block, one numpy column per field. the buffer is split into
+# one part per writer, and every writer only ever moves its own cursor and fills its own part, oldest row
+# first, so rollout processes append without any locks. passing the buffer to another process attaches to the
+# same memory instead of copying it.
+#
+# rows are read while writers may be overwriting them. a writer sets the row stamp to -1 before writing it and
+# to the row's append number after, and sample only keeps rows whose stamp was the same before and after they
+# were copied out.
+class ReplayBuffer:
+    def __init__(self, num_edges, capacity, num_writers=1, name=None):
+        self.num_edges = num_edges
+        self.num_writers = num_writers
+        self.part_size = capacity // num_writers
+        self.capacity = self.part_size * num_writers
+        columns = transition_columns(num_edges)
+        # the header has a cursor per writer (rows appended so far) and the largest priority
+        offsets = {}
+        size = (num_writers + 1) * 8
+        for column, dtype, shape in columns:
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            offsets[column] = size
+            size += (
+                self.capacity
+                * int(np.prod(shape, dtype=int))
+                * np.dtype(dtype).itemsize
+            )
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        if not self.owner:
+            # only the process that created the block removes it, the resource tracker would unlink it as
+            # soon as any attached process exits
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        self.cursors = np.ndarray((num_writers,), np.int64, self.shm.buf, 0)
+        self.max_priority = np.ndarray((1,), np.float64, self.shm.buf, num_writers * 8)
+        self.columns = {
+            column: np.ndarray(
+                (self.capacity,) + shape, dtype, self.shm.buf, offsets[column]
+            )
+            for column, dtype, shape in columns
+        }
+        if self.owner:
+            self.cursors[:] = 0
+            self.max_priority[0] = 1.0
+            self.columns["stamp"][:] = 0
+
+    def __reduce__(self):
+        return _attach, (self.name, self.num_edges, self.capacity, self.num_writers)
+
+    def __len__(self):
+        return int(np.minimum(self.cursors, self.part_size).sum())
+
+    def close(self):
+        # the numpy views keep the memory mapped, they have to go first
+        self.columns = {}
+        self.cursors = None
+        self.max_priority = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def append(self, writer, observation, action, reward, done):
+        cursor = int(self.cursors[writer])
+        row = writer * self.part_size + cursor % self.part_size
+        columns = self.columns
+        stamp = columns["stamp"]
+        stamp[row] = -1
+        for field in OBSERVATION_FIELDS:
+            columns[field][row] = observation[field]
+        columns["action"][row] = action
+        columns["reward"][row] = reward
+        columns["done"][row] = done
+        columns["priority"][row] = self.max_priority[0]
+        # the stamp is written last, so a reader that sees it sees the whole row
+        stamp[row] = cursor + 1
+        self.cursors[writer] = cursor + 1
+        return row
+
+    def filled_rows(self):
+        filled = np.minimum(self.cursors, self.part_size)
+        return np.concatenate(
+            [
+                writer * self.part_size + np.arange(count)
+                for writer, count in enumerate(filled.tolist())
+            ]
+        )
+
+    def empty_batch(self, batch_size):
+        batch = {
+            field: np.empty(
+                (batch_size,) + self.columns[field].shape[1:], self.columns[field].dtype
+            )
+            for field in BATCH_FIELDS
+        }
+        batch["indices"] = np.empty(batch_size, dtype=np.int64)
+        batch["weights"] = np.ones(batch_size, dtype=np.float32)
+        return batch
+
+    def sample(self, batch_size, rng, prioritized=False, alpha=0.6, beta=0.4, out=None):
+        # a batch of rows, uniformly or in proportion to priority ** alpha. the columns are gathered into out
+        # (from empty_batch), which can be passed back in every time so sampling doesn't allocate. with
+        # prioritized sampling weights holds the importance sampling weights, normalized to at most 1.
+        rows = self.filled_rows()
+        if len(rows) == 0:
+            raise ValueError("The replay buffer is empty")
+        batch = out if out is not None else self.empty_batch(batch_size)
+        if prioritized:
+            probabilities = self.columns["priority"][rows] ** alpha
+            probabilities /= probabilities.sum()
+            cumulative = np.cumsum(probabilities)
+        missing = np.arange(batch_size)
+        stamp = self.columns["stamp"]
+        while len(missing):
+            if prioritized:
+                picks = np.searchsorted(
+                    cumulative, rng.random(len(missing)) * cumulative[-1]
+                )
+                picks = np.minimum(picks, len(rows) - 1)
+            else:
+                picks = rng.integers(len(rows), size=len(missing))
+            indices = rows[picks]
+            before = stamp[indices]
+            for field in BATCH_FIELDS:
+                if len(missing) == batch_size:
+                    np.take(self.columns[field], indices, axis=0, out=batch[field])
+                else:
+                    batch[field][missing] = self.columns[field][indices]
+            batch["indices"][missing] = indices
+            if prioritized:
+                batch["weights"][missing] = (len(rows) * probabilities[picks]) ** -beta
+            # rows a writer touched while they were copied are drawn again
+            complete = (before > 0) & (stamp[indices] == before)
+            missing = missing[~complete]
+        if prioritized:
+            batch["weights"] /= batch["weights"].max()
+        else:
+            batch["weights"][:] = 1.0
+        return batch
+
+    def update_priorities(self, indices, priorities):
+        priorities = np.asarray(priorities, dtype=np.float64)
+        self.columns["priority"][indices] = priorities
+        self.max_priority[0] = max(self.max_priority[0], float(priorities.max()))
+
+
+def record_game(london_system, buffer, writer, policy=random_policy):
+    # plays one game and appends its transitions, see pipeline.game_transitions
+    appended = 0
+    for transition in game_transitions(london_system, policy, games=1):
+        buffer.append(
+            writer,
+            transition["observation"],
+            transition["action"],
+            transition["reward"],
+            transition["done"],
+        )
+        appended += 1
+    return appended
+
+
+def _actor(board, buffer, writer, seconds, transitions):
+    london_system = LondonSystem()
+    london_system.load_graph(board)
+    appended = 0
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        appended += record_game(london_system, buffer, writer)
+    transitions.put(appended)
+
+
+class _QueueBuffer:
+    # the old way, for the benchmark: every transition is pickled onto a queue
+    def __init__(self, transitions):
+        self.transitions = transitions
+
+    def append(self, writer, observation, action, reward, done):
+        self.transitions.put((observation, action, reward, done))
+
+
+def _queue_actor(board, transitions, seconds, counts):
+    london_system = LondonSystem()
+    london_system.load_graph(board)
+    buffer = _QueueBuffer(transitions)
+    appended = 0
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        appended += record_game(london_system, buffer, 0)
+    counts.put(appended)
+
+
+def _learn(buffer, batch_size, seconds, prioritized, transitions=None):
+    # samples batches for the given time and updates their priorities like a learner would, taking whatever
+    # is on transitions into the buffer first
+    rng = np.random.default_rng(0)
+    batch = buffer.empty_batch(batch_size)
+    batches = 0
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        if transitions is not None:
+            try:
+                while True:
+                    buffer.append(0, *transitions.get_nowait())
+            except queue.Empty:
+                pass
+        if len(buffer) < batch_size:
+            time.sleep(0.01)
+            continue
+        buffer.sample(batch_size, rng, prioritized, out=batch)
+        if prioritized:
+            buffer.update_priorities(batch["indices"], rng.random(batch_size) + 0.1)
+        batches += 1
+    if transitions is not None:
+        # the actors can't exit while their last transitions are still in the queue
+        while any(child.is_alive() for child in multiprocessing.active_children()):
+            try:
+                transitions.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    return batches
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--custom", "-c", default="london_system_default.json", help="Custom graph file"
+    )
+    parser.add_argument("--actors", type=int, default=4, help="Rollout processes")
+    parser.add_argument(
+        "--capacity", type=int, default=100000, help="Rows in the buffer"
+    )
+    parser.add_argument("--batch-size", type=int, default=256, help="Rows per batch")
+    parser.add_argument("--seconds", type=float, default=10, help="Seconds to run for")
+    parser.add_argument(
+        "--prioritized", action="store_true", help="Sample batches by priority"
+    )
+    args = parser.parse_args()
+
+    template = LondonSystem()
+    template.load_graph(args.custom)
+    num_edges = len(template.graph.edges)
+
+    # shared memory: the actors append while the learner samples batches and updates priorities
+    buffer = ReplayBuffer(num_edges, args.capacity, args.actors)
+    counts = multiprocessing.Queue()
+    actors = [
+        multiprocessing.Process(
+            target=_actor, args=(args.custom, buffer, writer, args.seconds, counts)
+        )
+        for writer in range(args.actors)
+    ]
+    for actor in actors:
+        actor.start()
+    batches = _learn(buffer, args.batch_size, args.seconds, args.prioritized)
+    appended = sum(counts.get() for _ in actors)
+    for actor in actors:
+        actor.join()
+    print(
+        f"Shared memory: {appended / args.seconds:.0f} transitions/s appended by {args.actors} actors, "
+        f"{batches / args.seconds:.0f} batches/s sampled"
+    )
+    buffer.close()
+
+    # pickled queue: the same actors put every transition on a queue, and the learner has to unpickle them
+    # and copy them into its own buffer before it can sample
+    buffer = ReplayBuffer(num_edges, args.capacity)
+    transitions = multiprocessing.Queue(maxsize=10000)
+    counts = multiprocessing.Queue()
+    actors = [
+        multiprocessing.Process(
+            target=_queue_actor, args=(args.custom, transitions, args.seconds, counts)
+        )
+        for _ in range(args.actors)
+    ]
+    for actor in actors:
+        actor.start()
+    batches = _learn(
+        buffer, args.batch_size, args.seconds, args.prioritized, transitions
+    )
+    appended = sum(counts.get() for _ in actors)
+    for actor in actors:
+        actor.join()
+    print(
+        f"Pickled queue: {appended / args.seconds:.0f} transitions/s appended by {args.actors} actors, "
+        f"{batches / args.seconds:.0f} batches/s sampled"
+    )
+    buffer.close()
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from argparse import ArgumentParser
+
+SCHEMA = """
+create table if not exists results (
+    board text not null,
+    state text not null,
+    kind text not null,
+    value real,
+    move text,
+    used real not null,
+    primary key (board, state, kind)
+) without rowid;
+create index if not exists results_used on results (used);
+"""
+
+
+def graph_hash(graph):
+    # the content hash of a board in memory, from what save_graph would write without the blocked flags, which
+    # belong to the game being played. boards loaded from a file can use board_registry.content_hash of the file
+    # instead, the two never need to agree.
+    edges = []
+    for edge in graph.edges:
+        data = edge.to_dict()
+        del data["blocked"]
+        edges.append(data)
+    data = {
+        "nodes": [node.to_dict() for node in graph.nodes],
+        "edges": edges,
+        "river": graph.river,
+        "scale": graph.scale,
+    }
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+# results of expensive evaluations (exact searches, solvers) kept on disk by board hash, LondonSystem.state_key
+# and the kind of result, with the value and the best move as json. the database is in sqlite's write ahead log
+# mode, so any number of processes can read it while one writes. writes and the times of hits are kept in memory
+# and written batch_size at a time in one transaction, and when there are more than max_entries results the least recently
+# used are deleted. a cache passed to another process opens its own connection there.
+class ResultCache:
+    def __init__(self, filename, max_entries=1000000, batch_size=1000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.connection = None
+        self.pid = None
+        # (board, state, kind) -> (value, move json, time) waiting to be written, and the times of hits
+        self.pending = {}
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["connection"] = None
+        state["pid"] = None
+        state["pending"] = {}
+        state["touched"] = {}
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        self.flush()
+        return self.connect().execute("select count(*) from results").fetchone()[0]
+
+    def connect(self):
+        # sqlite connections can't be shared with a forked child, so a child opens its own
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.filename, timeout=60)
+            self.pid = os.getpid()
+            self.connection.execute("pragma journal_mode=wal")
+            self.connection.execute("pragma synchronous=normal")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def get(self, board, state, kind):
+        # (value, move) or None
+        key = (board, state, kind)
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = (
+                self.connect()
+                .execute(
+                    "select value, move from results where board = ? and state = ? and kind = ?",
+                    key,
+                )
+                .fetchone()
+            )
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched[key] = time.time()
+        # a run that only reads has to keep the recency of its hits too
+        if len(self.touched) >= self.batch_size:
+            self.flush()
+        value, move = entry[:2]
+        return value, json.loads(move) if move is not None else None
+
+    def put(self, board, state, kind, value, move=None):
+        self.pending[(board, state, kind)] = (
+            value,
+            json.dumps(move) if move is not None else None,
+            time.time(),
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending and not self.touched:
+            return
+        connection = self.connect()
+        with connection:
+            connection.executemany(
+                "insert or replace into results values (?, ?, ?, ?, ?, ?)",
+                [key + entry for key, entry in self.pending.items()],
+            )
+            connection.executemany(
+                "update results set used = ? where board = ? and state = ? and kind = ?",
+                [(used,) + key for key, used in self.touched.items()],
+            )
+            self.writes += len(self.pending)
+            self.pending = {}
+            self.touched = {}
+            self.evict(connection)
+
+    def evict(self, connection):
+        count = connection.execute("select count(*) from results").fetchone()[0]
+        if count > self.max_entries:
+            connection.execute(
+                "delete from results where used <= (select used from results order by used limit 1 offset ?)",
+                (count - self.max_entries - 1,),
+            )
+
+    def clear(self):
+        self.pending = {}
+        self.touched = {}
+        connection = self.connect()
+        with connection:
+            connection.execute("delete from results")
+
+    def close(self):
+        if self.connection is not None and self.pid == os.getpid():
+            self.flush()
+            self.connection.close()
+        self.connection = None
+
+    def stats(self):
+        self.flush()
+        connection = self.connect()
+        kinds = dict(
+            connection.execute(
+                "select kind, count(*) from results group by kind"
+            ).fetchall()
+        )
+        return {
+            "entries": sum(kinds.values()),
+            "kinds": kinds,
+            "boards": connection.execute(
+                "select count(distinct board) from results"
+            ).fetchone()[0],
+            "bytes": os.path.getsize(self.filename),
+        }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("filename", help="Cache database")
+    parser.add_argument("--clear", action="store_true", help="Delete every result")
+    parser.add_argument(
+        "--max-entries", type=int, help="Evict down to this many results"
+    )
+    args = parser.parse_args()
+
+    cache = ResultCache(args.filename)
+    if args.clear:
+        cache.clear()
+    if args.max_entries is not None:
+        cache.max_entries = args.max_entries
+        connection = cache.connect()
+        with connection:
+            cache.evict(connection)
+    for name, value in cache.stats().items():
+        print(f"{name}: {value}")
+    cache.close()
@@ -0,0 +1,53 @@
+import random
+import time
+
+
+def random_policy(london_system, actions):
+    return random.choice(actions)
+
+
+# plays the action that gains the most points right away, see LondonSystem.evaluate_moves. ties are broken at
+# random.
+def greedy_policy(london_system, actions):
+    deltas = london_system.evaluate_moves().score_delta.tolist()
+    best = max(deltas)
+    return actions[
+        random.choice([i for i, delta in enumerate(deltas) if delta == best])
+    ]
+
+
+# plays one whole game without the gui. the policy is called with the game and its legal actions for every
+# card that can be played and returns one of the actions, or None to skip the card. metrics, if given, is told
+# about the game when it ends and times some of the legal_actions calls (see metrics.RolloutMetrics). colors
+# that can't make another move are skipped, their remaining cards still count as steps and dead ends.
+def run_episode(london_system, policy=random_policy, metrics=None):
+    london_system.verbose = False
+    london_system.skip_dead_ends = True
+    london_system.start_game()
+    steps = 0
+    dead_ends = 0
+    while True:
+        card = london_system.draw_card()
+        if card is None:
+            if london_system.next_color() is None:
+                break
+            continue
+        steps += 1
+        if metrics is not None and steps % metrics.sample_every == 0:
+            started = time.perf_counter()
+            actions = london_system.legal_actions()
+            metrics.observe_adjacency(time.perf_counter() - started)
+        else:
+            actions = london_system.legal_actions()
+        if actions:
+            action = policy(london_system, actions)
+            if action is not None:
+                london_system.apply_action(action)
+        else:
+            dead_ends += 1
+    steps += len(london_system.skipped_draws)
+    dead_ends += len(london_system.skipped_draws)
+    scores = london_system.calculate_score()
+    if metrics is not None:
+        metrics.record_game(scores, steps, dead_ends)
+    return scores
@@ -0,0 +1,367 @@
+import copy
+import random
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from board_tables import BoardTables, blocked_edges, track_indices
+from card import DECK
+from graph import node_key
+from hindsight_oracle import RAILROAD, HindsightOracle, bits
+from london_system import COLORS, MULTI_COLOR_SCORES, TOURIST_SCORES, LondonSystem
+from result_cache import ResultCache, graph_hash
+
+# a color round is played with an 11 card deck and every card can claim at most one edge
+DECK_SIZE = 11
+
+# points for a node by the number of color tracks it is on
+MULTI_COLOR_VALUES = np.array([MULTI_COLOR_SCORES.get(n, 0) for n in range(5)])
+
+# deck positions of the red cards and the card type at every position, for the bitset search
+RED_CARDS = sum(1 << i for i, card in enumerate(DECK) if card.color == "red")
+DECK_TYPES = [card.type.value for card in DECK]
+
+
+def remaining_moves(london_system):
+    # the most edges each color can still claim. the color being played has its undrawn cards and the
+    # current card, colors still to come have a full deck and finished colors have none.
+    graph = london_system.graph
+    moves = []
+    for color in COLORS:
+        if graph.curr_color is None or (
+            color != graph.curr_color and color in london_system.colors
+        ):
+            moves.append(DECK_SIZE)
+        elif color == graph.curr_color:
+            left = len(london_system.cards) if london_system.red_cards_played < 5 else 0
+            moves.append(left + (london_system.curr_card is not None))
+        else:
+            moves.append(0)
+    return moves
+
+
+class ScoreBound:
+    # an optimistic bound on the final calculate_score total. every color can only grow through unblocked edges,
+    # by at most one node per remaining card, so everything it can still reach is within that many steps of its
+    # track. the area, river, tourist and multi color scores are bounded from those reachable sets.
+    def __init__(self, tables):
+        self.tables = tables
+
+    def reachable(self, track, blocked, moves):
+        # depth limited search from the whole track. returns the new nodes that can be reached and the
+        # unblocked river edges that can still be claimed
+        tables = self.tables
+        distance = {node: 0 for node in track}
+        frontier = list(track)
+        river_edges = set()
+        for depth in range(1, moves + 1):
+            next_frontier = []
+            for node in frontier:
+                edges, others = tables.incident(node)
+                for edge, other in zip(edges.tolist(), others.tolist()):
+                    if blocked[edge]:
+                        continue
+                    if tables.crosses_river[edge]:
+                        river_edges.add(edge)
+                    if other not in distance:
+                        distance[other] = depth
+                        next_frontier.append(other)
+            frontier = next_frontier
+        new_nodes = [node for node, depth in distance.items() if depth > 0]
+        return new_nodes, river_edges
+
+    def area_bound(self, track, new_nodes, moves):
+        # a color scores areas times the most nodes in one area. if the fullest area gets j new nodes,
+        # only the other moves - j new nodes can open new areas
+        location = self.tables.location
+        counts = np.bincount(location[track], minlength=self.tables.num_locations)
+        available = np.bincount(
+            location[new_nodes], minlength=self.tables.num_locations
+        )
+        num_areas = int(np.count_nonzero(counts))
+        possible_areas = int(np.count_nonzero(counts + available))
+        best = 0
+        for area in np.flatnonzero(counts + available).tolist():
+            is_new = counts[area] == 0
+            for added in range(int(is_new), min(moves, available[area]) + 1):
+                areas = min(possible_areas, num_areas + is_new + moves - added)
+                best = max(best, int(counts[area] + added) * areas)
+        return best
+
+    def bound(self, tracks, river_claimed, blocked, moves):
+        tables = self.tables
+        total = 0
+        on_tracks = np.zeros(tables.num_nodes, dtype=np.int64)
+        tourists = 0
+        for track, claimed, left in zip(tracks, river_claimed, moves):
+            if left > 0:
+                new_nodes, river_edges = self.reachable(track, blocked, left)
+            else:
+                new_nodes, river_edges = [], set()
+            total += self.area_bound(track, new_nodes, left)
+            total += 2 * (claimed + min(left, len(river_edges)))
+            on_tracks[track] += 1
+            on_tracks[new_nodes] += 1
+            tourists += int(tables.tourist[track].sum())
+            tourists += min(left, int(tables.tourist[new_nodes].sum()))
+        total += int(MULTI_COLOR_VALUES[on_tracks].sum())
+        total += TOURIST_SCORES[min(tourists, len(TOURIST_SCORES) - 1)]
+        return total
+
+    def game_bound(self, london_system):
+        graph = london_system.graph
+        moves = remaining_moves(london_system)
+        tracks = []
+        river_claimed = []
+        for color, left in zip(COLORS, moves):
+            track = track_indices(graph, color)
+            # a color that hasn't started yet will start from its start node
+            start = self.tables.start[COLORS.index(color)]
+            if not track and left > 0 and start >= 0:
+                track = [int(start)]
+            tracks.append(track)
+            edges = {id(edge): edge for edge in graph.railroad_edges[color]}
+            river_claimed.append(sum(edge.crosses_river for edge in edges.values()))
+        return self.bound(tracks, river_claimed, blocked_edges(graph), moves)
+
+
+def score_upper_bound(london_system, score_bound=None):
+    if score_bound is None:
+        score_bound = ScoreBound(BoardTables(london_system.graph))
+    return score_bound.game_bound(london_system)
+
+
+def exact_max_score(london_system, cache=None):
+    # the best final score over every card and color order and every choice of moves, by exhaustive search.
+    # this is only practical near the end of a game on a small board and is used to check the bound. with a
+    # result_cache.ResultCache every position searched is stored with its value, and the best action after a
+    # draw, and positions searched before, in this run or an earlier one, are looked up instead.
+    memo = {}
+    board = graph_hash(london_system.graph) if cache is not None else None
+
+    def best_before_draw(game):
+        key = game.state_key(card=False)
+        if key in memo:
+            return memo[key]
+        if cache is not None:
+            cached = cache.get(board, key, "exact_max_score")
+            if cached is not None:
+                memo[key] = int(cached[0])
+                return memo[key]
+        if game.red_cards_played == 5 or not game.cards:
+            if not game.colors:
+                value = sum(game.calculate_score().values())
+            else:
+                value = 0
+                for color in list(game.colors):
+                    child = copy.deepcopy(game)
+                    child.next_color(color)
+                    value = max(value, best_before_draw(child))
+        else:
+            value = 0
+            seen = set()
+            for i, card in enumerate(game.cards):
+                if (card.type, card.color) in seen:
+                    continue
+                seen.add((card.type, card.color))
+                child = copy.deepcopy(game)
+                child.draw_card(child.cards[i])
+                value = max(value, best_after_draw(child))
+        memo[key] = value
+        if cache is not None:
+            cache.put(board, key, "exact_max_score", value)
+        return value
+
+    def best_after_draw(game):
+        if cache is not None:
+            key = game.state_key()
+            cached = cache.get(board, key, "exact_max_score")
+            if cached is not None:
+                return int(cached[0])
+        # the card can always be skipped
+        value = best_before_draw(copy.deepcopy(game))
+        best_action = None
+        for action in game.legal_actions():
+            child = copy.deepcopy(game)
+            child.apply_action(action)
+            child_value = best_before_draw(child)
+            if child_value > value:
+                value = child_value
+                best_action = action
+        if cache is not None:
+            cache.put(board, key, "exact_max_score", value, best_action)
+        return value
+
+    game = copy.deepcopy(london_system)
+    game.verbose = False
+    if game.curr_card is not None and game.legal_actions():
+        value = best_after_draw(game)
+    else:
+        value = best_before_draw(game)
+    if cache is not None:
+        cache.flush()
+    return value
+
+
+def last_color_max_score(london_system, oracle):
+    # exact_max_score for a game in its last color before a draw, on the hindsight_oracle bitsets. the other
+    # tracks are final, so a state is the undrawn cards, the current node, the swap, the blocked edges and the
+    # color's track and claimed edges. this is fast enough to search a whole round on a generated board.
+    graph = london_system.graph
+    if london_system.colors or graph.curr_color is None:
+        raise ValueError("the game is not in its last color")
+    graph.ensure_index()
+    color = COLORS.index(graph.curr_color)
+    tracks = [sum(1 << n for n in track_indices(graph, name)) for name in COLORS]
+    edges = [
+        sum(1 << graph.edge_ids[id(edge)] for edge in graph.railroad_edges[name])
+        for name in COLORS
+    ]
+    if not tracks[color]:
+        tracks[color] = 1 << oracle.start[color]
+    blocked = sum(1 << i for i in np.flatnonzero(blocked_edges(graph)).tolist())
+    deck = sum(1 << DECK.index(card) for card in london_system.cards)
+    curr = oracle.start[color]
+    if graph.curr_node is not None:
+        curr = graph.node_index[node_key(graph.curr_node)]
+    memo = {}
+
+    def best(deck, curr, swap, blocked, track, claimed):
+        if (RED_CARDS & ~deck).bit_count() == 5 or not deck:
+            tracks[color] = track
+            edges[color] = claimed
+            return oracle.final_score(tracks, edges)
+        # after a swap the current node no longer matters
+        key = (deck, -1 if swap else curr, swap, blocked, track, claimed)
+        value = memo.get(key)
+        if value is not None:
+            return value
+        value = 0
+        drawn = set()
+        for i in bits(deck):
+            card_type = DECK_TYPES[i]
+            red = RED_CARDS >> i & 1
+            if (card_type, red) in drawn:
+                continue
+            drawn.add((card_type, red))
+            left = deck & ~(1 << i)
+            swapped = swap or card_type == RAILROAD
+            # the card can always be skipped
+            value = max(value, best(left, curr, swapped, blocked, track, claimed))
+            sources = bits(track) if swapped and card_type != RAILROAD else (curr,)
+            for node in sources:
+                for edge, other in oracle.moves[node][card_type]:
+                    if blocked >> edge & 1:
+                        continue
+                    value = max(
+                        value,
+                        best(
+                            left,
+                            other,
+                            card_type == RAILROAD,
+                            blocked | oracle.claims[edge],
+                            track | 1 << other,
+                            claimed | 1 << edge,
+                        ),
+                    )
+        memo[key] = value
+        return value
+
+    return best(deck, curr, graph.swap, blocked, tracks[color], edges[color])
+
+
+if __name__ == "__main__":
+    from board_generator import generate_board
+
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--nodes", type=int, default=30, help="Nodes on the check board"
+    )
+    parser.add_argument("--seeds", type=int, default=10, help="Games to check")
+    parser.add_argument(
+        "--cards-left",
+        type=int,
+        default=9,
+        help="Check states in the last color with this many cards left",
+    )
+    parser.add_argument(
+        "--exact-cards-left",
+        type=int,
+        default=3,
+        help="Also check the bitset search against exact_max_score with this many cards left",
+    )
+    parser.add_argument(
+        "--cache", help="Keep exact search results in this database between runs"
+    )
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cache) if args.cache else None
+
+    checked = 0
+    cross_checked = 0
+    slack = []
+    search_time = 0.0
+    bound_time = 0.0
+    for seed in range(args.seeds):
+        london_system = LondonSystem()
+        london_system.verbose = False
+        london_system.load_graph_data(generate_board(args.nodes, seed, degree=5.0))
+        tables = BoardTables(london_system.graph)
+        score_bound = ScoreBound(tables)
+        oracle = HindsightOracle(tables)
+        random.seed(seed)
+        london_system.start_game()
+        # play randomly until the last color has only a few cards left, checking the bound at every draw from there
+        while True:
+            if not london_system.colors and len(london_system.cards) <= args.cards_left:
+                started = time.perf_counter()
+                bound = score_bound.game_bound(london_system)
+                bound_time += time.perf_counter() - started
+                started = time.perf_counter()
+                best = last_color_max_score(london_system, oracle)
+                search_time += time.perf_counter() - started
+                if len(london_system.cards) <= args.exact_cards_left:
+                    exact = exact_max_score(london_system, cache)
+                    if best != exact:
+                        raise AssertionError(
+                            f"seed {seed}: the bitset search found {best}, the exact best score is {exact}"
+                        )
+                    cross_checked += 1
+                if bound < best:
+                    raise AssertionError(
+                        f"seed {seed}: bound {bound} is below the exact best score {best}"
+                    )
+                checked += 1
+                slack.append(bound - best)
+            card = london_system.draw_card()
+            if card is None:
+                if london_system.next_color() is None:
+                    break
+                continue
+            actions = london_system.legal_actions()
+            if actions:
+                london_system.apply_action(random.choice(actions))
+
+    if cache is not None:
+        print(
+            f"Cache: {cache.hits} hits, {cache.misses} misses, {cache.stats()['entries']} entries"
+        )
+        cache.close()
+    slack = np.array(slack)
+    # a bound that is always tight on the checked states hasn't been tested on anything it could get wrong
+    if not np.any(slack > 0):
+        raise AssertionError(
+            "the bound was tight on every checked state, check bigger boards or more cards"
+        )
+    print(
+        f"Checked {checked} states, the bound was never below the exact best score "
+        f"({cross_checked} also checked against exact_max_score)"
+    )
+    print(
+        f"Mean slack {slack.mean():.2f}, max slack {slack.max()}, "
+        f"{np.count_nonzero(slack)} states with slack"
+    )
+    print(
+        f"Bound {1e6 * bound_time / checked:.0f}us per state, bitset search {search_time / checked:.3f}s per state"
+    )